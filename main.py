@@ -2,12 +2,30 @@
 import sys
 import os
 import json
+import hashlib
+import argparse
+from collections import Counter
+from datetime import datetime
 
 # Add src to path so we can import from it
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from analyzer import load_pcap, parse_packets, detect_suspicious
+from analyzer import load_pcap, parse_packets, parse_packet_batches, detect_suspicious
+from advanced_analyzer import analyze_connections, comprehensive_security_scan
+from table_detectors import scan_table
+from signature_engine import SignatureSet, scan_signatures
+from flow_export import FlowWriter, export_path
+from flow_table import IDLE_TIMEOUT, ACTIVE_TIMEOUT
+from packet_filter import PacketFilter
+from packet_table import dataframe_counters
+from parse_cache import ParseCache
+from scan_defaults import SCAN_THRESHOLDS
+from sketches import TalkerSketch
+from timeline import build_timelines
+from volume_stats import SuspiciousTrafficMonitor
+from rollup_store import RollupStore, detector_events
 from report_generator import display_summary, save_summary_file, save_packet_reports
+from batch_reports import BatchReports
 from visualizer import generate_all_visualizations
 from html_dashboard import create_dashboard
 
@@ -27,23 +45,111 @@ def load_config(config_file="config/settings.json"):
         return get_default_config()
 
 
+FLOOD_LABELS = {'syn_flood': "SYN flood on", 'icmp_flood': "ICMP flood from"}
+
+
+def parse_time(text):
+    """Epoch seconds or a local ISO 8601 date and time, as epoch nanoseconds"""
+    try:
+        seconds = float(text)
+    except ValueError:
+        try:
+            seconds = datetime.fromisoformat(text).timestamp()
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"expected epoch seconds or YYYY-MM-DD[ HH:MM[:SS]], got {text!r}"
+            ) from None
+    return int(round(seconds * 1e9))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="NetScope - Network Traffic Analyzer")
+    parser.add_argument("pcap_file", nargs="?",
+                        help="capture to analyze (default: input.pcap_file in the settings)")
+    parser.add_argument("--config", default="config/settings.json", help="settings file")
+    parser.add_argument("--start", type=parse_time,
+                        help="only packets at or after this time (epoch seconds or ISO date/time)")
+    parser.add_argument("--end", type=parse_time,
+                        help="only packets before this time (epoch seconds or ISO date/time)")
+    parser.add_argument("--filter", dest="packet_filter",
+                        help="only packets matching this filter, e.g. \"tcp and net 10.0.0.0/8\" "
+                             "(default: input.filter in the settings)")
+    return parser.parse_args(argv)
+
+
+def format_packet_time(timestamp):
+    return datetime.fromtimestamp(float(timestamp)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_window_bound(timestamp_ns, default):
+    return default if timestamp_ns is None else format_packet_time(timestamp_ns / 1e9)
+
+
+def print_flood_alert(kind, alert):
+    """Print a rate alert as soon as it starts"""
+    print(f"   ⚠ {FLOOD_LABELS[kind]} {alert['key']} at {format_packet_time(alert['start'])} "
+          f"({alert['peak_rate']:.0f}/s)")
+
+
 def get_default_config():
     """Return default configuration"""
     return {
         "input": {
-            "pcap_file": "traffic.pcap"
+            "pcap_file": "traffic.pcap",
+            "streaming": False,
+            "batch_size": 10000,
+            "workers": 1,
+            "seek_index": True,
+            "filter": None
+        },
+        "cache": {
+            "enabled": False,
+            "directory": "output/cache",
+            "max_size_mb": 512
+        },
+        "talkers": {
+            "sketch": False,
+            "capacity": 1000,
+            "count_min_width": 2048,
+            "count_min_depth": 4
+        },
+        "security_scan": {
+            "enabled": False,
+            "backend": "packets",
+            "port_sketch_cutoff": None
+        },
+        "signatures": {
+            "enabled": False,
+            "rules_file": "config/signatures.rules"
+        },
+        "rollups": {
+            "enabled": False,
+            "max_talkers": 1000
+        },
+        "flow_export": {
+            "enabled": False,
+            "format": "csv",
+            "idle_timeout": IDLE_TIMEOUT,
+            "active_timeout": ACTIVE_TIMEOUT,
+            "batch_size": 1000
         },
         "output": {
             "base_directory": "output",
             "dashboards_dir": "output/dashboards",
             "visualizations_dir": "output/visualizations",
             "reports_dir": "output/reports",
-            "exports_dir": "output/exports"
+            "exports_dir": "output/exports",
+            "rollups_dir": "output/rollups"
         },
         "thresholds": {
             "suspicious_bytes": 1048576,
             "use_adaptive_threshold": False,
-            "adaptive_factor": 5
+            "adaptive_factor": 5,
+            "threshold_method": None,
+            "percentile": 99.0,
+            "mad_factor": 3.5,
+            "online_alerts": False,
+            **SCAN_THRESHOLDS
         },
         "display": {
             "top_talkers_count": 15,
@@ -52,61 +158,298 @@ def get_default_config():
     }
 
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
     print("\n" + "="*70)
     print("🌐 NetScope - Network Traffic Analyzer")
     print("="*70 + "\n")
     
     # Load configuration
-    config = load_config()
+    config = load_config(args.config)
     
     # Extract settings
-    pcap_file = config['input']['pcap_file']
+    pcap_file = args.pcap_file or config['input']['pcap_file']
+    streaming = config['input'].get('streaming', False)
+    batch_size = config['input'].get('batch_size', 10000)
+    workers = config['input'].get('workers', 1)
+    cache_config = config.get('cache', {})
+    # Packets outside --start/--end are skipped by the reader; classic pcap
+    # files seek to the window through their sidecar index
+    read_window = {
+        'start_ns': args.start,
+        'end_ns': args.end,
+        'index': config['input'].get('seek_index', True),
+    }
+    windowed = args.start is not None or args.end is not None
+    # A capture filter is compiled once and applied by the reader to the
+    # raw record headers, before any packet is dissected
+    filter_expression = args.packet_filter or config['input'].get('filter')
+    if filter_expression:
+        try:
+            read_window['packet_filter'] = PacketFilter(filter_expression)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+    # Rollups and flow exports of a window or filtered run get their own names
+    run_name = os.path.splitext(os.path.basename(pcap_file))[0]
+    if windowed:
+        run_name += "_{}-{}".format(*(bound // 10**9 if bound is not None else default
+                                      for bound, default in ((args.start, 'start'), (args.end, 'end'))))
+    if filter_expression:
+        run_name += "_filter-" + hashlib.sha1(filter_expression.encode('utf-8')).hexdigest()[:8]
+    talker_config = config.get('talkers', {})
+    scan_config = config.get('security_scan', {})
+    signature_config = config.get('signatures', {})
+    rollup_config = config.get('rollups', {})
+    flow_config = config.get('flow_export', {})
     output_dirs = config['output']
     thresholds = config['thresholds']
     display = config['display']
     
+    # "threshold_method" overrides the older use_adaptive_threshold switch
+    method = thresholds.get('threshold_method') or (
+        'mean' if thresholds['use_adaptive_threshold'] else 'static'
+    )
+    threshold_settings = {
+        'threshold': thresholds['suspicious_bytes'],
+        'factor': thresholds.get('mad_factor', 3.5) if method == 'mad' else thresholds['adaptive_factor'],
+        'percentile': thresholds.get('percentile', 99.0),
+    }
+
+    # Estimate per-IP bytes in fixed memory instead of counting every IP
+    talkers = None
+    if talker_config.get('sketch', False):
+        if method in ('percentile', 'mad'):
+            print(f"⚠ The {method} threshold needs exact per-IP counts; talker sketch disabled")
+        else:
+            talkers = TalkerSketch(
+                capacity=talker_config.get('capacity', 1000),
+                width=talker_config.get('count_min_width', 2048),
+                depth=talker_config.get('count_min_depth', 4)
+            )
+
+    # Payload signatures are compiled once, before the capture is read
+    signatures = None
+    if signature_config.get('enabled', False):
+        rules_file = signature_config.get('rules_file', 'config/signatures.rules')
+        try:
+            signatures = SignatureSet.from_file(rules_file)
+            print(f"🧬 Loaded {len(signatures)} payload signatures from {rules_file}")
+        except (OSError, ValueError) as e:
+            print(f"⚠ Payload signatures disabled: {e}")
+
     # Create output directories
     for dir_path in output_dirs.values():
         os.makedirs(dir_path, exist_ok=True)
     
-    # Load packets
-    print(f"📂 Loading PCAP file: {pcap_file}")
-    packets = load_pcap(pcap_file)
-    if not packets:
-        print("❌ Failed to load packets. Exiting.")
-        return
+    # A streamed capture is parsed batch by batch into the report stages
+    # (batch_reports.py) and the whole packet table is never built; only
+    # the table scan backend needs it
+    incremental = streaming and not (scan_config.get('enabled', False)
+                                     and scan_config.get('backend', 'packets') == 'table')
+
+    # Reuse a cached parse of an unchanged capture
+    cache = None
+    parsed = None
+    batches = None
+    packets = None
+    if cache_config.get('enabled', False) and talkers is None and not (windowed or filter_expression):
+        cache = ParseCache(
+            cache_config.get('directory', 'output/cache'),
+            max_bytes=cache_config.get('max_size_mb', 512) * 1024 * 1024
+        )
+        if incremental:
+            batches = cache.batches(pcap_file, batch_size)
+        else:
+            parsed = cache.load(pcap_file)
 
-    # Parse packets
-    print("🔍 Parsing packets...")
-    df, full_proto_counter, main_proto_counter, ip_traffic_counter = parse_packets(packets)
+    if parsed is not None or batches is not None:
+        print(f"⚡ Loaded parsed packets from cache: {pcap_file}")
+    else:
+        # Load packets
+        print(f"📂 Loading PCAP file: {pcap_file}")
+        if windowed:
+            print(f"🕒 Time window: {format_window_bound(args.start, 'start')} → "
+                  f"{format_window_bound(args.end, 'end')}")
+        if filter_expression:
+            print(f"🔎 Capture filter: {filter_expression}")
+        packets = load_pcap(pcap_file, stream=streaming, batch_size=batch_size, **read_window)
+        if not packets:
+            print("❌ Failed to load packets. Exiting.")
+            return
+
+        # Parse packets, alerting on IPs as soon as they cross the threshold
+        monitor = None
+        if thresholds.get('online_alerts', False):
+            monitor = SuspiciousTrafficMonitor(
+                method,
+                capacity=talker_config.get('capacity', 1000),
+                on_alert=lambda ip, total_bytes, limit: print(
+                    f"   ⚠ {ip} crossed {limit:,.0f} bytes ({total_bytes:,} so far)"
+                ),
+                **threshold_settings
+            )
+        print("🔍 Parsing packets...")
+        if not incremental:
+            parsed = parse_packets(packets, workers=workers, monitor=monitor, talkers=talkers)
+            if cache is not None:
+                cache.store(pcap_file, *parsed)
+
+    reports = None
+    if incremental:
+        df = None
+        full_proto_counter, main_proto_counter = Counter(), Counter()
+        ip_traffic_counter = Counter() if talkers is None else talkers
+        reports = BatchReports(output_dirs['exports_dir'], max_talkers=rollup_config.get('max_talkers', 1000))
+        if batches is not None:
+            for batch in batches:
+                for counter, batch_counter in zip((full_proto_counter, main_proto_counter, ip_traffic_counter),
+                                                  dataframe_counters(batch)):
+                    counter.update(batch_counter)
+                reports.add(batch)
+        else:
+            cache_writer = cache.writer(pcap_file) if cache is not None else None
+            for batch in parse_packet_batches(packets, full_proto_counter, main_proto_counter,
+                                              ip_traffic_counter, workers=workers, monitor=monitor):
+                reports.add(batch)
+                if cache_writer is not None:
+                    cache_writer.add(batch)
+            if cache_writer is not None:
+                cache_writer.close()
+        packet_count = reports.packets
+    else:
+        df, full_proto_counter, main_proto_counter, ip_traffic_counter = parsed
+        packet_count = len(df)
     
-    if df.empty:
+    if not packet_count:
         print("❌ No packets to analyze. Exiting.")
         return
 
     # Detect suspicious IPs
     print("🚨 Detecting suspicious activity...")
-    if thresholds['use_adaptive_threshold']:
-        suspicious_ips = detect_suspicious(
-            ip_traffic_counter,
-            adaptive=True,
-            factor=thresholds['adaptive_factor']
-        )
-        print(f"   Using adaptive threshold (factor: {thresholds['adaptive_factor']}x)")
+    suspicious_ips = detect_suspicious(ip_traffic_counter, method=method, **threshold_settings)
+    if method == 'mean':
+        print(f"   Using adaptive threshold (factor: {threshold_settings['factor']}x)")
+    elif method == 'percentile':
+        print(f"   Using percentile threshold (p{threshold_settings['percentile']:g})")
+    elif method == 'mad':
+        print(f"   Using MAD threshold (median + {threshold_settings['factor']} scaled MADs)")
     else:
-        suspicious_ips = detect_suspicious(
-            ip_traffic_counter,
-            threshold=thresholds['suspicious_bytes']
-        )
         print(f"   Using static threshold: {thresholds['suspicious_bytes']:,} bytes")
 
+    # The connection tracker evicts flows after these timeouts, so the scan
+    # only holds open flows; with flow export on, evicted flows are written out
+    flow_writer = None
+    flows_exported = False
+    flow_timeouts = {
+        'idle_timeout': flow_config.get('idle_timeout', IDLE_TIMEOUT),
+        'active_timeout': flow_config.get('active_timeout', ACTIVE_TIMEOUT),
+    }
+    if flow_config.get('enabled', False):
+        flow_format = flow_config.get('format', 'csv')
+        try:
+            flow_writer = FlowWriter(export_path(output_dirs['exports_dir'], run_name, flow_format),
+                                     flow_format, batch_size=flow_config.get('batch_size', 1000))
+        except (OSError, ValueError) as e:
+            print(f"⚠ Flow export disabled: {e}")
+
+    # Packet-level detectors; flood alerts are printed as they start.
+    # The table backend scans the parsed table instead, without reading
+    # the capture again, but has no SYN flood, DNS, HTTP or signature
+    # detectors.
+    signature_alerts = None
+    scan = None
+    if scan_config.get('enabled', False):
+        if scan_config.get('backend', 'packets') == 'table':
+            print("🛡️ Running security scan on the packet table...")
+            scan = scan_table(df, thresholds)
+        else:
+            print("🛡️ Running security scan...")
+            if packets is None:
+                packets = load_pcap(pcap_file, stream=True, batch_size=batch_size, **read_window)
+            scan = comprehensive_security_scan(
+                packets, df, ip_traffic_counter,
+                port_sketch_cutoff=scan_config.get('port_sketch_cutoff'),
+                thresholds=thresholds,
+                on_alert=print_flood_alert,
+                signatures=signatures,
+                flow_sink=flow_writer,
+                **flow_timeouts
+            )
+            flows_exported = flow_writer is not None
+            if signatures is not None:
+                signature_alerts = scan['signature_alerts']
+        summary = f"   Port scanners: {len(scan['port_scanners'])}, "
+        if 'syn_flood_targets' in scan:
+            summary += f"SYN flood targets: {len(scan['syn_flood_targets'])}, "
+        print(summary + f"ICMP flooders: {len(scan['icmp_flooders'])}")
+        if 'dns_summary' in scan:
+            dns_summary = scan['dns_summary']
+            print(f"   DNS queries: {dns_summary['total_queries']:,}, "
+                  f"tunneling candidates: {len(dns_summary['tunneling_candidates'])}")
+            for alert in dns_summary['rate_alerts']:
+                print(f"   ⚠ DNS query burst from {alert['key']}: "
+                      f"{format_packet_time(alert['start'])} → {format_packet_time(alert['end'])}, "
+                      f"{alert['events']:,} queries, peak {alert['peak_rate']:.0f}/s")
+        if 'http_requests' in scan:
+            latencies = sorted(request['latency'] for request in scan['http_requests']
+                               if request['latency'] is not None)
+            line = f"   HTTP requests: {len(scan['http_requests']):,}, answered: {len(latencies):,}"
+            if latencies:
+                line += f", median latency {latencies[len(latencies) // 2] * 1000:.1f} ms"
+            print(line)
+        for kind in ('syn_flood', 'icmp_flood'):
+            for alert in scan.get(kind + '_alerts', []):
+                print(f"   ⚠ {FLOOD_LABELS[kind]} {alert['key']}: "
+                      f"{format_packet_time(alert['start'])} → {format_packet_time(alert['end'])}, "
+                      f"{alert['events']:,} packets, peak {alert['peak_rate']:.0f}/s")
+
+    # Signatures still need a pass over the payloads when the scan did not make one
+    if signatures is not None and signature_alerts is None:
+        print("🧬 Matching payload signatures...")
+        if packets is None:
+            packets = load_pcap(pcap_file, stream=True, batch_size=batch_size, **read_window)
+        signature_alerts = scan_signatures(packets, signatures)
+    if signature_alerts:
+        print(f"   ⚠ Payload signature matches: {len(signature_alerts)}")
+
+    # Likewise for the flow records
+    if flow_writer is not None:
+        if not flows_exported:
+            print("🌊 Tracking flows for export...")
+            if packets is None:
+                packets = load_pcap(pcap_file, stream=True, batch_size=batch_size, **read_window)
+            open_flows = analyze_connections(packets, sink=flow_writer, **flow_timeouts)
+            for record in open_flows.values():
+                flow_writer(record)
+        flow_writer.close()
+        print(f"🌊 {flow_writer.rows:,} flow records saved to {flow_writer.path}")
+
+    # Time-series rollups with the detector hits: the reports and the
+    # dashboard read these instead of the packet table, and a saved store
+    # answers later time-range queries without the capture
+    events = detector_events(suspicious_ips, ip_traffic_counter, scan, signature_alerts)
+    max_talkers = rollup_config.get('max_talkers', 1000)
+    if rollup_config.get('enabled', False):
+        rollup_dir = os.path.join(output_dirs.get('rollups_dir', 'output/rollups'), run_name)
+        if reports is not None:
+            rollups = reports.rollups.write(rollup_dir, events, source=os.path.abspath(pcap_file))
+        else:
+            rollups = RollupStore.write(rollup_dir, df, events, source=os.path.abspath(pcap_file),
+                                        max_talkers=max_talkers)
+        print(f"🗂️ Rollups saved to {rollup_dir}")
+    elif reports is not None:
+        rollups = reports.rollups.build(events)
+    else:
+        rollups = RollupStore.from_frame(df, events, max_talkers=max_talkers)
+
     # Display terminal summary
     if display['show_terminal_summary']:
         print("\n" + "="*70)
         print("📊 TERMINAL SUMMARY")
         print("="*70)
-        display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips)
+        display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips,
+                        signature_alerts)
 
     # Save text reports
     print("\n" + "="*70)
@@ -115,9 +458,20 @@ def main():
     save_summary_file(
         main_proto_counter, full_proto_counter, 
         ip_traffic_counter, suspicious_ips, 
-        folder=output_dirs['reports_dir']
+        folder=output_dirs['reports_dir'],
+        signature_alerts=signature_alerts,
+        rollups=rollups
     )
-    save_packet_reports(df, folder=output_dirs['exports_dir'])
+    if reports is not None:
+        reports.close()
+    else:
+        save_packet_reports(df, folder=output_dirs['exports_dir'])
+
+    # Timelines at every resolution for the spike count and the charts
+    timelines = reports.timelines.timelines() if reports is not None else build_timelines(df)
+    spikes = timelines[1].spikes().sum()
+    if spikes:
+        print(f"\n⏱️ Traffic spikes: {spikes} of {len(timelines[1]):,} active seconds")
 
     # Generate individual visualizations
     print("\n" + "="*70)
@@ -126,7 +480,10 @@ def main():
     generate_all_visualizations(
         df, main_proto_counter, full_proto_counter, 
         ip_traffic_counter, 
-        output_dir=output_dirs['visualizations_dir']
+        output_dir=output_dirs['visualizations_dir'],
+        timelines=timelines,
+        size_counts=reports.size_counts if reports is not None else None,
+        pair_counts=reports.pair_counts if reports is not None else None
     )
     
     # Generate HTML Dashboard
@@ -136,7 +493,9 @@ def main():
     dashboard_file = create_dashboard(
         df, main_proto_counter, full_proto_counter, 
         ip_traffic_counter, suspicious_ips, pcap_file, 
-        output_dir=output_dirs['dashboards_dir']
+        output_dir=output_dirs['dashboards_dir'],
+        signature_alerts=signature_alerts,
+        rollups=rollups
     )
     
     print("\n" + "="*70)
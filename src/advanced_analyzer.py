@@ -1,8 +1,23 @@
 # advanced_analyzer.py
 
-from scapy.all import TCP, UDP, ICMP, IP, ARP, DNS, Raw
+from scapy.all import TCP, IP, IPv6, ARP, DNS, Raw
 from collections import Counter, defaultdict
 import re
+import struct
+
+from dns_features import DnsQueryStats
+from fast_dissector import DNS_TCP_PORTS, DNS_UDP_PORTS
+from flow_table import FlowTable, TCP_SYN, TCP_ACK, IDLE_TIMEOUT, ACTIVE_TIMEOUT
+from http_stream import HttpStreamTracker
+from rate_detector import SlidingRateDetector
+from scan_defaults import (
+    PORT_SCAN_THRESHOLD, SYN_FLOOD_THRESHOLD, ICMP_FLOOD_THRESHOLD,
+    SYN_FLOOD_RATE, ICMP_FLOOD_RATE, DNS_QUERY_RATE, FLOOD_WINDOW
+)
+from scan_engine import run_visitors
+from signature_engine import SignatureScanner
+from sketches import PortSketch
+from timeline import build_timelines
 
 # Service port mapping (expanded)
 SERVICE_PORTS = {
@@ -25,96 +40,118 @@ def get_service_name(port, protocol=None):
     return f"Port-{port}"
 
 
-def analyze_connections(packets):
-    """Advanced connection tracking with TCP state analysis"""
-    connections = defaultdict(lambda: {
-        'packets': 0,
-        'bytes': 0,
-        'syn_count': 0,
-        'syn_ack_count': 0,
-        'ack_count': 0,
-        'fin_count': 0,
-        'rst_count': 0,
-        'first_seen': None,
-        'last_seen': None,
-        'complete_handshake': False
-    })
-    
-    for pkt in packets:
-        if pkt.haslayer(TCP) and pkt.haslayer(IP):
-            src = pkt[IP].src
-            dst = pkt[IP].dst
-            sport = pkt[TCP].sport
-            dport = pkt[TCP].dport
-            
-            conn_key = (src, sport, dst, dport)
-            conn = connections[conn_key]
-            
-            # Update connection stats
-            conn['packets'] += 1
-            conn['bytes'] += len(pkt)
-            
-            if conn['first_seen'] is None:
-                conn['first_seen'] = pkt.time
-            conn['last_seen'] = pkt.time
-            
-            # Analyze TCP flags
-            flags = pkt[TCP].flags
-            if flags & 0x02:  # SYN
-                conn['syn_count'] += 1
-            if flags & 0x12:  # SYN-ACK
-                conn['syn_ack_count'] += 1
-            if flags & 0x10:  # ACK
-                conn['ack_count'] += 1
-            if flags & 0x01:  # FIN
-                conn['fin_count'] += 1
-            if flags & 0x04:  # RST
-                conn['rst_count'] += 1
-            
-            # Check for complete handshake
-            if conn['syn_count'] > 0 and conn['syn_ack_count'] > 0 and conn['ack_count'] > 0:
-                conn['complete_handshake'] = True
-    
-    return connections
+class ConnectionTracker:
+    """
+    Per-packet visitor behind analyze_connections.
 
+    Both directions of a connection update one FlowRecord in a FlowTable;
+    idle_timeout, active_timeout and sink are passed to the table.
+    """
 
-def detect_port_scanning(packets, threshold=10):
-    """Detect potential port scanning activity"""
-    # Track unique ports per source IP
-    ip_ports = defaultdict(set)
-    
-    for pkt in packets:
-        if pkt.haslayer(IP):
-            src = pkt[IP].src
-            if pkt.haslayer(TCP):
-                ip_ports[src].add(('TCP', pkt[TCP].dport))
-            elif pkt.haslayer(UDP):
-                ip_ports[src].add(('UDP', pkt[UDP].dport))
-    
-    # Identify scanners
-    scanners = {}
-    for ip, ports in ip_ports.items():
-        if len(ports) >= threshold:
-            scanners[ip] = {
-                'port_count': len(ports),
-                'ports': sorted(list(ports), key=lambda x: x[1])[:20]  # First 20 ports
-            }
-    
-    return scanners
+    def __init__(self, idle_timeout=None, active_timeout=None, sink=None):
+        self.flows = FlowTable(idle_timeout, active_timeout, sink)
+
+    def visit(self, view):
+        if view.tcp is None or view.ip is None:
+            return
+        src, dst = view.ip
+        sport, dport, flags = view.tcp
+        self.flows.update(src, sport, dst, dport, int(flags), view.length, view.timestamp_ns)
+
+    def result(self):
+        return self.flows.connections()
+
+
+def analyze_connections(packets, idle_timeout=None, active_timeout=None, sink=None):
+    """
+    Advanced connection tracking with TCP state analysis.
+
+    Returns {(src_ip, src_port, dst_ip, dst_port): FlowRecord} with one
+    record per connection, keyed initiator first. With idle_timeout or
+    active_timeout (seconds) finished flows are evicted during the pass
+    and handed to sink instead of being returned.
+    """
+    return run_visitors(packets, [ConnectionTracker(idle_timeout, active_timeout, sink)])[0]
+
+
+class PortScanDetector:
+    """
+    Per-packet visitor behind detect_port_scanning.
+
+    With sketch_cutoff set, each source keeps an exact port set only up
+    to that many ports and a PortSketch (HyperLogLog plus a sample of
+    the lowest ports) beyond it, so memory per source stays bounded.
+    """
+
+    def __init__(self, threshold=PORT_SCAN_THRESHOLD, sketch_cutoff=None):
+        self.threshold = threshold
+        # Track unique ports per source IP
+        if sketch_cutoff is None:
+            self.ip_ports = defaultdict(set)
+        else:
+            self.ip_ports = defaultdict(lambda: PortSketch(cutoff=sketch_cutoff))
 
+    def visit(self, view):
+        if view.ip is None:
+            return
+        src = view.ip[0]
+        if view.tcp is not None:
+            self.ip_ports[src].add(('TCP', view.tcp[1]))
+        elif view.udp is not None:
+            self.ip_ports[src].add(('UDP', view.udp[1]))
 
-def detect_syn_flood(connections, threshold=50):
-    """Detect potential SYN flood attacks (incomplete handshakes)"""
+    def result(self):
+        # Identify scanners
+        scanners = {}
+        for ip, ports in self.ip_ports.items():
+            port_count = len(ports)
+            if port_count < self.threshold:
+                continue
+            if isinstance(ports, PortSketch):
+                scanners[ip] = {
+                    'port_count': port_count,
+                    'ports': ports.sample(),
+                    'port_count_estimated': ports.estimated
+                }
+            else:
+                scanners[ip] = {
+                    'port_count': port_count,
+                    'ports': sorted(list(ports), key=lambda x: x[1])[:20]  # First 20 ports
+                }
+
+        return scanners
+
+
+def detect_port_scanning(packets, threshold=PORT_SCAN_THRESHOLD, sketch_cutoff=None):
+    """
+    Detect potential port scanning activity.
+
+    sketch_cutoff switches to bounded-memory port counting: sources with
+    more distinct ports than that get an estimated port_count
+    (port_count_estimated is True) and a sample of their lowest ports.
+    """
+    return run_visitors(packets, [PortScanDetector(threshold, sketch_cutoff)])[0]
+
+
+def detect_syn_flood(connections, threshold=SYN_FLOOD_THRESHOLD):
+    """
+    Detect potential SYN flood attacks (incomplete handshakes).
+
+    connections is the analyze_connections dict or any iterable of flow
+    records.
+    """
     incomplete_connections = []
+    if isinstance(connections, dict):
+        connections = connections.values()
     
-    for conn_key, conn_data in connections.items():
+    for conn_data in connections:
         # SYN sent but no complete handshake
         if conn_data['syn_count'] > 0 and not conn_data['complete_handshake']:
             incomplete_connections.append({
-                'src_ip': conn_key[0],
-                'src_port': conn_key[1],
-                'dst_ip': conn_key[2],
-                'dst_port': conn_key[3],
+                'src_ip': conn_data['src_ip'],
+                'src_port': conn_data['src_port'],
+                'dst_ip': conn_data['dst_ip'],
+                'dst_port': conn_data['dst_port'],
                 'syn_count': conn_data['syn_count']
             })
     
@@ -132,103 +169,225 @@ def detect_syn_flood(connections, threshold=50):
     return potential_targets, incomplete_connections
 
 
-def detect_icmp_flood(packets, threshold=100):
+class IcmpFloodDetector:
+    """Per-packet visitor behind detect_icmp_flood"""
+
+    def __init__(self, threshold=ICMP_FLOOD_THRESHOLD):
+        self.threshold = threshold
+        self.icmp_counter = Counter()
+
+    def visit(self, view):
+        if view.icmp and view.ip is not None:
+            self.icmp_counter[view.ip[0]] += 1
+
+    def result(self):
+        # Identify sources with high ICMP traffic
+        icmp_flooders = {
+            ip: count for ip, count in self.icmp_counter.items()
+            if count >= self.threshold
+        }
+
+        return icmp_flooders
+
+
+def detect_icmp_flood(packets, threshold=ICMP_FLOOD_THRESHOLD):
     """Detect ICMP flood attacks"""
-    icmp_counter = Counter()
-    
-    for pkt in packets:
-        if pkt.haslayer(ICMP) and pkt.haslayer(IP):
-            src = pkt[IP].src
-            icmp_counter[src] += 1
-    
-    # Identify sources with high ICMP traffic
-    icmp_flooders = {
-        ip: count for ip, count in icmp_counter.items() 
-        if count >= threshold
-    }
-    
-    return icmp_flooders
+    return run_visitors(packets, [IcmpFloodDetector(threshold)])[0]
 
 
-def detect_dns_anomalies(packets):
-    """Detect DNS tunneling and suspicious DNS activity"""
-    dns_queries = []
-    suspicious_dns = []
-    
-    for pkt in packets:
-        if pkt.haslayer(DNS) and pkt.haslayer(IP):
+class SynFloodRateDetector:
+    """
+    Per-packet visitor behind detect_syn_flood_rate: SYNs (without ACK)
+    per second to each target, over a sliding window.
+    """
+
+    def __init__(self, rate=SYN_FLOOD_RATE, window=FLOOD_WINDOW, resolution=1, on_alert=None):
+        self.rates = SlidingRateDetector(rate, window, resolution, on_alert)
+
+    def visit(self, view):
+        if view.tcp is not None and view.ip is not None:
+            flags = view.tcp[2]
+            if flags & TCP_SYN and not flags & TCP_ACK:
+                self.rates.add(view.ip[1], view.timestamp_ns)
+
+    def result(self):
+        return self.rates.close()
+
+
+class IcmpFloodRateDetector:
+    """
+    Per-packet visitor behind detect_icmp_flood_rate: ICMP packets per
+    second from each source, over a sliding window.
+    """
+
+    def __init__(self, rate=ICMP_FLOOD_RATE, window=FLOOD_WINDOW, resolution=1, on_alert=None):
+        self.rates = SlidingRateDetector(rate, window, resolution, on_alert)
+
+    def visit(self, view):
+        if view.icmp and view.ip is not None:
+            self.rates.add(view.ip[0], view.timestamp_ns)
+
+    def result(self):
+        return self.rates.close()
+
+
+def detect_syn_flood_rate(packets, rate=SYN_FLOOD_RATE, window=FLOOD_WINDOW, resolution=1,
+                          on_alert=None):
+    """
+    Detect SYN floods as time intervals in which a target receives at
+    least rate SYNs per second, averaged over window seconds.
+
+    Returns a list of alerts (key is the target IP) with start and end
+    times; on_alert is called as each one starts.
+    """
+    return run_visitors(packets, [SynFloodRateDetector(rate, window, resolution, on_alert)])[0]
+
+
+def detect_icmp_flood_rate(packets, rate=ICMP_FLOOD_RATE, window=FLOOD_WINDOW, resolution=1,
+                           on_alert=None):
+    """
+    Detect ICMP floods as time intervals in which a source sends at least
+    rate ICMP packets per second, averaged over window seconds.
+
+    Returns a list of alerts (key is the source IP) with start and end
+    times; on_alert is called as each one starts.
+    """
+    return run_visitors(packets, [IcmpFloodRateDetector(rate, window, resolution, on_alert)])[0]
+
+
+def _ip_pair(pkt):
+    """Source and destination address of the IPv4 or IPv6 layer"""
+    if pkt.haslayer(IP):
+        return pkt[IP].src, pkt[IP].dst
+    if pkt.haslayer(IPv6):
+        return pkt[IPv6].src, pkt[IPv6].dst
+    return '', ''
+
+
+def _raw_dns_query(payload):
+    """
+    Parse the header and first question of a DNS message in place.
+
+    Returns (qr, qname) with qname formatted like scapy's DNSQR.qname, or
+    None when the message is compressed or malformed.
+    """
+    if len(payload) < 12:
+        return None
+    qr = payload[2] >> 7
+    if qr:
+        return qr, None
+    qdcount = struct.unpack_from('!H', payload, 4)[0]
+    if qdcount == 0:
+        return qr, b''
+    labels = []
+    offset = 12
+    while True:
+        if offset >= len(payload):
+            return None
+        label_len = payload[offset]
+        if label_len == 0:
+            break
+        if label_len >= 0x40:
+            return None
+        labels.append(bytes(payload[offset + 1:offset + 1 + label_len]))
+        offset += 1 + label_len
+    if offset + 5 > len(payload):
+        return None
+    return qr, b'.'.join(labels) + b'.'
+
+
+class DnsInspector:
+    """
+    Per-packet visitor behind detect_dns_anomalies. Query names are
+    scored in batches by DnsQueryStats; queries are not kept.
+    """
+
+    def __init__(self, query_rate=DNS_QUERY_RATE, window=FLOOD_WINDOW, max_offenders=100):
+        self.stats = DnsQueryStats(max_offenders=max_offenders, query_rate=query_rate,
+                                   window=window)
+
+    def inspect(self, pkt, timestamp_ns):
+        if pkt.haslayer(DNS) and (pkt.haslayer(IP) or pkt.haslayer(IPv6)):
             if pkt[DNS].qr == 0:  # DNS query
-                query_name = pkt[DNS].qd.qname.decode('utf-8') if pkt[DNS].qd else ''
-                
-                dns_queries.append({
-                    'src_ip': pkt[IP].src,
-                    'query': query_name,
-                    'length': len(query_name)
-                })
-                
-                # Check for suspiciously long domain names (potential tunneling)
-                if len(query_name) > 50:
-                    suspicious_dns.append({
-                        'src_ip': pkt[IP].src,
-                        'query': query_name,
-                        'reason': 'Unusually long domain name (potential DNS tunneling)'
-                    })
-    
-    # Count queries per IP
-    query_counter = Counter([q['src_ip'] for q in dns_queries])
-    
-    # High frequency DNS queries from single source
-    high_freq_dns = {
-        ip: count for ip, count in query_counter.items() 
-        if count > 100
-    }
-    
-    return dns_queries, suspicious_dns, high_freq_dns
+                # A malformed question dissects as Raw, without a qname
+                query_name = getattr(pkt[DNS].qd, 'qname', b'') if pkt[DNS].qd else b''
+                self.stats.add(_ip_pair(pkt)[0], query_name, timestamp_ns)
+
+    def visit(self, view):
+        if not view.decoded:
+            self.inspect(view.scapy(), view.timestamp_ns)
+        elif view.udp is not None:
+            # Plain DNS over UDP: read the question straight from the buffer
+            if view.udp[0] in DNS_UDP_PORTS or view.udp[1] in DNS_UDP_PORTS:
+                query = _raw_dns_query(view.payload)
+                if query is None:
+                    self.inspect(view.scapy(), view.timestamp_ns)
+                elif query[0] == 0:
+                    self.stats.add(view.addresses[0], query[1], view.timestamp_ns)
+        elif view.tcp is not None:
+            if view.tcp[0] in DNS_TCP_PORTS or view.tcp[1] in DNS_TCP_PORTS:
+                self.inspect(view.scapy(), view.timestamp_ns)
+
+    def result(self):
+        summary = self.stats.summary()
+
+        # High frequency DNS queries from single source
+        high_freq_dns = self.stats.high_frequency_sources(100)
+
+        return summary, self.stats.offenders(), high_freq_dns
+
+
+def detect_dns_anomalies(packets, query_rate=DNS_QUERY_RATE, window=FLOOD_WINDOW):
+    """
+    Detect DNS tunneling and suspicious DNS activity.
+
+    Returns (summary, suspicious_dns, high_freq_dns). summary holds the
+    query aggregates, the sources with the most suspicious queries
+    (tunneling_candidates) and the intervals in which a source sent at
+    least query_rate queries per second over window seconds
+    (rate_alerts). suspicious_dns lists the highest scoring queries
+    with the reasons they were flagged.
+    """
+    return run_visitors(packets, [DnsInspector(query_rate, window)])[0]
+
+
+class HttpInspector:
+    """
+    Per-packet visitor behind extract_http_info. TCP payloads go to an
+    HttpStreamTracker, which only looks past the first bytes of streams
+    that start like HTTP.
+    """
+
+    def __init__(self, max_buffer=65536, max_streams=10000):
+        self.tracker = HttpStreamTracker(max_buffer=max_buffer, max_streams=max_streams)
+
+    def visit(self, view):
+        if view.tcp is None:
+            return
+        if view.decoded:
+            payload = view.payload
+        else:
+            layer = view.scapy()[TCP].payload
+            payload = layer.load if isinstance(layer, Raw) else bytes(layer)
+        src_ip, dst_ip = view.addresses or ('', '')
+        sport, dport, flags = view.tcp
+        self.tracker.add(src_ip, dst_ip, sport, dport, int(flags), view.seq, payload,
+                         view.timestamp_ns)
+
+    def result(self):
+        return self.tracker.result()
 
 
 def extract_http_info(packets):
-    """Extract HTTP requests and responses"""
-    http_requests = []
-    http_responses = []
-    
-    for pkt in packets:
-        if pkt.haslayer(TCP) and pkt.haslayer(Raw):
-            payload = pkt[Raw].load
-            
-            try:
-                payload_str = payload.decode('utf-8', errors='ignore')
-                
-                # Check for HTTP request
-                if payload_str.startswith(('GET ', 'POST ', 'PUT ', 'DELETE ', 'HEAD ')):
-                    lines = payload_str.split('\r\n')
-                    method_line = lines[0].split()
-                    
-                    if len(method_line) >= 3:
-                        http_requests.append({
-                            'src_ip': pkt[IP].src if pkt.haslayer(IP) else '',
-                            'dst_ip': pkt[IP].dst if pkt.haslayer(IP) else '',
-                            'method': method_line[0],
-                            'url': method_line[1],
-                            'version': method_line[2],
-                            'timestamp': pkt.time
-                        })
-                
-                # Check for HTTP response
-                elif payload_str.startswith('HTTP/'):
-                    lines = payload_str.split('\r\n')
-                    status_line = lines[0].split()
-                    
-                    if len(status_line) >= 2:
-                        http_responses.append({
-                            'src_ip': pkt[IP].src if pkt.haslayer(IP) else '',
-                            'dst_ip': pkt[IP].dst if pkt.haslayer(IP) else '',
-                            'status_code': status_line[1],
-                            'timestamp': pkt.time
-                        })
-            except:
-                pass
-    
-    return http_requests, http_responses
+    """
+    Extract HTTP requests and responses from the reassembled TCP streams.
+
+    Requests carry method, url, version, host, user_agent and
+    content_length; responses status_code and content_length. A request
+    answered in the capture gets the status_code of its response, and
+    both get the latency in seconds between the request and the response.
+    """
+    return run_visitors(packets, [HttpInspector()])[0]
 
 
 def detect_unusual_protocols(protocol_counter, whitelist=None):
@@ -245,84 +404,168 @@ def detect_unusual_protocols(protocol_counter, whitelist=None):
 
 
 def analyze_packet_timing(df, interval_seconds=1):
-    """Analyze packet timing to detect traffic spikes"""
-    if df.empty or 'timestamp' not in df.columns:
+    """
+    Analyze packet timing to detect traffic spikes.
+
+    Returns (timeline, spikes) as lists of {time, packets, bytes,
+    is_spike} per interval with traffic; df is left unchanged. Use
+    timeline.build_timelines directly for several resolutions at once.
+    """
+    if df.empty or 'timestamp_ns' not in df.columns:
         return []
-    
-    import pandas as pd
-    
-    df['datetime'] = pd.to_datetime(df['timestamp'], unit='s')
-    df['interval'] = df['datetime'].dt.floor(f'{interval_seconds}s')
-    
-    # Group by interval
-    timeline = df.groupby('interval').agg({
-        'length': ['count', 'sum']
-    }).reset_index()
-    
-    timeline.columns = ['time', 'packets', 'bytes']
-    
-    # Calculate average and detect spikes
-    avg_packets = timeline['packets'].mean()
-    std_packets = timeline['packets'].std()
-    
-    # Spike = more than 3 standard deviations above mean
-    timeline['is_spike'] = timeline['packets'] > (avg_packets + 3 * std_packets)
-    
-    spikes = timeline[timeline['is_spike']].to_dict('records')
-    
-    return timeline.to_dict('records'), spikes
+
+    records = build_timelines(df, (interval_seconds,))[interval_seconds].to_records()
+    spikes = [record for record in records if record['is_spike']]
+    return records, spikes
+
+
+PROTOCOL_GROUPINGS = ('protocol', 'chain', 'port', 'time')
 
 
-def get_protocol_statistics(df):
-    """Calculate detailed protocol statistics"""
+def get_protocol_statistics(df, by='protocol', interval_seconds=60):
+    """
+    Calculate detailed protocol statistics with one grouped aggregation.
+
+    by selects the groups: 'protocol' (main protocol), 'chain' (full
+    protocol chain), 'port' (service port, the lower of the two ports;
+    packets without ports are left out) or 'time' (buckets of
+    interval_seconds, keyed by their start in epoch seconds). Groups are
+    ordered by packet count. Per-protocol entries also name the most
+    common chain of the protocol, and per-port entries its service.
+    """
+    if by not in PROTOCOL_GROUPINGS:
+        raise ValueError(f"Unknown protocol grouping: {by}")
     if df.empty:
         return {}
-    
-    protocol_stats = {}
-    
-    for protocol in df['main_protocol'].unique():
-        protocol_df = df[df['main_protocol'] == protocol]
-        protocol_stats[protocol] = {
-            'count': len(protocol_df),
-            'total_bytes': protocol_df['length'].sum(),
-            'avg_packet_size': protocol_df['length'].mean(),
-            'min_packet_size': protocol_df['length'].min(),
-            'max_packet_size': protocol_df['length'].max(),
-            'std_packet_size': protocol_df['length'].std()
-        }
-    
+
+    if by == 'protocol':
+        key = df['main_protocol']
+    elif by == 'chain':
+        key = df['full_protocol']
+    elif by == 'port':
+        key = df[['src_port', 'dst_port']].min(axis=1, skipna=False).rename('port')
+    else:
+        step = int(interval_seconds * 1e9)
+        key = (df['timestamp_ns'] // step * step).rename('bucket')
+
+    stats = df['length'].groupby(key, observed=True, sort=False).agg(
+        ['count', 'sum', 'mean', 'min', 'max', 'std']
+    ).sort_values('count', ascending=False, kind='stable')
+    stats.columns = ['count', 'total_bytes', 'avg_packet_size', 'min_packet_size',
+                     'max_packet_size', 'std_packet_size']
+    if by == 'time':
+        stats.index = stats.index / 1e9
+    protocol_stats = stats.to_dict('index')
+
+    if by == 'protocol':
+        chains = df.groupby(['main_protocol', 'full_protocol'], observed=True).size()
+        for (protocol, chain), _count in chains.sort_values(ascending=False, kind='stable').items():
+            protocol_stats[protocol].setdefault('chain', chain)
+    elif by == 'port':
+        protocol_stats = {int(port): dict(entry, service=get_service_name(int(port)))
+                          for port, entry in protocol_stats.items()}
+
     return protocol_stats
 
 
-def comprehensive_security_scan(packets, df, ip_traffic_counter):
-    """Run all security detection algorithms"""
-    print("   🔍 Analyzing connections...")
-    connections = analyze_connections(packets)
-    
-    print("   🔍 Detecting port scans...")
-    port_scanners = detect_port_scanning(packets, threshold=10)
+class IncompleteHandshakes:
+    """
+    FlowTable sink behind the SYN flood check of the security scan.
+
+    Adds the SYN count of every evicted flow whose handshake never
+    completed to its destination, then passes the record on to sink.
+    Only the per-target totals are kept, not the flows.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.targets = Counter()
+        self.flows = 0
+
+    def __call__(self, record):
+        if record.syn_count > 0 and not record.complete_handshake:
+            self.targets[record.dst_ip] += record.syn_count
+            self.flows += 1
+        if self.sink is not None:
+            self.sink(record)
+
+
+def comprehensive_security_scan(packets, df, ip_traffic_counter, port_sketch_cutoff=None,
+                                thresholds=None, on_alert=None, signatures=None,
+                                flow_sink=None, idle_timeout=IDLE_TIMEOUT,
+                                active_timeout=ACTIVE_TIMEOUT):
+    """
+    Run all security detection algorithms.
+
+    The packet detectors share a single pass over the capture; df is not
+    used and may be None. port_sketch_cutoff is passed to the port scan detector as
+    sketch_cutoff.
+
+    thresholds is the "thresholds" section of settings.json; missing keys
+    use the defaults in scan_defaults. The SYN and ICMP rate detectors
+    report their alerts through on_alert(kind, alert) as they start,
+    during the pass.
+    With a SignatureSet, payloads are also matched against it in the same
+    pass (signature_alerts).
+
+    Connections are evicted from the flow table once idle for
+    idle_timeout or active for active_timeout seconds, so only open flows
+    are held during the pass; connections holds the flows still open at
+    the end. The SYN flood check counts the SYNs of incomplete handshakes
+    per target as flows are evicted (incomplete_handshakes is the number
+    of such flows). With a flow_sink (e.g. a FlowWriter), every evicted
+    flow is also handed to it, the open ones at the end of the pass.
+    """
+    thresholds = thresholds or {}
+    window = thresholds.get('flood_window_seconds', FLOOD_WINDOW)
+
+    def rate_alert(kind):
+        if on_alert is None:
+            return None
+        return lambda alert: on_alert(kind, alert)
+
+    incomplete = IncompleteHandshakes(flow_sink)
+    tracker = ConnectionTracker(idle_timeout, active_timeout, incomplete)
+
+    print("   🔍 Analyzing connections, port scans, ICMP floods, DNS and HTTP traffic...")
+    visitors = [
+        tracker,
+        PortScanDetector(threshold=thresholds.get('port_scan_threshold', PORT_SCAN_THRESHOLD),
+                         sketch_cutoff=port_sketch_cutoff),
+        IcmpFloodDetector(threshold=thresholds.get('icmp_flood_threshold', ICMP_FLOOD_THRESHOLD)),
+        DnsInspector(query_rate=thresholds.get('dns_query_rate', DNS_QUERY_RATE), window=window),
+        HttpInspector(),
+        SynFloodRateDetector(rate=thresholds.get('syn_flood_rate', SYN_FLOOD_RATE), window=window,
+                             on_alert=rate_alert('syn_flood')),
+        IcmpFloodRateDetector(rate=thresholds.get('icmp_flood_rate', ICMP_FLOOD_RATE),
+                              window=window, on_alert=rate_alert('icmp_flood')),
+    ]
+    if signatures is not None:
+        visitors.append(SignatureScanner(signatures))
+    results = run_visitors(packets, visitors)
+    (connections, port_scanners, icmp_flooders,
+     (dns_summary, suspicious_dns, high_freq_dns),
+     (http_requests, http_responses),
+     syn_flood_alerts, icmp_flood_alerts) = results[:7]
+    tracker.flows.flush()
     
     print("   🔍 Detecting SYN floods...")
-    syn_flood_targets, incomplete_conns = detect_syn_flood(connections, threshold=20)
-    
-    print("   🔍 Detecting ICMP floods...")
-    icmp_flooders = detect_icmp_flood(packets, threshold=50)
-    
-    print("   🔍 Analyzing DNS traffic...")
-    dns_queries, suspicious_dns, high_freq_dns = detect_dns_anomalies(packets)
-    
-    print("   🔍 Extracting HTTP information...")
-    http_requests, http_responses = extract_http_info(packets)
+    syn_flood_threshold = thresholds.get('syn_flood_threshold', SYN_FLOOD_THRESHOLD)
+    syn_flood_targets = {ip: count for ip, count in incomplete.targets.items()
+                         if count >= syn_flood_threshold}
     
     return {
         'connections': connections,
         'port_scanners': port_scanners,
         'syn_flood_targets': syn_flood_targets,
-        'incomplete_connections': incomplete_conns,
+        'incomplete_handshakes': incomplete.flows,
         'icmp_flooders': icmp_flooders,
-        'dns_queries': dns_queries,
+        'syn_flood_alerts': syn_flood_alerts,
+        'icmp_flood_alerts': icmp_flood_alerts,
+        'dns_summary': dns_summary,
         'suspicious_dns': suspicious_dns,
         'high_freq_dns': high_freq_dns,
         'http_requests': http_requests,
-        'http_responses': http_responses
+        'http_responses': http_responses,
+        'signature_alerts': results[7] if signatures is not None else []
     }
\ No newline at end of file
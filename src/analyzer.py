@@ -1,11 +1,182 @@
 # analyzer.py
-from scapy.all import rdpcap, TCP, UDP, ICMP, IP, ARP
-import pandas as pd
-from collections import Counter
+from scapy.all import PcapReader, RawPcapReader, TCP, UDP, ICMP, IP, IPv6, ARP
+import os
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def load_pcap(file_path):
+from decompressor import open_decompressed
+from fast_dissector import dissect, to_scapy, time_to_ns, NS_PER_SECOND
+from packet_table import PacketTable
+from pcap_reader import MappedPcap, open_capture
+from seek_index import IndexBuilder, SeekIndex, capture_index
+from sketches import TalkerSketch, traffic_total
+from volume_stats import MAD_SCALE
+
+# Bump whenever parse_packets output changes; it invalidates cached parses
+PARSER_VERSION = 1
+
+# Bytes of capture per worker task in parse_packet_batches
+RANGE_BYTES = 64 * 1024 * 1024
+
+
+class PcapStream:
+    """
+    Lazily iterate over the packets of a capture file.
+
+    Packets are read one at a time with scapy's PcapReader, so memory use
+    does not depend on the size of the capture. Every iteration re-opens
+    the file, which lets several analysis passes run over the same stream.
+
+    With start_ns and/or end_ns only packets with start_ns <= time <
+    end_ns are returned. Classic pcap files are then read from the byte
+    range given by their seek index (see seek_index.py); with index, a
+    full read of a classic pcap saves that index when it has none.
+
+    A PacketFilter drops the records it rejects from their raw headers,
+    before they are dissected.
+    """
+
+    def __init__(self, file_path, batch_size=10000, start_ns=None, end_ns=None, index=True,
+                 packet_filter=None):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.index = index
+        self.packet_filter = packet_filter
+
+    @property
+    def time_range(self):
+        return self.start_ns is not None or self.end_ns is not None
+
+    def __iter__(self):
+        packet_filter = self.packet_filter
+        with _open_reader(self.file_path) as reader:
+            if not self.time_range and packet_filter is None:
+                yield from reader
+                return
+            for pkt in reader:
+                if self.time_range and not _in_range(time_to_ns(pkt.time), self.start_ns, self.end_ns):
+                    continue
+                if packet_filter is None or packet_filter.match_packet(pkt):
+                    yield pkt
+
+    def records(self):
+        """
+        Iterate over (data, timestamp_ns, linktype) for every record
+        without dissecting it, for the raw-bytes fast path of
+        parse_packets.
+
+        pcap and pcapng files are memory-mapped and data is a zero-copy
+        memoryview that is only valid until the next record is requested.
+        Compressed captures are decompressed by a background thread.
+        """
+        records = self._read_records()
+        if self.packet_filter is not None:
+            records = self.packet_filter.records(records)
+        return records
+
+    def _read_records(self):
+        try:
+            capture = open_capture(self.file_path)
+        except ValueError:
+            # Anything else goes through scapy's reader
+            yield from _records_in_range(self._scapy_records(), self.start_ns, self.end_ns)
+            return
+        with capture:
+            if not isinstance(capture, MappedPcap):
+                # No offsets to seek to: filter while reading
+                yield from _records_in_range(capture.packets(), self.start_ns, self.end_ns)
+            elif self.time_range:
+                start, stop = capture_index(capture).byte_range(self.start_ns, self.end_ns)
+                yield from _records_in_range(capture.packets(start, stop), self.start_ns, self.end_ns)
+            elif self.index and SeekIndex.load(self.file_path) is None:
+                builder = IndexBuilder()
+                yield from capture.packets(index=builder)
+                stat = os.stat(self.file_path)
+                builder.finish(stat.st_size, stat.st_mtime_ns).save(self.file_path)
+            else:
+                yield from capture.packets()
+
+    def record_ranges(self, parts):
+        """
+        Split the capture into byte ranges for parallel parsing, or
+        return None if it is not a classic pcap file (pcapng records
+        depend on the interface blocks before them).
+        """
+        try:
+            with MappedPcap(self.file_path) as capture:
+                if not self.time_range:
+                    return capture.split(parts)
+                start, stop = capture_index(capture).byte_range(self.start_ns, self.end_ns)
+                return capture.split(parts, start, stop)
+        except ValueError:
+            return None
+
+    def _scapy_records(self):
+        with RawPcapReader(self.file_path) as reader:
+            if hasattr(reader, "interfaces"):
+                # pcapng: link type and resolution are per interface
+                for data, meta in reader:
+                    timestamp_ns = 0
+                    if meta.tshigh is not None:
+                        timestamp_ns = ((meta.tshigh << 32) + meta.tslow) * NS_PER_SECOND // meta.tsresol
+                    yield data, timestamp_ns, meta.linktype
+            else:
+                frac_ns = 1 if reader.nano else 1000
+                linktype = reader.linktype
+                for data, meta in reader:
+                    yield data, meta.sec * NS_PER_SECOND + meta.usec * frac_ns, linktype
+
+    def batches(self, batch_size=None):
+        """Yield lists of at most batch_size packets"""
+        return _batched(self, batch_size or self.batch_size)
+
+
+def _open_reader(file_path):
+    """scapy PcapReader over the capture, decompressing gzip/xz/zstd input"""
+    decompressed = open_decompressed(file_path)
     try:
-        packets = rdpcap(file_path)
+        return PcapReader(decompressed if decompressed is not None else file_path)
+    except Exception:
+        if decompressed is not None:
+            decompressed.close()
+        raise
+
+
+def load_pcap(file_path, stream=False, batch_size=10000, start_ns=None, end_ns=None, index=True,
+              packet_filter=None):
+    """
+    Load a capture file.
+
+    pcap and pcapng files may be gzip, xz or zstd compressed; the format
+    is detected from the magic bytes. With stream=True a PcapStream is
+    returned instead of a PacketList, and packets are only read while the
+    stream is being iterated.
+
+    start_ns and end_ns (epoch nanoseconds) keep only the packets with
+    start_ns <= time < end_ns. A stream seeks straight to them in classic
+    pcap files, through the sidecar index that is built on first use
+    (index=False stops full reads from building it).
+
+    packet_filter, a packet_filter.PacketFilter, keeps only the packets
+    it accepts; a stream tests the raw headers before dissecting.
+    """
+    try:
+        if stream:
+            # Open once so that a missing or corrupt file is reported here
+            with _open_reader(file_path):
+                pass
+            print(f"Streaming packets from {file_path}")
+            return PcapStream(file_path, batch_size=batch_size, start_ns=start_ns, end_ns=end_ns,
+                              index=index, packet_filter=packet_filter)
+        with _open_reader(file_path) as reader:
+            packets = reader.read_all()
+        if start_ns is not None or end_ns is not None:
+            packets = packets.filter(lambda pkt: _in_range(time_to_ns(pkt.time), start_ns, end_ns))
+        if packet_filter is not None:
+            packets = packets.filter(packet_filter.match_packet)
         print(f"Loaded {len(packets)} packets from {file_path}")
         return packets
     except FileNotFoundError:
@@ -15,59 +186,244 @@ def load_pcap(file_path):
         print(f"Error reading PCAP file: {e}")
         return []
 
-def parse_packets(packets):
-    """Extract packet info and detect all protocols."""
-    data = []
-    protocol_counter = Counter()
-    main_protocol_counter = Counter()
-    ip_traffic_counter = Counter()
 
+def _in_range(timestamp_ns, start_ns, end_ns):
+    return (start_ns is None or timestamp_ns >= start_ns) and (end_ns is None or timestamp_ns < end_ns)
+
+
+def _records_in_range(records, start_ns=None, end_ns=None):
+    """Records with start_ns <= timestamp_ns < end_ns"""
+    if start_ns is None and end_ns is None:
+        return records
+    return (record for record in records if _in_range(record[1], start_ns, end_ns))
+
+
+def _batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _scapy_fields(pkt):
+    """
+    Extract addresses, ports and the layer signature from a scapy packet.
+
+    The signature is the tuple of layer classes; PacketTable names each
+    distinct signature once instead of joining layer names per packet.
+    """
+    if pkt.haslayer(IP):
+        src_ip, dst_ip = pkt[IP].src, pkt[IP].dst
+    elif pkt.haslayer(IPv6):
+        src_ip, dst_ip = pkt[IPv6].src, pkt[IPv6].dst
+    elif pkt.haslayer(ARP):
+        src_ip, dst_ip = pkt[ARP].psrc, pkt[ARP].pdst
+    else:
+        src_ip, dst_ip = "", ""
+    src_port = pkt[TCP].sport if pkt.haslayer(TCP) else (pkt[UDP].sport if pkt.haslayer(UDP) else None)
+    dst_port = pkt[TCP].dport if pkt.haslayer(TCP) else (pkt[UDP].dport if pkt.haslayer(UDP) else None)
+
+    # Detect layers
+    layers = []
+    current_layer = pkt
+    while current_layer:
+        layers.append(current_layer.__class__)
+        current_layer = current_layer.payload
+
+    return src_ip, dst_ip, src_port, dst_port, tuple(layers)
+
+
+def _iter_fields(packets):
+    """
+    Yield (timestamp_ns, length, fields) for every packet.
+
+    Streams expose their raw records, which go through the fast
+    dissector; only records it cannot classify are built with scapy.
+    """
+    if hasattr(packets, "records"):
+        yield from _iter_record_fields(packets.records())
+        return
     for pkt in packets:
         try:
-            src_ip = pkt[IP].src if pkt.haslayer(IP) else (pkt[ARP].psrc if pkt.haslayer(ARP) else "")
-            dst_ip = pkt[IP].dst if pkt.haslayer(IP) else (pkt[ARP].pdst if pkt.haslayer(ARP) else "")
-            length = len(pkt)
-            timestamp = pkt.time
-            src_port = pkt[TCP].sport if pkt.haslayer(TCP) else (pkt[UDP].sport if pkt.haslayer(UDP) else None)
-            dst_port = pkt[TCP].dport if pkt.haslayer(TCP) else (pkt[UDP].dport if pkt.haslayer(UDP) else None)
-
-            # Detect layers
-            layers = []
-            current_layer = pkt
-            while current_layer:
-                layers.append(current_layer.name)
-                if not hasattr(current_layer, "payload") or current_layer.payload is None:
-                    break
-                current_layer = current_layer.payload
-
-            full_protocol = " -> ".join(layers)
-            main_protocol = layers[-1] if layers else "UNKNOWN"
-
-            data.append({
-                "timestamp": timestamp,
-                "src_ip": src_ip,
-                "dst_ip": dst_ip,
-                "src_port": src_port,
-                "dst_port": dst_port,
-                "main_protocol": main_protocol,
-                "full_protocol": full_protocol,
-                "length": length
-            })
-
-            protocol_counter[full_protocol] += 1
-            main_protocol_counter[main_protocol] += 1
-            if src_ip:
-                ip_traffic_counter[src_ip] += length
-            if dst_ip:
-                ip_traffic_counter[dst_ip] += length
+            yield time_to_ns(pkt.time), len(pkt), _scapy_fields(pkt)
+        except Exception as e:
+            print(f"Skipping packet due to error: {e}")
 
+
+def _iter_record_fields(records):
+    for data, timestamp_ns, linktype in records:
+        try:
+            fields = dissect(data, linktype)
+            if fields is not None:
+                yield timestamp_ns, len(data), fields
+            else:
+                pkt = to_scapy(data, linktype)
+                yield timestamp_ns, len(pkt), _scapy_fields(pkt)
         except Exception as e:
             print(f"Skipping packet due to error: {e}")
 
-    df = pd.DataFrame(data)
+
+def _fill_table(table, packet_fields, limit=None):
+    """Append up to limit parsed packets to table, returns the count"""
+    added = 0
+    append = table.append
+    for timestamp_ns, length, (src_ip, dst_ip, src_port, dst_port, layers) in packet_fields:
+        append(timestamp_ns, src_ip, dst_ip, src_port, dst_port, layers, length)
+        added += 1
+        if added == limit:
+            break
+    return added
+
+
+def _parse_range(file_path, start, stop, talkers=None, batch_size=10000, start_ns=None, end_ns=None,
+                 packet_filter=None):
+    """
+    Worker: parse the records in one byte range of a pcap file, keeping
+    those with start_ns <= time < end_ns that pass packet_filter.
+
+    Returns the table and, if given an empty TalkerSketch, that sketch
+    filled with the range's per-IP bytes for the parent to merge.
+    """
+    table = PacketTable()
+    with MappedPcap(file_path) as capture:
+        records = _records_in_range(capture.packets(start, stop), start_ns, end_ns)
+        if packet_filter is not None:
+            records = packet_filter.records(records)
+        packet_fields = _iter_record_fields(records)
+        if talkers is None:
+            _fill_table(table, packet_fields)
+        else:
+            row = 0
+            while _fill_table(table, packet_fields, batch_size):
+                talkers.update(table.ip_traffic(row))
+                row = len(table)
+    return table, talkers
+
+
+def parse_packets(packets, workers=1, monitor=None, talkers=None):
+    """
+    Extract packet info and detect all protocols.
+
+    Returns the columnar packet table described in packet_table.py and
+    the full-protocol, main-protocol and per-IP byte counters.
+    parse_packet_batches gives the same table one batch at a time, for
+    consumers that do not need it whole.
+
+    With workers > 1 (0 = one per CPU) a streamed pcap file is split into
+    record ranges that are parsed in a process pool; the partial tables
+    are merged in capture order, so the result is identical to a serial
+    parse.
+
+    A SuspiciousTrafficMonitor passed as monitor is fed the per-IP bytes
+    of every batch (or partial table) as soon as it has been parsed, so
+    it can raise alerts before the whole capture is read. It keeps its
+    own bounded running totals, so it can be combined with talkers.
+
+    With talkers, an empty TalkerSketch, per-IP bytes are added to the
+    sketch batch by batch (each worker fills its own sketch, merged
+    into talkers) and the sketch is returned instead of the per-IP
+    Counter. The sketch bounds the byte counts and the top-talker
+    sorts; the table still interns every address for the src_ip and
+    dst_ip categories of the DataFrame.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = None
+    if workers > 1 and hasattr(packets, "record_ranges"):
+        ranges = packets.record_ranges(workers)
+
+    table = PacketTable()
+    if ranges and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            partials = pool.map(_parse_range, [packets.file_path] * len(ranges),
+                                *zip(*ranges), [talkers] * len(ranges),
+                                [packets.batch_size] * len(ranges),
+                                [packets.start_ns] * len(ranges), [packets.end_ns] * len(ranges),
+                                [packets.packet_filter] * len(ranges))
+            for partial, partial_talkers in partials:
+                start = len(table)
+                table.extend(partial)
+                if talkers is not None:
+                    talkers.merge(partial_talkers)
+                if monitor is not None:
+                    monitor.observe(table.ip_traffic(start))
+    elif monitor is not None or talkers is not None:
+        packet_fields = _iter_fields(packets)
+        batch_size = getattr(packets, "batch_size", 10000)
+        start = 0
+        while _fill_table(table, packet_fields, batch_size):
+            ip_traffic = table.ip_traffic(start)
+            if talkers is not None:
+                talkers.update(ip_traffic)
+            if monitor is not None:
+                monitor.observe(ip_traffic)
+            start = len(table)
+    else:
+        _fill_table(table, _iter_fields(packets))
+
+    df = table.to_dataframe()
+    protocol_counter, main_protocol_counter = table.protocol_counters()
+    ip_traffic_counter = table.ip_traffic() if talkers is None else talkers
     return df, protocol_counter, main_protocol_counter, ip_traffic_counter
 
-def detect_suspicious(ip_traffic_counter, threshold=1048576, adaptive=False, factor=2):
+
+def parse_packet_batches(packets, protocol_counter, main_protocol_counter, ip_traffic_counter,
+                         workers=1, monitor=None):
+    """
+    Parse packets incrementally, without building the whole table.
+
+    Yields one DataFrame (see packet_table.py) per batch of
+    packets.batch_size packets, 10000 for a packet list, and adds each
+    batch to the three counters in place; ip_traffic_counter may be a
+    TalkerSketch. A batch only interns its own addresses, so only the
+    counters grow with the capture. A SuspiciousTrafficMonitor passed
+    as monitor observes every batch as it is parsed.
+
+    With workers > 1 (0 = one per CPU) a streamed pcap file is split into
+    record ranges of about RANGE_BYTES parsed in a process pool, with at
+    most two ranges per worker in flight; each range is yielded as one
+    DataFrame, in capture order.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = None
+    if workers > 1 and hasattr(packets, "record_ranges"):
+        parts = max(workers, -(-os.path.getsize(packets.file_path) // RANGE_BYTES))
+        ranges = packets.record_ranges(parts)
+
+    def add(table):
+        protocols, main_protocols, ip_traffic = table.counters()
+        protocol_counter.update(protocols)
+        main_protocol_counter.update(main_protocols)
+        ip_traffic_counter.update(ip_traffic)
+        if monitor is not None:
+            monitor.observe(ip_traffic)
+        return table.to_dataframe()
+
+    if ranges and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for start, stop in ranges:
+                pending.append(pool.submit(_parse_range, packets.file_path, start, stop, None,
+                                           packets.batch_size, packets.start_ns, packets.end_ns,
+                                           packets.packet_filter))
+                if len(pending) >= 2 * workers:
+                    yield add(pending.popleft().result()[0])
+            while pending:
+                yield add(pending.popleft().result()[0])
+        return
+
+    table = PacketTable()
+    packet_fields = _iter_fields(packets)
+    while _fill_table(table, packet_fields, getattr(packets, "batch_size", 10000)):
+        yield add(table)
+        table.clear_rows()
+
+
+def detect_suspicious(ip_traffic_counter, threshold=1048576, adaptive=False, factor=2,
+                      method=None, percentile=99.0):
     """
     Detect suspicious IPs based on traffic volume.
     
@@ -75,24 +431,53 @@ def detect_suspicious(ip_traffic_counter, threshold=1048576, adaptive=False, fac
     - ip_traffic_counter: Counter of bytes per IP
     - threshold: static threshold in bytes (default 1 MB)
     - adaptive: if True, compute threshold based on average traffic
-    - factor: multiplier for average if adaptive is True
+    - factor: multiplier for average if adaptive is True, number of
+      scaled MADs above the median for method 'mad'
+    - method: 'static', 'mean', 'percentile' or 'mad' (default: 'mean'
+      if adaptive is True, else 'static')
+    - percentile: percentile of per-IP traffic used by method 'percentile'
+
+    The percentile and MAD thresholds are computed exactly from the
+    per-IP byte counts.
+
+    ip_traffic_counter may also be a TalkerSketch, for the static and mean
+    methods. Only the IPs the sketch keeps are candidates; every IP with
+    more than total / capacity bytes is among them.
     """
     suspicious_ips = []
+    if method is None:
+        method = "mean" if adaptive else "static"
 
-    if adaptive:
+    if method in ("percentile", "mad"):
+        if isinstance(ip_traffic_counter, TalkerSketch):
+            raise ValueError(f"The {method} threshold needs exact per-IP counts, not a TalkerSketch")
+        if not ip_traffic_counter:
+            return []
+        volumes = np.fromiter(ip_traffic_counter.values(), dtype=np.float64, count=len(ip_traffic_counter))
+        if method == "percentile":
+            robust_threshold = np.percentile(volumes, percentile)
+        else:
+            median = np.median(volumes)
+            robust_threshold = median + factor * MAD_SCALE * np.median(np.abs(volumes - median))
+        for ip, total_bytes in ip_traffic_counter.items():
+            if total_bytes > robust_threshold:
+                suspicious_ips.append(ip)
+    elif method == "mean":
         # Compute average traffic per IP
         if not ip_traffic_counter:
             return []
-        avg_traffic = sum(ip_traffic_counter.values()) / len(ip_traffic_counter)
+        avg_traffic = traffic_total(ip_traffic_counter) / len(ip_traffic_counter)
         adaptive_threshold = avg_traffic * factor
         # print(f"Adaptive threshold: {adaptive_threshold} bytes")  # Optional debug
         for ip, total_bytes in ip_traffic_counter.items():
             if total_bytes > adaptive_threshold:
                 suspicious_ips.append(ip)
-    else:
+    elif method == "static":
         # Static threshold
         for ip, total_bytes in ip_traffic_counter.items():
             if total_bytes > threshold:
                 suspicious_ips.append(ip)
+    else:
+        raise ValueError(f"Unknown threshold method: {method}")
 
     return suspicious_ips
@@ -0,0 +1,47 @@
+# batch_reports.py
+"""
+Report inputs built from a packet table fed one DataFrame at a time.
+
+With streaming input, main does not build the whole packet table: each
+DataFrame of parse_packet_batches (or of ParseCache.batches) is folded
+into the rollups, the timelines, the packet export and the chart inputs,
+then dropped. What stays in memory follows those aggregates (rollup rows
+of the active buckets, distinct addresses and address pairs, packet
+lengths) rather than the number of packets, and the outputs are the
+ones the same stages produce from the whole table.
+"""
+
+from collections import Counter
+
+from report_generator import PacketReportWriter
+from rollup_store import RollupBuilder
+from timeline import TimelineBuilder
+from visualizer import packet_size_counts, ip_pair_counts
+
+
+class BatchReports:
+    """
+    Rollups, timelines, packet reports and chart inputs of the batches
+    added so far. close() finishes the packet reports.
+    """
+
+    def __init__(self, exports_dir="reports", max_talkers=1000):
+        self.rollups = RollupBuilder(max_talkers=max_talkers)
+        self.timelines = TimelineBuilder()
+        self.packet_reports = PacketReportWriter(exports_dir)
+        self.size_counts = Counter()
+        self.pair_counts = Counter()
+
+    @property
+    def packets(self):
+        return self.rollups.packets
+
+    def add(self, df):
+        self.rollups.add(df)
+        self.timelines.add(df)
+        self.packet_reports.add(df)
+        self.size_counts.update(packet_size_counts(df))
+        self.pair_counts.update(ip_pair_counts(df))
+
+    def close(self):
+        self.packet_reports.close()
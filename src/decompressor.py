@@ -0,0 +1,132 @@
+# decompressor.py
+"""
+Transparent input decompression for gzip, xz and zstd captures.
+
+The compression format is detected from the magic bytes, not the file
+name. A background thread decompresses the file into a bounded queue of
+chunks, and the parser reads from that queue. zlib, lzma and zstandard
+release the GIL while they work, so decompression runs on another core
+alongside parsing. Memory use stays at a few chunks whatever the size of
+the capture.
+"""
+
+import gzip
+import io
+import lzma
+import queue
+import threading
+
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+CHUNK_SIZE = 1 << 20
+MAX_CHUNKS = 8
+
+
+def _open_zstd(file_path):
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading .zst captures requires the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(
+        open(file_path, "rb"), read_across_frames=True, closefd=True
+    )
+
+
+COMPRESSION_FORMATS = (
+    (GZIP_MAGIC, lambda file_path: gzip.open(file_path, "rb")),
+    (XZ_MAGIC, lambda file_path: lzma.open(file_path, "rb")),
+    (ZSTD_MAGIC, _open_zstd),
+)
+
+
+def compression_opener(header):
+    """Opener for the compression format whose magic starts header, or None"""
+    for magic, opener in COMPRESSION_FORMATS:
+        if header.startswith(magic):
+            return opener
+    return None
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    """
+    Raw binary stream that reads a decompressing file object in a thread.
+
+    The thread keeps at most max_chunks decompressed chunks of chunk_size
+    bytes queued ahead of the reader. A stream that is corrupt or cut
+    short ends at the last byte that could be decompressed, as it would
+    with scapy's gzip reader.
+    """
+
+    def __init__(self, source, name, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        super().__init__()
+        self.name = name
+        self._chunks = queue.Queue(max_chunks)
+        self._chunk = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._decompress, args=(source, chunk_size), daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item):
+        """Queue item unless the reader has been closed"""
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, source, chunk_size):
+        try:
+            with source:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk or not self._put(chunk):
+                        break
+        except Exception as e:
+            print(f"⚠ Decompression of {self.name} stopped early: {e}")
+        self._put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            # Unblock the thread if it is waiting on a full queue
+            while not self._chunks.empty():
+                self._chunks.get_nowait()
+            self._thread.join()
+        super().close()
+
+
+def open_decompressed(file_path):
+    """
+    Return a buffered reader over the decompressed contents of file_path,
+    or None if the file is not compressed.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(len(XZ_MAGIC))
+    opener = compression_opener(header)
+    if opener is None:
+        return None
+    return io.BufferedReader(ThreadedDecompressor(opener(file_path), file_path), buffer_size=CHUNK_SIZE)
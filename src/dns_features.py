@@ -0,0 +1,244 @@
+# dns_features.py
+"""
+Batched DNS query-name features and tunneling scores.
+
+Query names are collected as raw bytes and processed a batch at a time:
+length, label count, longest label, Shannon entropy and character-class
+ratios are computed for the whole batch with NumPy. Each name gets a
+tunneling score from these features. DnsQueryStats keeps per-source
+counts in Space-Saving sketches, a rolling query rate per source and the
+highest-scoring queries, so memory grows neither with the number of
+queries nor with the number of sources.
+"""
+
+import heapq
+from collections import Counter
+
+import numpy as np
+
+from rate_detector import SlidingRateDetector
+from scan_defaults import DNS_QUERY_RATE, FLOOD_WINDOW
+from sketches import TalkerSketch
+
+# Scoring rules: (feature, threshold, points, reason)
+LONG_NAME = 50
+LONG_LABEL = 40
+HIGH_ENTROPY = 4.0
+DIGIT_RATIO = 0.3
+SCORE_RULES = (
+    ('length', LONG_NAME, 2, 'Unusually long domain name (potential DNS tunneling)'),
+    ('longest_label', LONG_LABEL, 1, 'Long label'),
+    ('entropy', HIGH_ENTROPY, 1, 'High entropy'),
+    ('digit_ratio', DIGIT_RATIO, 1, 'Many digits'),
+)
+# Queries scoring at least this are reported as suspicious
+SUSPICIOUS_SCORE = 2
+
+_DOT = ord('.')
+_DIGITS = np.zeros(256, dtype=bool)
+_DIGITS[ord('0'):ord('9') + 1] = True
+_LETTERS = np.zeros(256, dtype=bool)
+_LETTERS[ord('a'):ord('z') + 1] = True
+_LETTERS[ord('A'):ord('Z') + 1] = True
+
+
+def name_features(names):
+    """
+    Features of a list of query names (bytes, e.g. b'www.example.com.').
+
+    Returns a dict of arrays, one value per name: length (as written,
+    with the root dot), labels, longest_label, entropy (bits per
+    character), and letter_ratio, digit_ratio and other_ratio over the
+    characters that are not dots.
+    """
+    count = len(names)
+    lengths = np.fromiter(map(len, names), dtype=np.int64, count=count)
+    data = np.frombuffer(b''.join(names), dtype=np.uint8)
+    owner = np.repeat(np.arange(count), lengths)
+
+    # Shannon entropy from the byte counts of each name
+    pairs, pair_counts = np.unique((owner << 8) | data, return_counts=True)
+    pair_owner = pairs >> 8
+    probability = pair_counts / lengths[pair_owner]
+    entropy = -np.bincount(pair_owner, weights=probability * np.log2(probability),
+                           minlength=count)
+
+    # Labels: a new label starts at each name and after each dot
+    dots = data == _DOT
+    starts = np.zeros(len(data), dtype=bool)
+    starts[np.cumsum(lengths)[:-1][lengths[1:] > 0]] = True
+    if len(data):
+        starts[0] = True
+    label_ids = np.cumsum(starts | np.concatenate(([False], dots[:-1]))) - 1
+    label_lengths = np.bincount(label_ids[~dots], minlength=label_ids[-1] + 1 if len(data) else 0)
+    label_owner = np.zeros(len(label_lengths), dtype=np.int64)
+    label_owner[label_ids] = owner
+    labels = np.bincount(label_owner[label_lengths > 0], minlength=count)
+    longest_label = np.zeros(count, dtype=np.int64)
+    np.maximum.at(longest_label, label_owner, label_lengths)
+
+    characters = np.maximum(lengths - np.bincount(owner[dots], minlength=count), 1)
+    letters = np.bincount(owner[_LETTERS[data]], minlength=count)
+    digits = np.bincount(owner[_DIGITS[data]], minlength=count)
+    others = characters - letters - digits
+    return {
+        'length': lengths,
+        'labels': labels,
+        'longest_label': longest_label,
+        'entropy': entropy,
+        'letter_ratio': letters / characters,
+        'digit_ratio': digits / characters,
+        'other_ratio': np.maximum(others, 0) / characters,
+    }
+
+
+def tunneling_scores(features):
+    """Score of each name and the indices of the rules it triggered"""
+    scores = np.zeros(len(features['length']), dtype=np.int64)
+    triggered = []
+    for feature, threshold, points, _reason in SCORE_RULES:
+        hit = features[feature] > threshold
+        scores += hit * points
+        triggered.append(hit)
+    return scores, np.array(triggered).reshape(len(SCORE_RULES), -1)
+
+
+class DnsQueryStats:
+    """
+    Aggregate DNS queries in batches of batch_size.
+
+    Per source it counts queries, suspicious queries and the score total
+    in TalkerSketches of max_sources entries, so the busiest sources are
+    exact (or overstated by a bounded error once more than max_sources
+    sources were seen), and keeps the maximum score of the sources kept by
+    the suspicious sketch. A rolling query rate over window seconds
+    raises an alert at query_rate queries per second. Of the suspicious
+    queries only the max_offenders highest scoring are kept.
+    """
+
+    def __init__(self, batch_size=4096, max_offenders=100, query_rate=DNS_QUERY_RATE,
+                 window=FLOOD_WINDOW, max_sources=1000):
+        self.batch_size = batch_size
+        self.max_offenders = max_offenders
+        self.rates = SlidingRateDetector(query_rate, window)
+        self._sources = []
+        self._names = []
+        self.query_counts = TalkerSketch(capacity=max_sources)
+        self.suspicious_counts = TalkerSketch(capacity=max_sources)
+        self.score_totals = TalkerSketch(capacity=max_sources)
+        self.max_scores = {}
+        self.queries = 0
+        self.length_total = 0
+        self.max_length = 0
+        self.entropy_total = 0.0
+        self._offenders = []
+        self._sequence = 0
+
+    def add(self, src_ip, qname, timestamp_ns=None):
+        """Record one query; qname is the raw name in bytes"""
+        self._sources.append(src_ip)
+        self._names.append(qname)
+        if timestamp_ns is not None:
+            self.rates.add(src_ip, timestamp_ns)
+        if len(self._names) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Score the pending batch"""
+        if not self._names:
+            return
+        names, sources = self._names, self._sources
+        self._names, self._sources = [], []
+        features = name_features(names)
+        scores, triggered = tunneling_scores(features)
+
+        self.queries += len(names)
+        self.length_total += int(features['length'].sum())
+        self.max_length = max(self.max_length, int(features['length'].max()))
+        self.entropy_total += float(features['entropy'].sum())
+
+        suspicious = scores >= SUSPICIOUS_SCORE
+        score_totals = Counter()
+        suspicious_counts = Counter()
+        max_scores = self.max_scores
+        for src_ip, score, flagged in zip(sources, scores.tolist(), suspicious.tolist()):
+            score_totals[src_ip] += score
+            if flagged:
+                suspicious_counts[src_ip] += 1
+                if score > max_scores.get(src_ip, 0):
+                    max_scores[src_ip] = score
+        self.query_counts.update(Counter(sources))
+        self.score_totals.update(+score_totals)
+        if suspicious_counts:
+            self.suspicious_counts.update(suspicious_counts)
+            kept = self.suspicious_counts.counts
+            if len(max_scores) > len(kept):
+                self.max_scores = {src_ip: score for src_ip, score in max_scores.items() if src_ip in kept}
+
+        for index in np.flatnonzero(suspicious):
+            entry = (int(scores[index]), -self._sequence, index)
+            self._sequence += 1
+            if len(self._offenders) >= self.max_offenders and entry[:2] <= self._offenders[0][:2]:
+                continue
+            reasons = [rule[3] for rule, hit in zip(SCORE_RULES, triggered[:, index]) if hit]
+            record = {
+                'src_ip': sources[index],
+                'query': names[index].decode('utf-8', 'replace'),
+                'reason': '; '.join(reasons),
+                'score': int(scores[index]),
+                'length': int(features['length'][index]),
+                'entropy': round(float(features['entropy'][index]), 2),
+            }
+            item = (entry[0], entry[1], record)
+            if len(self._offenders) < self.max_offenders:
+                heapq.heappush(self._offenders, item)
+            else:
+                heapq.heapreplace(self._offenders, item)
+
+    def offenders(self):
+        """The kept suspicious queries, highest score first"""
+        return [record for _score, _order, record in sorted(self._offenders, key=lambda item: item[:2],
+                                                            reverse=True)]
+
+    @property
+    def estimated(self):
+        """True once a sketch had to drop sources, making the per-source counts estimates"""
+        return any(sketch.floor for sketch in (self.query_counts, self.suspicious_counts, self.score_totals))
+
+    def source_count(self):
+        """Distinct sources: exact until a source was dropped, then a HyperLogLog estimate"""
+        if self.query_counts.floor:
+            return len(self.query_counts)
+        return len(self.query_counts.counts)
+
+    def high_frequency_sources(self, threshold=100):
+        """{source: queries} of the kept sources with more than threshold queries"""
+        self.flush()
+        return {src_ip: count for src_ip, count in self.query_counts.items() if count > threshold}
+
+    def summary(self, top=20):
+        """Aggregates, the top tunneling candidates and the rate alerts"""
+        self.flush()
+        candidates = sorted(
+            self.suspicious_counts.items(),
+            key=lambda item: (item[1], self.score_totals.estimate(item[0])), reverse=True
+        )[:top]
+        return {
+            'total_queries': self.queries,
+            'sources': self.source_count(),
+            'estimated': self.estimated,
+            'mean_length': self.length_total / self.queries if self.queries else 0.0,
+            'max_length': self.max_length,
+            'mean_entropy': self.entropy_total / self.queries if self.queries else 0.0,
+            'tunneling_candidates': [
+                {
+                    'src_ip': src_ip,
+                    'queries': self.query_counts.estimate(src_ip),
+                    'suspicious_queries': suspicious_queries,
+                    'mean_score': self.score_totals.estimate(src_ip) / self.query_counts.estimate(src_ip),
+                    'max_score': self.max_scores.get(src_ip, SUSPICIOUS_SCORE),
+                }
+                for src_ip, suspicious_queries in candidates
+            ],
+            'rate_alerts': self.rates.close(),
+        }
@@ -0,0 +1,289 @@
+# fast_dissector.py
+"""
+Raw-bytes fast path for parse_packets.
+
+Decodes the common Ethernet / 802.1Q / IPv4 / IPv6 / ARP / TCP / UDP / ICMP
+header stacks straight from the record bytes with struct, without building
+scapy packet objects. Anything that scapy would dissect differently (other
+link types, IP options, fragments, ICMP errors, ports bound to an
+application layer, truncated frames...) is left to scapy: dissect() returns
+None for those records and the caller falls back to the scapy path.
+"""
+
+import socket
+import struct
+from decimal import Decimal
+
+from scapy.all import conf, TCP, UDP, DNS
+from scapy.utils import EDecimal
+
+LINKTYPE_ETHERNET = 1
+NS_PER_SECOND = 1_000_000_000
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_8021Q = 0x8100
+ETH_P_IPV6 = 0x86DD
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+# ICMP types whose payload scapy dissects as a plain Raw layer
+_ICMP_ECHO_TYPES = (0, 8)
+
+_ETHER_TYPE = struct.Struct("!H")
+_IPV4_HEADER = struct.Struct("!BxHxxHxB")      # ver/ihl, len, flags/frag, proto
+_IPV6_HEADER = struct.Struct("!xxxxHB")         # plen, nh
+_ARP_HEADER = struct.Struct("!HHBBH")           # hwtype, ptype, hwlen, plen, op
+_PORTS = struct.Struct("!HH")
+_TCP_SEQ = struct.Struct("!I")
+_UDP_LENGTH = struct.Struct("!H")
+
+_inet_ntoa = socket.inet_ntoa
+_inet_ntop = socket.inet_ntop
+_AF_INET6 = socket.AF_INET6
+
+
+def _bound_ports(layer, payload_cls=None):
+    """Ports for which scapy dissects the payload as an application layer"""
+    ports = set()
+    for fields, cls in layer.payload_guess:
+        if payload_cls is not None and cls is not payload_cls:
+            continue
+        for name in ("sport", "dport"):
+            if name in fields:
+                ports.add(fields[name])
+    return frozenset(ports)
+
+
+TCP_BOUND_PORTS = _bound_ports(TCP)
+UDP_BOUND_PORTS = _bound_ports(UDP)
+DNS_TCP_PORTS = _bound_ports(TCP, DNS)
+DNS_UDP_PORTS = _bound_ports(UDP, DNS)
+
+
+def time_to_ns(timestamp):
+    """Convert a packet time in seconds to integer nanoseconds"""
+    return int(Decimal(timestamp) * NS_PER_SECOND)
+
+
+def ns_to_time(timestamp_ns):
+    """Convert integer nanoseconds to a scapy packet time"""
+    return EDecimal(timestamp_ns) / NS_PER_SECOND
+
+
+def to_scapy(data, linktype=LINKTYPE_ETHERNET, timestamp_ns=None):
+    """Dissect a raw record with scapy, the same way PcapReader does"""
+    data = bytes(data)
+    try:
+        pkt = conf.l2types.num2layer[linktype](data)
+    except Exception:
+        pkt = conf.raw_layer(data)
+    if timestamp_ns is not None:
+        pkt.time = ns_to_time(timestamp_ns)
+    return pkt
+
+
+def _network(data, linktype):
+    """
+    Decode the link and network headers.
+
+    Returns (layers, src_start, dst_start, proto, offset, end) where
+    layers is the tuple of layer names so far, data[src_start:] and
+    data[dst_start:] hold the source and destination addresses (4 bytes,
+    16 for IPv6) and offset and end delimit the network-layer payload
+    (proto is None for ARP), or None for anything the fast path does not
+    handle.
+    """
+    if linktype != LINKTYPE_ETHERNET or len(data) < 14:
+        return None
+
+    size = len(data)
+    layers = ("Ethernet",)
+    ether_type = _ETHER_TYPE.unpack_from(data, 12)[0]
+    offset = 14
+    if ether_type == ETH_P_8021Q:
+        if size < 18:
+            return None
+        layers = ("Ethernet", "802.1Q")
+        ether_type = _ETHER_TYPE.unpack_from(data, 16)[0]
+        offset = 18
+
+    if ether_type == ETH_P_IP:
+        if size - offset < 20:
+            return None
+        ver_ihl, total_len, frag, proto = _IPV4_HEADER.unpack_from(data, offset)
+        # IP options and fragments are left to scapy
+        if ver_ihl != 0x45 or frag & 0x3FFF:
+            return None
+        end = offset + total_len
+        if total_len < 20 or end > size:
+            return None
+        return layers + ("IP",), offset + 12, offset + 16, proto, offset + 20, end
+
+    if ether_type == ETH_P_IPV6:
+        if size - offset < 40 or data[offset] >> 4 != 6:
+            return None
+        payload_len, next_header = _IPV6_HEADER.unpack_from(data, offset)
+        end = offset + 40 + payload_len
+        # Jumbograms and extension headers are left to scapy
+        if payload_len == 0 or end > size:
+            return None
+        if next_header not in (IPPROTO_TCP, IPPROTO_UDP):
+            return None
+        return layers + ("IPv6",), offset + 8, offset + 24, next_header, offset + 40, end
+
+    if ether_type == ETH_P_ARP:
+        if size - offset < 28:
+            return None
+        hwtype, ptype, hwlen, plen, _op = _ARP_HEADER.unpack_from(data, offset)
+        if hwtype != 1 or ptype != ETH_P_IP or hwlen != 6 or plen != 4:
+            return None
+        return layers + ("ARP",), offset + 14, offset + 24, None, offset + 28, offset + 28
+
+    return None
+
+
+def _address(data, start, network):
+    """Text form of the address at data[start:] of an "IP", "IPv6" or "ARP" layer"""
+    if network == "IPv6":
+        return _inet_ntop(_AF_INET6, data[start:start + 16])
+    return _inet_ntoa(data[start:start + 4])
+
+
+def _transport(data, offset, end, proto):
+    """
+    Decode the TCP/UDP/ICMP header at offset.
+
+    Returns (src_port, dst_port, layers) with the tuple of transport layer
+    names, or None when scapy has to take over.
+    """
+    if proto is None:
+        return None, None, ()
+
+    if proto == IPPROTO_TCP:
+        if end - offset < 20:
+            return None
+        sport, dport = _PORTS.unpack_from(data, offset)
+        if sport in TCP_BOUND_PORTS or dport in TCP_BOUND_PORTS:
+            return None
+        header_len = (data[offset + 12] >> 4) * 4
+        if header_len < 20 or offset + header_len > end:
+            return None
+        if end > offset + header_len:
+            return sport, dport, ("TCP", "Raw")
+        return sport, dport, ("TCP",)
+
+    if proto == IPPROTO_UDP:
+        if end - offset < 8:
+            return None
+        sport, dport = _PORTS.unpack_from(data, offset)
+        if sport in UDP_BOUND_PORTS or dport in UDP_BOUND_PORTS:
+            return None
+        if _UDP_LENGTH.unpack_from(data, offset + 4)[0] != end - offset:
+            return None
+        if end > offset + 8:
+            return sport, dport, ("UDP", "Raw")
+        return sport, dport, ("UDP",)
+
+    if proto == IPPROTO_ICMP:
+        if end - offset < 8 or data[offset] not in _ICMP_ECHO_TYPES:
+            return None
+        if end > offset + 8:
+            return None, None, ("ICMP", "Raw")
+        return None, None, ("ICMP",)
+
+    return None
+
+
+def dissect(data, linktype=LINKTYPE_ETHERNET):
+    """
+    Decode one capture record.
+
+    Returns (src_ip, dst_ip, src_port, dst_port, layers) with the same
+    values parse_packets extracts through scapy, layers being the tuple
+    of layer names, or None if the record has to be dissected by scapy.
+    """
+    network = _network(data, linktype)
+    if network is None:
+        return None
+    layers, src_start, dst_start, proto, offset, end = network
+    transport = _transport(data, offset, end, proto)
+    if transport is None:
+        return None
+    src_port, dst_port, transport_layers = transport
+    network = layers[-1]
+    layers += transport_layers
+    if end < len(data):
+        layers += ("Padding",)
+    return (_address(data, src_start, network), _address(data, dst_start, network),
+            src_port, dst_port, layers)
+
+
+def locate_headers(data, linktype=LINKTYPE_ETHERNET):
+    """
+    decode_headers() with the addresses left in the record: src_ip and
+    dst_ip are replaced by the offsets of the address bytes (4, or 16 for
+    IPv6), for callers that compare addresses as integers.
+    """
+    network = _network(data, linktype)
+    if network is None:
+        return None
+    layers, src_start, dst_start, proto, offset, end = network
+    if proto is None:
+        return layers[-1], src_start, dst_start, None, None, None, None, end, end, None
+    if proto == IPPROTO_TCP:
+        if end - offset < 20:
+            return None
+        header_len = (data[offset + 12] >> 4) * 4
+        if header_len < 20 or offset + header_len > end:
+            return None
+        sport, dport = _PORTS.unpack_from(data, offset)
+        return (layers[-1], src_start, dst_start, proto, sport, dport, data[offset + 13],
+                offset + header_len, end, _TCP_SEQ.unpack_from(data, offset + 4)[0])
+    if proto == IPPROTO_UDP:
+        if end - offset < 8:
+            return None
+        sport, dport = _PORTS.unpack_from(data, offset)
+        udp_end = min(offset + _UDP_LENGTH.unpack_from(data, offset + 4)[0], end)
+        return (layers[-1], src_start, dst_start, proto, sport, dport, 0,
+                offset + 8, max(udp_end, offset + 8), None)
+    if proto == IPPROTO_ICMP:
+        if end - offset < 8 or data[offset] not in _ICMP_ECHO_TYPES:
+            return None
+        return layers[-1], src_start, dst_start, proto, None, None, None, offset + 8, end, None
+    return None
+
+
+def decode_headers(data, linktype=LINKTYPE_ETHERNET):
+    """
+    Decode the network and transport headers of one capture record.
+
+    Returns (network, src_ip, dst_ip, proto, src_port, dst_port, tcp_flags,
+    start, end, tcp_seq) where network is "IP", "IPv6" or "ARP" and
+    data[start:end] is the transport payload. Ports and flags are None for
+    ICMP echo and ARP, whose payload scapy never dissects further; tcp_seq
+    is None except for TCP. Returns None for anything else. Port bindings
+    are ignored, as in decode_transport().
+    """
+    headers = locate_headers(data, linktype)
+    if headers is None:
+        return None
+    network, src_start, dst_start = headers[:3]
+    return (network, _address(data, src_start, network), _address(data, dst_start, network)) + headers[3:]
+
+
+def decode_transport(data, linktype=LINKTYPE_ETHERNET):
+    """
+    Locate the TCP/UDP payload of one capture record.
+
+    Unlike dissect() this ignores scapy's port bindings, so payload
+    inspectors can look at DNS or HTTP bytes in place. Returns
+    (src_ip, dst_ip, proto, src_port, dst_port, tcp_flags, start, end),
+    with data[start:end] being the transport payload, or None.
+    """
+    headers = decode_headers(data, linktype)
+    if headers is None or headers[4] is None:
+        return None
+    return headers[1:9]
@@ -0,0 +1,162 @@
+# flow_export.py
+"""
+Streaming export of TCP flow records, NetFlow/IPFIX style.
+
+A FlowWriter is a FlowTable sink: every flow is written out when the
+table evicts it (idle or active timeout), so a long capture never holds
+more than the open flows and one batch of rows in memory. Rows are
+buffered and written batch_size at a time, as CSV, JSON Lines or Parquet
+(one row group per batch); CSV and JSON Lines files are flushed after
+each batch so they can be tailed while the capture is read.
+
+Each row holds the 5-tuple (initiator first), first and last seen in UTC,
+duration, packets and bytes in both directions and from the responder,
+the TCP flags seen ('SFRA' letters and per-flag packet counts) and the
+handshake status (see FlowRecord.handshake_status).
+"""
+
+import csv
+import json
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fast_dissector import IPPROTO_TCP, NS_PER_SECOND
+
+FORMATS = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+
+FLOW_SCHEMA = pa.schema([
+    ('src_ip', pa.string()),
+    ('src_port', pa.int32()),
+    ('dst_ip', pa.string()),
+    ('dst_port', pa.int32()),
+    ('protocol', pa.int16()),
+    ('first_seen', pa.timestamp('ns', tz='UTC')),
+    ('last_seen', pa.timestamp('ns', tz='UTC')),
+    ('duration', pa.float64()),
+    ('packets', pa.int64()),
+    ('bytes', pa.int64()),
+    ('reverse_packets', pa.int64()),
+    ('reverse_bytes', pa.int64()),
+    ('tcp_flags', pa.string()),
+    ('syn_count', pa.int64()),
+    ('syn_ack_count', pa.int64()),
+    ('ack_count', pa.int64()),
+    ('fin_count', pa.int64()),
+    ('rst_count', pa.int64()),
+    ('handshake', pa.string()),
+])
+FLOW_FIELDS = tuple(FLOW_SCHEMA.names)
+
+_COUNTERS = ('packets', 'bytes', 'reverse_packets', 'reverse_bytes',
+             'syn_count', 'syn_ack_count', 'ack_count', 'fin_count', 'rst_count')
+
+
+def format_utc(timestamp_ns):
+    """ISO 8601 UTC time of a nanosecond timestamp, to the microsecond"""
+    seconds, nanoseconds = divmod(timestamp_ns, NS_PER_SECOND)
+    moment = datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=nanoseconds // 1000)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def flow_row(record):
+    """Export row of a FlowRecord, times as nanosecond timestamps"""
+    row = {
+        'src_ip': record.src_ip,
+        'src_port': record.src_port,
+        'dst_ip': record.dst_ip,
+        'dst_port': record.dst_port,
+        'protocol': IPPROTO_TCP,
+        'first_seen': record.first_ns,
+        'last_seen': record.last_ns,
+        'duration': (record.last_ns - record.first_ns) / NS_PER_SECOND,
+        'tcp_flags': record.tcp_flags,
+        'handshake': record.handshake_status,
+    }
+    for counter in _COUNTERS:
+        row[counter] = getattr(record, counter)
+    return row
+
+
+def _check_format(file_format):
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown flow export format {file_format!r}, expected one of {', '.join(FORMATS)}")
+
+
+def export_path(directory, name, file_format):
+    """<directory>/<name>_flows<extension> for a format in FORMATS"""
+    _check_format(file_format)
+    return os.path.join(directory, f"{name}_flows{FORMATS[file_format]}")
+
+
+class FlowWriter:
+    """
+    Flow record sink writing to path in file_format ('csv', 'jsonl' or
+    'parquet'; by default taken from the extension).
+
+    Call it with a FlowRecord, or pass it as a FlowTable sink. close()
+    writes the last batch; rows counts the records written so far.
+    """
+
+    def __init__(self, path, file_format=None, batch_size=1000):
+        if file_format is None:
+            extensions = {extension: name for name, extension in FORMATS.items()}
+            file_format = extensions.get(os.path.splitext(path)[1].lower())
+        _check_format(file_format)
+        self.path = path
+        self.file_format = file_format
+        self.batch_size = max(1, batch_size)
+        self.rows = 0
+        self._batch = []
+        self._file = None
+        self._csv = None
+        self._parquet = None
+        if file_format == 'parquet':
+            self._parquet = pq.ParquetWriter(path, FLOW_SCHEMA)
+        else:
+            self._file = open(path, 'w', newline='', encoding='utf-8')
+            if file_format == 'csv':
+                self._csv = csv.writer(self._file)
+                self._csv.writerow(FLOW_FIELDS)
+
+    def __call__(self, record):
+        self._batch.append(flow_row(record))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def flush(self):
+        """Write the buffered rows"""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        if self._parquet is not None:
+            self._parquet.write_table(pa.Table.from_pylist(batch, schema=FLOW_SCHEMA))
+        else:
+            for row in batch:
+                row['first_seen'] = format_utc(row['first_seen'])
+                row['last_seen'] = format_utc(row['last_seen'])
+            if self._csv is not None:
+                self._csv.writerows([row[field] for field in FLOW_FIELDS] for row in batch)
+            else:
+                self._file.writelines(json.dumps(row) + '\n' for row in batch)
+            self._file.flush()
+        self.rows += len(batch)
+
+    def close(self):
+        if self._file is None and self._parquet is None:
+            return
+        self.flush()
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        else:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,231 @@
+# flow_table.py
+"""
+Bidirectional TCP flow table with idle and active timeouts.
+
+Both directions of a connection share one FlowRecord. The record is
+oriented from the initiator (the sender of the first SYN, or of the first
+packet seen when the handshake was not captured) to the responder. Records
+use __slots__, and flows can be evicted once they have been idle or active
+for too long. Evicted flows go to a sink callable, so a long capture is
+tracked in memory proportional to the number of concurrently active flows.
+"""
+
+from collections import OrderedDict, deque
+
+from fast_dissector import ns_to_time, NS_PER_SECOND
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# Default timeouts (seconds) of the security scan and the flow export
+IDLE_TIMEOUT = 60
+ACTIVE_TIMEOUT = 1800
+
+# Handshake progress, in FlowRecord.handshake
+_SYN_SEEN = 1
+_SYN_ACK_SEEN = 2
+
+# Letters of FlowRecord.tcp_flags, in tcpdump order
+_FLAG_LETTERS = (('S', 'syn_count', 'syn_ack_count'), ('F', 'fin_count'),
+                 ('R', 'rst_count'), ('A', 'syn_ack_count', 'ack_count'))
+
+
+class FlowRecord:
+    """
+    Counters of one TCP connection, initiator -> responder.
+
+    packets and bytes cover both directions; reverse_packets and
+    reverse_bytes the responder -> initiator share of them. The flag
+    counters count packets carrying SYN without ACK, SYN with ACK, ACK,
+    FIN and RST. complete_handshake is set once the initiator's SYN, the
+    responder's SYN-ACK and the initiator's ACK have been seen in order.
+    Fields can also be read as record['name'].
+    """
+
+    __slots__ = ('src_ip', 'src_port', 'dst_ip', 'dst_port',
+                 'packets', 'bytes', 'reverse_packets', 'reverse_bytes',
+                 'syn_count', 'syn_ack_count', 'ack_count', 'fin_count', 'rst_count',
+                 'first_ns', 'last_ns', 'complete_handshake', 'handshake')
+
+    def __init__(self, src_ip, src_port, dst_ip, dst_port, timestamp_ns):
+        self.src_ip = src_ip
+        self.src_port = src_port
+        self.dst_ip = dst_ip
+        self.dst_port = dst_port
+        self.packets = 0
+        self.bytes = 0
+        self.reverse_packets = 0
+        self.reverse_bytes = 0
+        self.syn_count = 0
+        self.syn_ack_count = 0
+        self.ack_count = 0
+        self.fin_count = 0
+        self.rst_count = 0
+        self.first_ns = timestamp_ns
+        self.last_ns = timestamp_ns
+        self.complete_handshake = False
+        self.handshake = 0
+
+    @property
+    def key(self):
+        """(src_ip, src_port, dst_ip, dst_port), initiator first"""
+        return (self.src_ip, self.src_port, self.dst_ip, self.dst_port)
+
+    @property
+    def first_seen(self):
+        return ns_to_time(self.first_ns)
+
+    @property
+    def last_seen(self):
+        return ns_to_time(self.last_ns)
+
+    @property
+    def tcp_flags(self):
+        """Flags seen in either direction as tcpdump letters, e.g. 'SFA'"""
+        return ''.join(letter for letter, *counters in _FLAG_LETTERS
+                       if any(getattr(self, counter) for counter in counters))
+
+    @property
+    def handshake_status(self):
+        """'complete', 'syn_ack' (no final ACK), 'syn' (unanswered) or 'none' (not captured)"""
+        if self.complete_handshake:
+            return 'complete'
+        if self.handshake & _SYN_ACK_SEEN:
+            return 'syn_ack'
+        if self.handshake & _SYN_SEEN:
+            return 'syn'
+        return 'none'
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def update(self, forward, flags, length, timestamp_ns):
+        """Account for one packet; forward is True for initiator -> responder"""
+        self.packets += 1
+        self.bytes += length
+        if not forward:
+            self.reverse_packets += 1
+            self.reverse_bytes += length
+        if timestamp_ns > self.last_ns:
+            self.last_ns = timestamp_ns
+
+        if flags & TCP_SYN:
+            if flags & TCP_ACK:
+                self.syn_ack_count += 1
+                if not forward and self.handshake & _SYN_SEEN:
+                    self.handshake |= _SYN_ACK_SEEN
+            else:
+                self.syn_count += 1
+                if forward:
+                    self.handshake |= _SYN_SEEN
+        if flags & TCP_ACK:
+            self.ack_count += 1
+            if forward and not flags & TCP_SYN and self.handshake & _SYN_ACK_SEEN:
+                self.complete_handshake = True
+        if flags & TCP_FIN:
+            self.fin_count += 1
+        if flags & TCP_RST:
+            self.rst_count += 1
+
+
+class FlowTable:
+    """
+    Live TCP flows keyed by a direction-independent 4-tuple.
+
+    A flow is evicted once no packet has been seen for idle_timeout
+    seconds, or once it has lasted active_timeout seconds (a later packet
+    then starts a new record). Evicted records are passed to sink. With
+    no timeouts, nothing is ever evicted.
+    """
+
+    def __init__(self, idle_timeout=None, active_timeout=None, sink=None):
+        self.idle_ns = None if idle_timeout is None else int(idle_timeout * NS_PER_SECOND)
+        self.active_ns = None if active_timeout is None else int(active_timeout * NS_PER_SECOND)
+        self.sink = sink
+        # Kept in least recently updated order when flows can go idle
+        self.flows = OrderedDict() if self.idle_ns is not None else {}
+        # (first_ns, flow key, record) in creation order, for the active
+        # timeout; entries of evicted flows are dropped by _compact
+        self._started = deque()
+        self._expiring = self.idle_ns is not None or self.active_ns is not None
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def update(self, src, sport, dst, dport, flags, length, timestamp_ns):
+        """Account for one TCP packet"""
+        if (src, sport) <= (dst, dport):
+            key = (src, sport, dst, dport)
+        else:
+            key = (dst, dport, src, sport)
+        record = self.flows.get(key)
+        if self._expiring:
+            if record is not None and self._timed_out(record, timestamp_ns):
+                self._evict(key)
+                record = None
+            self._expire(timestamp_ns)
+
+        if record is None:
+            if flags & TCP_SYN and flags & TCP_ACK:
+                # Handshake caught at the SYN-ACK: the receiver initiated
+                record = FlowRecord(dst, dport, src, sport, timestamp_ns)
+            else:
+                record = FlowRecord(src, sport, dst, dport, timestamp_ns)
+            self.flows[key] = record
+            if self.active_ns is not None:
+                self._started.append((timestamp_ns, key, record))
+        elif self.idle_ns is not None:
+            self.flows.move_to_end(key)
+
+        forward = record.src_ip == src and record.src_port == sport
+        record.update(forward, flags, length, timestamp_ns)
+
+    def _timed_out(self, record, now_ns):
+        return ((self.idle_ns is not None and now_ns - record.last_ns > self.idle_ns)
+                or (self.active_ns is not None and now_ns - record.first_ns > self.active_ns))
+
+    def _expire(self, now_ns):
+        """Evict the flows that have timed out by now_ns"""
+        if self.idle_ns is not None:
+            flows = self.flows
+            while flows:
+                key, record = next(iter(flows.items()))
+                if now_ns - record.last_ns <= self.idle_ns:
+                    break
+                self._evict(key)
+        if self.active_ns is not None:
+            started = self._started
+            while started and now_ns - started[0][0] > self.active_ns:
+                _first_ns, key, record = started.popleft()
+                if self.flows.get(key) is record:
+                    self._evict(key)
+
+    def _evict(self, key):
+        record = self.flows.pop(key)
+        self.evicted += 1
+        if self.sink is not None:
+            self.sink(record)
+        if len(self._started) > 2 * len(self.flows):
+            self._compact()
+
+    def _compact(self):
+        """
+        Drop the start entries of flows that are no longer live. Run once
+        they outnumber the live flows, so _started stays within twice the
+        live flows at an amortized constant cost per eviction.
+        """
+        flows = self.flows
+        self._started = deque(entry for entry in self._started if flows.get(entry[1]) is entry[2])
+
+    def flush(self):
+        """Evict every remaining flow, e.g. at the end of a capture"""
+        for key in list(self.flows):
+            self._evict(key)
+        self._started.clear()
+
+    def connections(self):
+        """Live flows as {(src_ip, src_port, dst_ip, dst_port): record}"""
+        return {record.key: record for record in self.flows.values()}
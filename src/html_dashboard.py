@@ -3,25 +3,46 @@
 import os
 import json
 from datetime import datetime
+from html import escape
+
+from rollup_store import RollupStore, SIZE_BIN
+from sketches import traffic_total, talker_note
 
 def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_counter, 
-                    suspicious_ips, pcap_file, output_dir="reports"):
-    """Generate a futuristic cyberpunk-style HTML dashboard"""
+                    suspicious_ips, pcap_file, output_dir="reports", signature_alerts=None,
+                    rollups=None):
+    """
+    Generate a futuristic cyberpunk-style HTML dashboard.
+
+    Totals, the timeline, packet sizes and protocol statistics are read
+    from rollups (a RollupStore, or a RollupView of a time range); without
+    it they are rolled up from df in memory.
+    """
+    
+    signature_alerts = signature_alerts or []
+    alert_count = len(suspicious_ips) + len(signature_alerts)
     
     os.makedirs(output_dir, exist_ok=True)
     
+    if rollups is None:
+        rollups = RollupStore.from_frame(df)
+    view = rollups.query() if isinstance(rollups, RollupStore) else rollups
+    
     # Calculate statistics
-    total_packets = len(df)
-    total_bytes = df['length'].sum() if not df.empty else 0
+    total_packets = view.total_packets
+    total_bytes = view.total_bytes
     total_mb = total_bytes / 1024 / 1024
-    unique_src_ips = df['src_ip'].nunique() if not df.empty else 0
-    unique_dst_ips = df['dst_ip'].nunique() if not df.empty else 0
+    # Per-bucket talker rows are capped, so a partial range may only give a lower bound
+    unique_src_ips, unique_dst_ips = (
+        f"{'' if view.unique_addresses_exact(dimension) else '≥ '}{view.unique_addresses(dimension)}"
+        for dimension in ('source', 'destination')
+    )
     
     # Get timestamp range
-    if not df.empty and 'timestamp' in df.columns:
+    if total_packets:
         try:
-            min_time = float(df['timestamp'].min())
-            max_time = float(df['timestamp'].max())
+            min_time = view.first_ns / 1e9
+            max_time = view.last_ns / 1e9
             start_time = datetime.fromtimestamp(min_time).strftime('%Y-%m-%d %H:%M:%S')
             end_time = datetime.fromtimestamp(max_time).strftime('%Y-%m-%d %H:%M:%S')
             duration = max_time - min_time
@@ -33,8 +54,9 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
     # Generate charts
     protocol_chart = generate_protocol_pie_chart(main_proto_counter)
     top_talkers_chart = generate_top_talkers_chart(ip_traffic_counter)
-    packet_size_chart = generate_packet_size_chart(df)
+    packet_size_chart = generate_packet_size_chart(view.size_histogram())
     protocol_bar_chart = generate_protocol_bar_chart(main_proto_counter)
+    timeline_chart = generate_timeline_chart(view.timeline())
     
     html_content = f"""
 <!DOCTYPE html>
@@ -736,7 +758,7 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
             <div class="stat-card">
                 <div class="stat-icon">⚡</div>
                 <div class="stat-label">Threat Level</div>
-                <div class="stat-value" style="{'color: var(--danger);' if suspicious_ips else 'color: var(--accent);'}">{len(suspicious_ips)} ALERT{'S' if len(suspicious_ips) != 1 else ''}</div>
+                <div class="stat-value" style="{'color: var(--danger);' if alert_count else 'color: var(--accent);'}">{alert_count} ALERT{'S' if alert_count != 1 else ''}</div>
                 <div class="stat-subvalue">Security anomalies detected</div>
             </div>
         </div>
@@ -745,7 +767,7 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
         <div class="section">
             <h2 class="section-title">🚨 Threat Analysis Matrix</h2>
             <div class="alert-box">
-                {generate_security_alerts_html(suspicious_ips, ip_traffic_counter)}
+                {generate_security_alerts_html(suspicious_ips, ip_traffic_counter, signature_alerts)}
             </div>
         </div>
         
@@ -779,6 +801,15 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
             </div>
         </div>
         
+        <!-- Traffic Timeline -->
+        <div class="section">
+            <h2 class="section-title">⏱️ Traffic Timeline</h2>
+            <div class="chart-container">
+                <h3 class="chart-title">Packets over Time</h3>
+                <div id="timelineChart"></div>
+            </div>
+        </div>
+        
         <!-- Traffic Table -->
         <div class="section">
             <h2 class="section-title">💬 Traffic Breakdown Matrix</h2>
@@ -791,7 +822,7 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
         <div class="section">
             <h2 class="section-title">🔍 Protocol Signature Database</h2>
             <div class="table-container">
-                {generate_protocol_table(main_proto_counter, full_proto_counter, total_packets)}
+                {generate_protocol_table(view.protocol_statistics(), total_packets)}
             </div>
         </div>
         
@@ -813,6 +844,7 @@ def create_dashboard(df, main_proto_counter, full_proto_counter, ip_traffic_coun
         {top_talkers_chart}
         {packet_size_chart}
         {protocol_bar_chart}
+        {timeline_chart}
     </script>
 </body>
 </html>
@@ -835,9 +867,9 @@ def format_duration(seconds):
         return f"{seconds/3600:.1f}h"
 
 
-def generate_security_alerts_html(suspicious_ips, ip_traffic_counter):
+def generate_security_alerts_html(suspicious_ips, ip_traffic_counter, signature_alerts=None):
     """Generate HTML for security alerts"""
-    if not suspicious_ips:
+    if not suspicious_ips and not signature_alerts:
         return '''
         <div class="no-alerts">
             <div class="no-alerts-icon">🛡️</div>
@@ -866,6 +898,21 @@ def generate_security_alerts_html(suspicious_ips, ip_traffic_counter):
             </div>
         </div>
         '''
+    for alert in signature_alerts or []:
+        html += f'''
+        <div class="alert-item">
+            <div class="alert-icon">🧬</div>
+            <div class="alert-text">
+                <div class="alert-ip">{alert['src_ip']} → {alert['dst_ip']}</div>
+                <div class="alert-details">
+                    Payload signature {escape(alert['signature'])}: {alert['count']:,} packet{'s' if alert['count'] != 1 else ''}
+                </div>
+            </div>
+            <div style="font-family: 'Orbitron', sans-serif; font-size: 11px; color: var(--danger); text-transform: uppercase;">
+                {alert['severity']} SIGNATURE
+            </div>
+        </div>
+        '''
     return html
 
 
@@ -888,7 +935,8 @@ def generate_top_talkers_table(ip_traffic_counter):
         <tbody>
     '''
     
-    total_bytes = sum(ip_traffic_counter.values())
+    total_bytes = traffic_total(ip_traffic_counter)
+    note = talker_note(ip_traffic_counter)
     
     for idx, (ip, bytes_val) in enumerate(top_talkers, 1):
         mb = bytes_val / 1024 / 1024
@@ -900,7 +948,7 @@ def generate_top_talkers_table(ip_traffic_counter):
         <tr>
             <td><strong style="color: var(--primary);">#{idx:02d}</strong></td>
             <td><code>{ip}</code></td>
-            <td>{bytes_val:,}</td>
+            <td>{bytes_val:,}{f" ±{ip_traffic_counter.error(ip):,}" if note else ""}</td>
             <td>{mb:.2f}</td>
             <td>{percentage:.1f}%</td>
             <td style="color: {status_color}; font-family: 'Orbitron', sans-serif; font-size: 11px;">● {status_text}</td>
@@ -908,11 +956,13 @@ def generate_top_talkers_table(ip_traffic_counter):
         '''
     
     html += '</tbody></table>'
+    if note:
+        html += f'<div style="margin-top: 10px; color: var(--text-dim); font-size: 13px;">{note}</div>'
     return html
 
 
-def generate_protocol_table(main_proto_counter, full_proto_counter, total_packets):
-    """Generate HTML table for protocol details"""
+def generate_protocol_table(protocol_stats, total_packets):
+    """Generate HTML table for protocol details from get_protocol_statistics() or RollupView.protocol_statistics()"""
     html = '''
     <table>
         <thead>
@@ -920,27 +970,25 @@ def generate_protocol_table(main_proto_counter, full_proto_counter, total_packet
                 <th>Protocol</th>
                 <th>Packet Count</th>
                 <th>Distribution</th>
+                <th>Bytes</th>
+                <th>Avg Size</th>
                 <th>Layer Chain</th>
             </tr>
         </thead>
         <tbody>
     '''
     
-    proto_chains = {}
-    for chain, count in full_proto_counter.items():
-        main = chain.split(' -> ')[-1] if ' -> ' in chain else chain
-        if main not in proto_chains:
-            proto_chains[main] = chain
-    
-    for proto, count in main_proto_counter.most_common():
+    for proto, stats in protocol_stats.items():
+        count = stats['count']
         percentage = (count / total_packets * 100) if total_packets > 0 else 0
-        sample_chain = proto_chains.get(proto, proto)
         html += f'''
         <tr>
             <td><strong style="color: var(--primary);">{proto}</strong></td>
             <td>{count:,}</td>
             <td>{percentage:.1f}%</td>
-            <td><code style="font-size: 11px;">{sample_chain}</code></td>
+            <td>{stats['total_bytes']:,}</td>
+            <td>{stats['avg_packet_size']:.0f} B</td>
+            <td><code style="font-size: 11px;">{stats.get('chain', proto)}</code></td>
         </tr>
         '''
     
@@ -1076,23 +1124,23 @@ def generate_top_talkers_chart(ip_traffic_counter):
     return f"Plotly.newPlot('topTalkersChart', {json.dumps(chart_json['data'])}, {json.dumps(chart_json['layout'])});"
 
 
-def generate_packet_size_chart(df):
-    """Generate Plotly histogram for packet sizes - Cyberpunk style"""
-    if df.empty or 'length' not in df.columns:
+def generate_packet_size_chart(size_histogram):
+    """Generate Plotly histogram for packet sizes from {bin start: packets} - Cyberpunk style"""
+    if not size_histogram:
         return "// No packet size data"
     
-    sizes = df['length'].tolist()
-    
     chart_json = {
         'data': [{
-            'x': sizes,
-            'type': 'histogram',
-            'nbinsx': 50,
+            'x': [size + SIZE_BIN / 2 for size in size_histogram],
+            'y': list(size_histogram.values()),
+            'width': SIZE_BIN,
+            'type': 'bar',
+            'customdata': [f"{size}-{size + SIZE_BIN - 1}" for size in size_histogram],
             'marker': {
                 'color': 'rgba(0, 240, 255, 0.7)',
                 'line': {'color': '#00f0ff', 'width': 1}
             },
-            'hovertemplate': 'Size: %{x} bytes<br>Count: %{y}<extra></extra>'
+            'hovertemplate': 'Size: %{customdata} bytes<br>Count: %{y}<extra></extra>'
         }],
         'layout': {
             'height': 400,
@@ -1117,3 +1165,73 @@ def generate_packet_size_chart(df):
     }
     
     return f"Plotly.newPlot('packetSizeChart', {json.dumps(chart_json['data'])}, {json.dumps(chart_json['layout'])});"
+
+
+def generate_timeline_chart(timeline, top_protocols=5):
+    """Generate Plotly packets-over-time chart with per-protocol lines and spike markers - Cyberpunk style"""
+    if timeline is None or not len(timeline):
+        return "// No timeline data"
+    
+    times = [time.isoformat() for time in timeline.times()]
+    colors = ['#ff00ff', '#00ff88', '#ffaa00', '#7b61ff', '#ff3366']
+    
+    data = [{
+        'x': times,
+        'y': timeline.packets.tolist(),
+        'type': 'scatter',
+        'mode': 'lines',
+        'name': 'All packets',
+        'line': {'color': '#00f0ff', 'width': 2},
+        'fill': 'tozeroy',
+        'fillcolor': 'rgba(0, 240, 255, 0.1)',
+        'customdata': timeline.bytes.tolist(),
+        'hovertemplate': '%{x}<br>Packets: %{y}<br>Bytes: %{customdata}<extra></extra>'
+    }]
+    
+    totals = timeline.protocol_packets.sum(axis=0)
+    for i, column in enumerate(totals.argsort()[::-1][:top_protocols]):
+        data.append({
+            'x': times,
+            'y': timeline.protocol_packets[:, column].tolist(),
+            'type': 'scatter',
+            'mode': 'lines',
+            'name': timeline.protocols[column],
+            'line': {'color': colors[i % len(colors)], 'width': 1}
+        })
+    
+    spikes = timeline.spikes()
+    if spikes.any():
+        data.append({
+            'x': [time for time, spike in zip(times, spikes) if spike],
+            'y': timeline.packets[spikes].tolist(),
+            'type': 'scatter',
+            'mode': 'markers',
+            'name': 'Spike',
+            'marker': {'color': '#ff3366', 'size': 10, 'symbol': 'diamond'}
+        })
+    
+    chart_json = {
+        'data': data,
+        'layout': {
+            'height': 400,
+            'margin': {'t': 10, 'b': 60, 'l': 60, 'r': 20},
+            'paper_bgcolor': 'rgba(0,0,0,0)',
+            'plot_bgcolor': 'rgba(0,0,0,0)',
+            'xaxis': {
+                'title': {'text': f'Time ({format_duration(timeline.resolution)} buckets)', 'font': {'family': 'Share Tech Mono', 'color': '#6a7a8a'}},
+                'tickfont': {'family': 'Share Tech Mono', 'color': '#e0e0e0'},
+                'gridcolor': 'rgba(0, 240, 255, 0.1)',
+                'linecolor': 'rgba(0, 240, 255, 0.3)'
+            },
+            'yaxis': {
+                'title': {'text': 'Packets', 'font': {'family': 'Share Tech Mono', 'color': '#6a7a8a'}},
+                'tickfont': {'family': 'Share Tech Mono', 'color': '#e0e0e0'},
+                'gridcolor': 'rgba(0, 240, 255, 0.1)',
+                'linecolor': 'rgba(0, 240, 255, 0.3)'
+            },
+            'legend': {'font': {'family': 'Share Tech Mono', 'color': '#e0e0e0'}},
+            'font': {'family': 'Share Tech Mono', 'color': '#e0e0e0'}
+        }
+    }
+    
+    return f"Plotly.newPlot('timelineChart', {json.dumps(chart_json['data'])}, {json.dumps(chart_json['layout'])});"
@@ -0,0 +1,261 @@
+# http_stream.py
+"""
+HTTP/1.x message extraction from reassembled TCP streams.
+
+A direction of a TCP connection is only tracked once a segment starts
+like an HTTP message, checked on the raw bytes, so bulk non-HTTP payloads
+are never decoded or buffered. Tracked streams are reassembled by sequence
+number with bounded buffers: header blocks split across segments are
+joined, and message bodies of known Content-Length are skipped without
+copying. Requests are paired with the responses of the same connection in
+order, which gives the latency of each request.
+"""
+
+from collections import OrderedDict, deque
+
+from fast_dissector import ns_to_time, NS_PER_SECOND
+
+HTTP_METHODS = (b'GET ', b'POST ', b'PUT ', b'DELETE ', b'HEAD ')
+_RESPONSE = b'HTTP/'
+_STARTS = HTTP_METHODS + (_RESPONSE,)
+_KEY_HEADERS = {b'host': 'host', b'user-agent': 'user_agent', b'content-length': 'content_length'}
+
+_SEQ_MOD = 1 << 32
+_SEQ_HALF = 1 << 31
+
+
+def looks_like_http(payload):
+    """Whether a segment can start an HTTP message, from its first bytes"""
+    head = bytes(payload[:7])
+    if head.startswith(_STARTS):
+        return True
+    # A start line split right after the first few bytes
+    return len(head) < 7 and any(start.startswith(head) for start in _STARTS) and bool(head)
+
+
+def _text(value):
+    return value.decode('utf-8', errors='ignore')
+
+
+class _Stream:
+    """One direction of a tracked connection"""
+
+    __slots__ = ('next_seq', 'buffer', 'body_left', 'pending', 'pending_bytes', 'start_ns')
+
+    def __init__(self, seq):
+        self.next_seq = seq
+        self.buffer = bytearray()
+        self.body_left = 0
+        # Out-of-order segments: seq -> payload
+        self.pending = {}
+        self.pending_bytes = 0
+        # Time of the segment that started the buffered message
+        self.start_ns = None
+
+
+class HttpStreamTracker:
+    """
+    Extract HTTP requests and responses from TCP segments.
+
+    max_buffer bounds the bytes held per stream, for an unfinished header
+    block and for segments that arrived ahead of a gap; a stream that
+    exceeds it is dropped. At most max_streams stream directions are
+    tracked (least recently used are dropped first), and at most
+    max_pending requests per connection wait for their response.
+
+    A message is timed by the segment that carries its first byte. When a
+    stream ends (FIN, RST, eviction or result()) with an unterminated
+    header block, its start line and complete header lines are still
+    reported.
+    """
+
+    def __init__(self, max_buffer=65536, max_streams=10000, max_pending=100):
+        self.max_buffer = max_buffer
+        self.max_streams = max_streams
+        self.max_pending = max_pending
+        self.streams = OrderedDict()
+        # Canonical connection key -> requests awaiting a response
+        self.waiting = OrderedDict()
+        self.requests = []
+        self.responses = []
+
+    def add(self, src_ip, dst_ip, sport, dport, flags, seq, payload, timestamp_ns):
+        """Account for one TCP segment; payload is its bytes (or memoryview)"""
+        key = (src_ip, sport, dst_ip, dport)
+        stream = self.streams.get(key)
+        if stream is None:
+            if not payload or not looks_like_http(payload):
+                return
+            stream = self.streams[key] = _Stream(seq)
+            if len(self.streams) > self.max_streams:
+                self._drop(next(iter(self.streams)))
+        else:
+            self.streams.move_to_end(key)
+
+        if payload:
+            self._receive(key, stream, seq, payload, timestamp_ns)
+        if flags & 0x05 and key in self.streams:
+            # FIN or RST: nothing more to reassemble in this direction
+            self._drop(key)
+
+    def _receive(self, key, stream, seq, payload, timestamp_ns):
+        offset = (seq - stream.next_seq) % _SEQ_MOD
+        if offset >= _SEQ_HALF:
+            # Retransmission, possibly overlapping new data
+            overlap = _SEQ_MOD - offset
+            if overlap >= len(payload):
+                return
+            payload = payload[overlap:]
+            offset = 0
+        if offset:
+            # Ahead of a gap: hold until the gap is filled
+            if seq not in stream.pending:
+                stream.pending[seq] = bytes(payload)
+                stream.pending_bytes += len(payload)
+                if stream.pending_bytes + len(stream.buffer) > self.max_buffer:
+                    self._drop(key)
+            return
+
+        self._consume(key, stream, payload, timestamp_ns)
+        while stream.pending and key in self.streams:
+            segment = stream.pending.pop(stream.next_seq, None)
+            if segment is None:
+                break
+            stream.pending_bytes -= len(segment)
+            self._consume(key, stream, segment, timestamp_ns)
+
+    def _consume(self, key, stream, data, timestamp_ns):
+        """Parse in-order bytes"""
+        stream.next_seq = (stream.next_seq + len(data)) % _SEQ_MOD
+        if stream.body_left:
+            if len(data) <= stream.body_left:
+                stream.body_left -= len(data)
+                return
+            data = data[stream.body_left:]
+            stream.body_left = 0
+        buffer = stream.buffer
+        if not buffer:
+            stream.start_ns = timestamp_ns
+        buffer += data
+
+        while buffer:
+            if stream.body_left:
+                skipped = min(stream.body_left, len(buffer))
+                del buffer[:skipped]
+                stream.body_left -= skipped
+                continue
+            if not looks_like_http(buffer):
+                # Lost track of the message boundaries
+                del buffer[:]
+                self._drop(key)
+                return
+            end = buffer.find(b'\r\n\r\n')
+            if end < 0:
+                if len(buffer) > self.max_buffer:
+                    self._drop(key)
+                return
+            header = bytes(buffer[:end])
+            del buffer[:end + 4]
+            complete = self._message(key, stream, header)
+            # Whatever follows started in this segment
+            stream.start_ns = timestamp_ns
+            if not complete:
+                del buffer[:]
+                self._drop(key)
+                return
+
+    def _message(self, key, stream, header):
+        """Record one header block; False when the body length is unknown"""
+        lines = header.split(b'\r\n')
+        start = lines[0].split()
+        fields = {}
+        for line in lines[1:]:
+            name, _sep, value = line.partition(b':')
+            field = _KEY_HEADERS.get(name.strip().lower())
+            if field is not None:
+                fields[field] = _text(value.strip())
+        try:
+            length = int(fields['content_length']) if 'content_length' in fields else None
+        except ValueError:
+            length = None
+
+        src_ip, sport, dst_ip, dport = key
+        connection = key if (src_ip, sport) <= (dst_ip, dport) else (dst_ip, dport, src_ip, sport)
+        timestamp_ns = stream.start_ns
+        time = ns_to_time(timestamp_ns)
+
+        if start[0].startswith(_RESPONSE):
+            if len(start) < 2:
+                return False
+            response = {
+                'src_ip': src_ip,
+                'dst_ip': dst_ip,
+                'status_code': _text(start[1]),
+                'timestamp': time,
+                'content_length': length,
+                'method': None,
+                'url': None,
+                'latency': None
+            }
+            self.responses.append(response)
+            waiting = self.waiting.get(connection)
+            request = None
+            if waiting:
+                request, request_ns = waiting.popleft()
+                if not waiting:
+                    del self.waiting[connection]
+                latency = (timestamp_ns - request_ns) / NS_PER_SECOND
+                request['status_code'] = response['status_code']
+                request['latency'] = response['latency'] = latency
+                response['method'] = request['method']
+                response['url'] = request['url']
+            status = response['status_code']
+            if (request is not None and request['method'] == 'HEAD') or status[:1] == '1' \
+                    or status in ('204', '304'):
+                return True
+            if length is None:
+                # Chunked or close-delimited body: resynchronise on a later message
+                return False
+            stream.body_left = length
+            return True
+
+        if len(start) < 3:
+            return False
+        request = {
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'method': _text(start[0]),
+            'url': _text(start[1]),
+            'version': _text(start[2]),
+            'timestamp': time,
+            'host': fields.get('host'),
+            'user_agent': fields.get('user_agent'),
+            'content_length': length,
+            'status_code': None,
+            'latency': None
+        }
+        self.requests.append(request)
+        waiting = self.waiting.get(connection)
+        if waiting is None:
+            waiting = self.waiting[connection] = deque()
+            if len(self.waiting) > self.max_streams:
+                self.waiting.popitem(last=False)
+        if len(waiting) < self.max_pending:
+            waiting.append((request, timestamp_ns))
+        stream.body_left = length or 0
+        return True
+
+    def _drop(self, key):
+        stream = self.streams.pop(key, None)
+        if stream is None or stream.body_left or not looks_like_http(stream.buffer):
+            return
+        # An unterminated header block: keep its complete lines
+        end = stream.buffer.rfind(b'\r\n')
+        if end > 0:
+            self._message(key, stream, bytes(stream.buffer[:end]))
+
+    def result(self):
+        """End all streams; returns (requests, responses)"""
+        for key in list(self.streams):
+            self._drop(key)
+        return self.requests, self.responses
@@ -0,0 +1,291 @@
+# packet_filter.py
+"""
+BPF-style capture filters evaluated on the raw record bytes.
+
+A filter expression is compiled once into a predicate over the header
+fields of a record: network (ip, ip6 or arp), source and destination
+address as integers, IP protocol number and TCP/UDP ports. The fields come
+from the fast dissector's header decoder, straight from the record bytes,
+so the reader can drop unwanted packets before they are dissected and the
+filter agrees with the parser on what is IP, TCP or UDP. Records the fast
+dissector leaves to scapy (other link types, IP options, fragments...)
+are decoded with scapy instead.
+
+Supported expressions, combined with and/&&, or/||, not/! and parentheses:
+
+    [src|dst] host <address>        IPv4 or IPv6 address
+    [src|dst] net <address>/<bits>
+    [tcp|udp] [src|dst] port <n>
+    [tcp|udp] [src|dst] portrange <n>-<m>
+    tcp  udp  icmp  icmp6  ip  ip6  arp
+    proto <n>                       IP protocol number
+
+e.g. "tcp and net 10.0.0.0/8 and not port 22". As in BPF, host and net
+also match the addresses of ARP packets.
+"""
+
+import ipaddress
+import re
+
+from scapy.all import IP, IPv6, ARP, TCP, UDP
+
+from fast_dissector import (
+    LINKTYPE_ETHERNET, ETH_P_IP, IPPROTO_ICMP, IPPROTO_TCP, IPPROTO_UDP,
+    locate_headers, to_scapy
+)
+
+IPPROTO_ICMPV6 = 58
+
+PROTOCOLS = {
+    'tcp': ('ip', 'ip6', IPPROTO_TCP),
+    'udp': ('ip', 'ip6', IPPROTO_UDP),
+    'icmp': ('ip', None, IPPROTO_ICMP),
+    'icmp6': (None, 'ip6', IPPROTO_ICMPV6),
+}
+
+NO_FIELDS = (None, None, None, None, None, None)
+
+# locate_headers() network names, and the address size of each
+_NETWORKS = {'IP': ('ip', 4), 'IPv6': ('ip6', 16), 'ARP': ('arp', 4)}
+_TOKEN = re.compile(r'\s*(\(|\)|&&|\|\||!|[^\s()!&|]+)')
+_PORT_PROTOCOLS = (IPPROTO_TCP, IPPROTO_UDP)
+
+
+def header_fields(data, linktype=LINKTYPE_ETHERNET):
+    """
+    (network, src, dst, proto, sport, dport) of a raw record, addresses
+    as integers, or None for records the fast dissector leaves to scapy.
+    network is 'ip', 'ip6', 'arp' or None; proto and ports are None when
+    absent.
+    """
+    headers = locate_headers(data, linktype)
+    if headers is None:
+        return None
+    network, src_start, dst_start, proto, sport, dport = headers[:6]
+    network, size = _NETWORKS[network]
+    return (network, int.from_bytes(data[src_start:src_start + size], 'big'),
+            int.from_bytes(data[dst_start:dst_start + size], 'big'), proto, sport, dport)
+
+
+def packet_fields(pkt):
+    """header_fields() of a scapy packet, from its outermost IP header"""
+    if pkt.haslayer(IP):
+        ip = pkt[IP]
+        network, proto = 'ip', ip.proto
+        src, dst = int(ipaddress.IPv4Address(ip.src)), int(ipaddress.IPv4Address(ip.dst))
+    elif pkt.haslayer(IPv6):
+        ip = pkt[IPv6]
+        network, proto = 'ip6', ip.nh
+        src, dst = int(ipaddress.IPv6Address(ip.src)), int(ipaddress.IPv6Address(ip.dst))
+    elif pkt.haslayer(ARP) and pkt[ARP].ptype == ETH_P_IP:
+        try:
+            src, dst = int(ipaddress.IPv4Address(pkt[ARP].psrc)), int(ipaddress.IPv4Address(pkt[ARP].pdst))
+        except ValueError:
+            return NO_FIELDS
+        return ('arp', src, dst, None, None, None)
+    else:
+        return NO_FIELDS
+    if isinstance(ip.payload, (TCP, UDP)):
+        return network, src, dst, proto, ip.payload.sport, ip.payload.dport
+    return network, src, dst, proto, None, None
+
+
+def _address_test(direction, network, low, high):
+    """Fields predicate: an address of the given family in [low, high]"""
+    networks = ('ip', 'arp') if network == 4 else ('ip6',)
+    if direction == 'src':
+        return lambda f: f[0] in networks and low <= f[1] <= high
+    if direction == 'dst':
+        return lambda f: f[0] in networks and low <= f[2] <= high
+    return lambda f: f[0] in networks and (low <= f[1] <= high or low <= f[2] <= high)
+
+
+def _port_test(direction, low, high, proto):
+    protos = _PORT_PROTOCOLS if proto is None else (proto,)
+    if direction == 'src':
+        return lambda f: f[3] in protos and f[4] is not None and low <= f[4] <= high
+    if direction == 'dst':
+        return lambda f: f[3] in protos and f[5] is not None and low <= f[5] <= high
+    return lambda f: f[3] in protos and f[4] is not None and (low <= f[4] <= high or low <= f[5] <= high)
+
+
+def _protocol_test(name):
+    v4, v6, proto = PROTOCOLS[name]
+    return lambda f: f[3] == proto and (f[0] == v4 or f[0] == v6)
+
+
+class _Parser:
+    """Recursive-descent parser producing a fields predicate"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        self.position = 0
+        position = 0
+        end = len(text.rstrip())
+        while position < end:
+            token = _TOKEN.match(text, position)
+            if token is None:
+                raise self.error("unexpected character", text[position:end].lstrip())
+            self.tokens.append(token.group(1))
+            position = token.end()
+        self.position = 0
+
+    def error(self, message, near=None):
+        if near is None:
+            near = self.tokens[self.position] if self.position < len(self.tokens) else 'end of filter'
+        return ValueError(f"Invalid filter {self.text!r}: {message} near {near!r}")
+
+    def peek(self):
+        return self.tokens[self.position].lower() if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position] if self.position < len(self.tokens) else None
+        if token is None:
+            raise self.error("unexpected end")
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty filter")
+        test = self.parse_or()
+        if self.position < len(self.tokens):
+            raise self.error("unexpected token")
+        return test
+
+    def parse_or(self):
+        test = self.parse_and()
+        while self.peek() in ('or', '||'):
+            self.position += 1
+            left, right = test, self.parse_and()
+            test = lambda f, left=left, right=right: left(f) or right(f)
+        return test
+
+    def parse_and(self):
+        test = self.parse_not()
+        while self.peek() in ('and', '&&'):
+            self.position += 1
+            left, right = test, self.parse_not()
+            test = lambda f, left=left, right=right: left(f) and right(f)
+        return test
+
+    def parse_not(self):
+        if self.peek() in ('not', '!'):
+            self.position += 1
+            inner = self.parse_not()
+            return lambda f: not inner(f)
+        if self.peek() == '(':
+            self.position += 1
+            test = self.parse_or()
+            if self.peek() != ')':
+                raise self.error("missing ')'")
+            self.position += 1
+            return test
+        return self.parse_primitive()
+
+    def parse_number(self, low=0, high=65535):
+        token = self.take()
+        if not token.isdigit() or not low <= int(token) <= high:
+            self.position -= 1
+            raise self.error(f"expected a number from {low} to {high}")
+        return int(token)
+
+    def parse_primitive(self):
+        proto = None
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end")
+        if token in PROTOCOLS:
+            self.position += 1
+            if self.peek() not in ('src', 'dst', 'port', 'portrange'):
+                return _protocol_test(token)
+            if token not in ('tcp', 'udp'):
+                raise self.error(f"{token} has no ports")
+            proto = PROTOCOLS[token][2]
+            token = self.peek()
+        direction = None
+        if token in ('src', 'dst'):
+            direction = token
+            self.position += 1
+            token = self.peek()
+
+        if token == 'port' or token == 'portrange':
+            self.position += 1
+            if token == 'port':
+                low = high = self.parse_number()
+            else:
+                bounds = self.take().split('-')
+                if len(bounds) != 2 or not all(bound.isdigit() for bound in bounds):
+                    self.position -= 1
+                    raise self.error("expected <n>-<m>")
+                low, high = sorted(int(bound) for bound in bounds)
+            return _port_test(direction, low, high, proto)
+        if proto is not None:
+            raise self.error("expected port or portrange")
+
+        if token in ('host', 'net'):
+            self.position += 1
+            text = self.take()
+            try:
+                network = (ipaddress.ip_address(text) if token == 'host'
+                           else ipaddress.ip_network(text, strict=False))
+            except ValueError:
+                self.position -= 1
+                raise self.error(f"bad {token} address") from None
+            if token == 'host':
+                low = high = int(network)
+            else:
+                low, high = int(network.network_address), int(network.broadcast_address)
+            return _address_test(direction, network.version, low, high)
+        if direction is not None:
+            raise self.error("expected host, net, port or portrange")
+
+        if token in ('ip', 'ip6', 'arp'):
+            self.position += 1
+            return lambda f, network=token: f[0] == network
+        if token == 'proto':
+            self.position += 1
+            number = self.parse_number(0, 255)
+            return lambda f: f[3] == number and f[0] in ('ip', 'ip6')
+        raise self.error("unknown primitive")
+
+
+class PacketFilter:
+    """
+    A compiled filter expression.
+
+    match(data, linktype) tests a raw record, match_packet(pkt) a scapy
+    packet. Filters pickle as their expression, so they can be handed to
+    worker processes.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._test = _Parser(expression).parse()
+
+    def __reduce__(self):
+        return PacketFilter, (self.expression,)
+
+    def __repr__(self):
+        return f"PacketFilter({self.expression!r})"
+
+    def match(self, data, linktype=LINKTYPE_ETHERNET):
+        fields = header_fields(data, linktype)
+        if fields is None:
+            fields = packet_fields(to_scapy(data, linktype))
+        return self._test(fields)
+
+    def match_packet(self, pkt):
+        return self._test(packet_fields(pkt))
+
+    def records(self, records):
+        """The (data, timestamp_ns, linktype) records that pass the filter"""
+        test = self._test
+        for record in records:
+            data, _timestamp_ns, linktype = record
+            fields = header_fields(data, linktype)
+            if fields is None:
+                fields = packet_fields(to_scapy(data, linktype))
+            if test(fields):
+                yield record
@@ -0,0 +1,235 @@
+# packet_table.py
+"""
+Columnar, typed packet table built by parse_packets.
+
+Rows are appended into compact array buffers instead of one dict per
+packet. Addresses and protocol chains are interned, so the DataFrame
+carries integer category codes rather than repeated strings:
+
+    timestamp_ns    int64 nanoseconds since the epoch
+    src_ip/dst_ip   categorical ('' when the packet has no address)
+    src_port/...    UInt16 with a null mask
+    main_protocol   categorical
+    full_protocol   categorical
+    length          uint32
+"""
+
+from array import array
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+CHAIN_SEPARATOR = " -> "
+
+
+def layer_name(layer):
+    """Name of a layer-signature element: a layer name or a scapy layer class"""
+    if isinstance(layer, str):
+        return layer
+    # scapy moves a class's name attribute to _name; instances default to it
+    return layer._name or layer.__name__
+
+
+class PacketTable:
+    """Accumulate parsed packets into typed column buffers"""
+
+    def __init__(self):
+        self.timestamp_ns = array('q')
+        self.src_ip = array('i')
+        self.dst_ip = array('i')
+        self.src_port = array('H')
+        self.dst_port = array('H')
+        self.port_missing = array('B')
+        self.chain = array('i')
+        self.length = array('I')
+
+        # Interning tables; codes are assigned in first-seen order
+        self.addresses = []
+        self._address_codes = {}
+        self.chains = []
+        self.chain_keys = []
+        self.chain_main = array('i')
+        self._chain_codes = {}
+        # Layer signature (names or scapy classes) -> chain code
+        self._signature_codes = {}
+        self.main_protocols = []
+        self._main_codes = {}
+
+    def __len__(self):
+        return len(self.length)
+
+    def address_code(self, ip):
+        code = self._address_codes.get(ip)
+        if code is None:
+            code = self._address_codes[ip] = len(self.addresses)
+            self.addresses.append(ip)
+        return code
+
+    def chain_code(self, layers):
+        """
+        Intern a layer signature, returns its full_protocol code.
+
+        layers is a tuple of layer names or of scapy layer classes. Each
+        distinct signature is resolved to its names and main protocol once;
+        after that a packet costs a single dict lookup.
+        """
+        code = self._signature_codes.get(layers)
+        if code is None:
+            key = tuple(map(layer_name, layers))
+            code = self._signature_codes[layers] = self._name_code(key)
+        return code
+
+    def _name_code(self, key):
+        code = self._chain_codes.get(key)
+        if code is None:
+            main_protocol = key[-1] if key else "UNKNOWN"
+            main_code = self._main_codes.get(main_protocol)
+            if main_code is None:
+                main_code = self._main_codes[main_protocol] = len(self.main_protocols)
+                self.main_protocols.append(main_protocol)
+            code = self._chain_codes[key] = len(self.chains)
+            self.chains.append(CHAIN_SEPARATOR.join(key))
+            self.chain_keys.append(key)
+            self.chain_main.append(main_code)
+        return code
+
+    def append(self, timestamp_ns, src_ip, dst_ip, src_port, dst_port, layers, length):
+        self.timestamp_ns.append(timestamp_ns)
+        self.src_ip.append(self.address_code(src_ip))
+        self.dst_ip.append(self.address_code(dst_ip))
+        if src_port is None:
+            self.src_port.append(0)
+            self.dst_port.append(0)
+            self.port_missing.append(1)
+        else:
+            self.src_port.append(src_port)
+            self.dst_port.append(dst_port)
+            self.port_missing.append(0)
+        self.chain.append(self.chain_code(layers))
+        self.length.append(length)
+
+    def extend(self, other):
+        """
+        Append the rows of another table, remapping its interned codes.
+
+        Tables merged in capture order give exactly the codes, and thus
+        the DataFrame and counters, that a single serial pass produces.
+        """
+        address_map = np.array([self.address_code(ip) for ip in other.addresses], dtype=np.int32)
+        chain_map = np.array([self.chain_code(key) for key in other.chain_keys], dtype=np.int32)
+
+        for name, mapping in (('src_ip', address_map), ('dst_ip', address_map), ('chain', chain_map)):
+            codes = np.frombuffer(getattr(other, name), dtype=np.int32)
+            if len(codes):
+                getattr(self, name).frombytes(mapping[codes].tobytes())
+        for name in ('timestamp_ns', 'src_port', 'dst_port', 'port_missing', 'length'):
+            getattr(self, name).extend(getattr(other, name))
+
+    def clear_rows(self):
+        """
+        Drop the rows and the address table but keep the protocol-chain
+        interning, so a table reused batch by batch only holds the
+        addresses of its current batch.
+        """
+        for name in ('timestamp_ns', 'src_ip', 'dst_ip', 'src_port',
+                     'dst_port', 'port_missing', 'chain', 'length'):
+            setattr(self, name, array(getattr(self, name).typecode))
+        self.addresses = []
+        self._address_codes = {}
+
+    def _column(self, name, dtype, start, stop):
+        return np.frombuffer(getattr(self, name), dtype=dtype)[start:stop].copy()
+
+    def to_dataframe(self, start=0, stop=None):
+        """Build the typed DataFrame for rows[start:stop]"""
+        chain = self._column('chain', np.int32, start, stop)
+        main = np.frombuffer(self.chain_main, dtype=np.int32)[chain]
+        missing = self._column('port_missing', np.uint8, start, stop).astype(bool)
+        addresses = pd.Index(self.addresses, dtype=object)
+
+        return pd.DataFrame({
+            "timestamp_ns": self._column('timestamp_ns', np.int64, start, stop),
+            "src_ip": pd.Categorical.from_codes(self._column('src_ip', np.int32, start, stop), addresses),
+            "dst_ip": pd.Categorical.from_codes(self._column('dst_ip', np.int32, start, stop), addresses),
+            "src_port": pd.arrays.IntegerArray(self._column('src_port', np.uint16, start, stop), missing),
+            "dst_port": pd.arrays.IntegerArray(self._column('dst_port', np.uint16, start, stop), missing.copy()),
+            "main_protocol": pd.Categorical.from_codes(main, pd.Index(self.main_protocols, dtype=object)),
+            "full_protocol": pd.Categorical.from_codes(chain, pd.Index(self.chains, dtype=object)),
+            "length": self._column('length', np.uint32, start, stop),
+        })
+
+    def counters(self, start=0, stop=None):
+        """
+        Protocol-chain, main-protocol and per-IP byte counters for
+        rows[start:stop], with keys in first-seen order.
+        """
+        return self.protocol_counters(start, stop) + (self.ip_traffic(start, stop),)
+
+    def protocol_counters(self, start=0, stop=None):
+        """Protocol-chain and main-protocol counters for rows[start:stop]"""
+        chain = self._column('chain', np.int32, start, stop)
+
+        chain_counts = np.bincount(chain, minlength=len(self.chains))
+        main_counts = np.bincount(np.frombuffer(self.chain_main, dtype=np.int32),
+                                  weights=chain_counts, minlength=len(self.main_protocols))
+        protocol_counter = Counter({
+            self.chains[code]: int(chain_counts[code]) for code in np.flatnonzero(chain_counts)
+        })
+        main_protocol_counter = Counter({
+            self.main_protocols[code]: int(main_counts[code]) for code in np.flatnonzero(main_counts)
+        })
+        return protocol_counter, main_protocol_counter
+
+    def ip_traffic(self, start=0, stop=None):
+        """Per-IP byte counter (bytes sent plus received) for rows[start:stop]"""
+        length = self._column('length', np.uint32, start, stop).astype(np.int64)
+        # Only the addresses of these rows are counted, so a batch costs
+        # as much as its own rows however many addresses were seen before
+        codes, inverse = np.unique(np.concatenate((self._column('src_ip', np.int32, start, stop),
+                                                   self._column('dst_ip', np.int32, start, stop))),
+                                   return_inverse=True)
+        ip_bytes = np.bincount(inverse, weights=np.concatenate((length, length)), minlength=len(codes))
+        ip_traffic_counter = Counter({
+            self.addresses[code]: int(total)
+            for code, total in zip(codes.tolist(), ip_bytes.tolist()) if self.addresses[code]
+        })
+        return ip_traffic_counter
+
+
+def _first_seen_totals(column, weights=None):
+    """
+    Values of a categorical column with their first row and their row
+    count (or sum of weights), in category code order.
+    """
+    codes = column.cat.codes.to_numpy()
+    present, first_row = np.unique(codes, return_index=True)
+    totals = np.bincount(codes, weights=weights, minlength=len(column.cat.categories))[present]
+    return pd.DataFrame({"first_row": first_row, "total": totals},
+                        index=pd.Index(column.cat.categories[present], dtype=object))
+
+
+def _ordered_counter(totals):
+    totals = totals.sort_values("first_row", kind="stable")
+    return Counter(dict(zip(totals.index, totals["total"].astype(np.int64).tolist())))
+
+
+def dataframe_counters(df):
+    """
+    Full-protocol, main-protocol and per-IP byte counters of a packet
+    DataFrame: the counters PacketTable gives for the same rows, with
+    keys in first-seen order whatever the order of the categories.
+    """
+    protocol_counter = _ordered_counter(_first_seen_totals(df['full_protocol']))
+    main_protocol_counter = _ordered_counter(_first_seen_totals(df['main_protocol']))
+
+    # An address is interned at its first row, source before destination
+    length = df['length'].to_numpy().astype(np.int64)
+    sides = []
+    for side, column in enumerate(('src_ip', 'dst_ip')):
+        totals = _first_seen_totals(df[column], length)
+        totals["first_row"] = totals["first_row"] * 2 + side
+        sides.append(totals)
+    ip_totals = pd.concat(sides).groupby(level=0, sort=False).agg({"first_row": "min", "total": "sum"})
+    ip_traffic_counter = _ordered_counter(ip_totals[ip_totals.index != ''])
+    return protocol_counter, main_protocol_counter, ip_traffic_counter
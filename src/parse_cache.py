@@ -0,0 +1,272 @@
+# parse_cache.py
+"""
+On-disk cache of parsed captures.
+
+The parse_packets packet table is stored as a Parquet file, so a rerun on
+an unchanged capture skips load_pcap and parse_packets entirely; the
+Counters are rebuilt from the table on load, which keeps the file footer
+small however many addresses the capture holds. A streamed parse is
+written and read back batch by batch (CacheWriter, ParseCache.batches),
+one row group per batch, so the whole table never has to be in memory.
+Entries are keyed by the capture's content hash and the parser version. The size and mtime of each capture are kept in an index, so an
+unchanged file is not re-hashed on every run. Once the cache grows past
+its size budget the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analyzer import PARSER_VERSION
+from packet_table import dataframe_counters
+
+INDEX_FILE = "index.json"
+ENTRY_SUFFIX = ".parquet"
+METADATA_KEY = b"netscope"
+# Bump when the entry layout changes; older entries are no longer read
+ENTRY_FORMAT = 2
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(file_path):
+    """SHA-256 of the file contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_metadata(file_path):
+    return {
+        "source": os.path.abspath(file_path),
+        "parser_version": PARSER_VERSION,
+    }
+
+
+def _to_pandas(table):
+    df = table.to_pandas()
+    # Parquet hands categories back as strings; keep the object
+    # categories parse_packets produces
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = pd.Categorical.from_codes(
+                df[column].cat.codes, pd.Index(list(df[column].cat.categories), dtype=object)
+            )
+    return df
+
+
+class ParseCache:
+    """Parsed-capture cache in directory, limited to max_bytes on disk"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        index = {path: entry for path, entry in index.items() if os.path.exists(path)}
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self._index_path)
+
+    def fingerprint(self, file_path):
+        """
+        Cache key of a capture: its content hash, the parser version and
+        the entry format.
+
+        The hash is only recomputed when the file's size or mtime changed.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        index = self._load_index()
+        entry = index.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = index[path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_digest(path),
+            }
+            self._save_index(index)
+        return f"{entry['sha256']}-v{PARSER_VERSION}-f{ENTRY_FORMAT}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def _open(self, file_path):
+        """The cache entry of file_path as a ParquetFile, or None"""
+        try:
+            entry_path = self._entry_path(self.fingerprint(file_path))
+        except OSError:
+            return None
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            parquet = pq.ParquetFile(entry_path)
+        except pa.ArrowInvalid as e:
+            print(f"⚠ Removing corrupt cache entry {entry_path}: {e}")
+            os.remove(entry_path)
+            return None
+        except OSError as e:
+            # May be transient; keep the entry for the next run
+            print(f"⚠ Could not read cache entry {entry_path}: {e}")
+            return None
+        if METADATA_KEY not in (parquet.schema_arrow.metadata or {}):
+            print(f"⚠ Removing cache entry without NetScope metadata {entry_path}")
+            parquet.close()
+            os.remove(entry_path)
+            return None
+
+        # Mark the entry as recently used for eviction
+        os.utime(entry_path)
+        return parquet
+
+    def load(self, file_path):
+        """Return the cached parse_packets result for file_path, or None"""
+        parquet = self._open(file_path)
+        if parquet is None:
+            return None
+        with parquet:
+            df = _to_pandas(parquet.read())
+        return (df,) + dataframe_counters(df)
+
+    def batches(self, file_path, batch_size=10000):
+        """
+        Iterate over the cached packet table of file_path in DataFrames of
+        at most batch_size rows, like parse_packet_batches, or return None
+        if it is not cached. Each batch has only its own categories; the
+        Counters are dataframe_counters of each batch.
+        """
+        parquet = self._open(file_path)
+        if parquet is None:
+            return None
+        return self._iter_batches(parquet, batch_size)
+
+    @staticmethod
+    def _iter_batches(parquet, batch_size):
+        with parquet:
+            metadata = parquet.schema_arrow.metadata
+            for batch in parquet.iter_batches(batch_size=batch_size):
+                # A batch shares the dictionary of its whole row group
+                columns = [column.dictionary_decode().dictionary_encode()
+                           if pa.types.is_dictionary(column.type) else column
+                           for column in batch.columns]
+                table = pa.Table.from_arrays(columns, names=batch.schema.names)
+                yield _to_pandas(table.replace_schema_metadata(metadata))
+
+    def writer(self, file_path):
+        """A CacheWriter storing the batches of file_path, or None if it cannot be keyed"""
+        try:
+            entry_path = self._entry_path(self.fingerprint(file_path))
+        except OSError:
+            return None
+        return CacheWriter(self, entry_path, _entry_metadata(file_path))
+
+    def store(self, file_path, df, protocol_counter, main_protocol_counter, ip_traffic_counter):
+        """
+        Cache a parse_packets result, then evict down to the size budget.
+
+        Only the packet table is written; the Counters are the ones
+        dataframe_counters rebuilds from it.
+        """
+        try:
+            entry_path = self._entry_path(self.fingerprint(file_path))
+        except OSError:
+            return
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            METADATA_KEY: json.dumps(_entry_metadata(file_path)),
+        })
+
+        tmp_path = entry_path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _mtime, size, _name in entries)
+        for _mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class CacheWriter:
+    """
+    Cache entry written batch by batch, one row group per DataFrame of
+    parse_packet_batches. The entry only appears, and the cache is only
+    evicted, once close() has written it completely.
+    """
+
+    def __init__(self, cache, entry_path, metadata):
+        self.cache = cache
+        self.entry_path = entry_path
+        self.metadata = metadata
+        self._tmp_path = entry_path + ".tmp"
+        self._schema = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add(self, df):
+        if df.empty:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            # Batches differ in category counts and so in index width
+            fields = [field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                      if pa.types.is_dictionary(field.type) else field
+                      for field in table.schema]
+            self._schema = pa.schema(fields, metadata={
+                **(table.schema.metadata or {}),
+                METADATA_KEY: json.dumps(self.metadata),
+            })
+            self._writer = pq.ParquetWriter(self._tmp_path, self._schema)
+        self._writer.write_table(table.cast(self._schema))
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_path, self.entry_path)
+        self.cache.evict()
+
+    def discard(self):
+        """Drop what was written, e.g. after a failed parse"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.remove(self._tmp_path)
@@ -0,0 +1,360 @@
+# pcap_reader.py
+"""
+Memory-mapped, zero-copy capture readers for classic pcap and pcapng.
+
+The capture file is mapped into memory once and every record is handed out
+as a memoryview slice of that mapping, so the fast dissector and the payload
+inspectors read straight from the page cache without copying each frame
+into a new bytes object. Compressed captures cannot be mapped; they are
+read sequentially from the decompressor by StreamedCapture.
+"""
+
+import mmap
+import struct
+
+from decompressor import open_decompressed
+
+NS_PER_SECOND = 1_000_000_000
+
+# magic -> (byte order, ticks per second)
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 10 ** 6),
+    b"\xa1\xb2\xc3\xd4": (">", 10 ** 6),
+    b"\x4d\x3c\xb2\xa1": ("<", 10 ** 9),
+    b"\xa1\xb2\x3c\x4d": (">", 10 ** 9),
+}
+
+PCAP_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+# Section Header Block byte-order magic -> byte order
+PCAPNG_BYTE_ORDER = {
+    b"\x4d\x3c\x2b\x1a": "<",
+    b"\x1a\x2b\x3c\x4d": ">",
+}
+
+BLOCK_SHB = 0x0A0D0D0A
+BLOCK_IDB = 1
+BLOCK_PB = 2       # obsolete Packet Block
+BLOCK_SPB = 3
+BLOCK_EPB = 6
+
+OPT_ENDOFOPT = 0
+OPT_IF_TSRESOL = 9
+DEFAULT_TSRESOL = 10 ** 6
+
+
+def _open_mapping(file_path, magics):
+    """Open and map file_path, checking its first four bytes"""
+    f = open(file_path, "rb")
+    try:
+        magic = f.read(4)
+        if magic not in magics:
+            raise ValueError(f"Not a supported capture file (bad magic: {magic!r})")
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        raise
+    if hasattr(mapping, "madvise"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    return f, magic, mapping
+
+
+def open_capture(file_path):
+    """
+    Open a capture with the reader matching its magic number: MappedPcap
+    for classic pcap, MappedPcapng for pcapng and StreamedCapture for
+    gzip, xz or zstd compressed captures. Raises ValueError for anything
+    else.
+    """
+    decompressed = open_decompressed(file_path)
+    if decompressed is not None:
+        try:
+            return StreamedCapture(decompressed)
+        except Exception:
+            decompressed.close()
+            raise
+    with open(file_path, "rb") as f:
+        magic = f.read(4)
+    if magic == PCAPNG_MAGIC:
+        return MappedPcapng(file_path)
+    return MappedPcap(file_path)
+
+
+def _options(view, endian, start, end):
+    """Yield (code, value) for the pcapng options in view[start:end]"""
+    unpack = struct.Struct(endian + "HH").unpack_from
+    offset = start
+    while offset + 4 <= end:
+        code, length = unpack(view, offset)
+        if code == OPT_ENDOFOPT:
+            return
+        offset += 4
+        if offset + length > end:
+            return
+        yield code, view[offset:offset + length]
+        offset += length + (-length % 4)
+
+
+def _interface(view, endian, body, end):
+    """(linktype, snaplen, ns_scale, tsresol) of an IDB body"""
+    linktype, _reserved, snaplen = struct.unpack_from(endian + "HHI", view, body)
+    tsresol = DEFAULT_TSRESOL
+    for code, value in _options(view, endian, body + 8, end):
+        if code == OPT_IF_TSRESOL and len(value) == 1:
+            exponent = value[0]
+            tsresol = (2 if exponent & 0x80 else 10) ** (exponent & 0x7F)
+            break
+    # Timestamps convert with one multiplication when the resolution
+    # divides a nanosecond evenly
+    ns_scale = NS_PER_SECOND // tsresol if NS_PER_SECOND % tsresol == 0 else None
+    return linktype, snaplen, ns_scale, tsresol
+
+
+def _pcapng_packets(blocks):
+    """
+    Turn pcapng blocks into (data, timestamp_ns, linktype) records.
+
+    blocks yields (endian, block_type, view, body, body_end) with
+    view[body:body_end] being the block body.
+    """
+    interfaces = []
+    for endian, block_type, view, body, body_end in blocks:
+        if block_type == BLOCK_EPB or block_type == BLOCK_PB:
+            if body_end - body < 20:
+                return
+            if block_type == BLOCK_EPB:
+                intid, ts_high, ts_low, caplen, _wirelen = struct.unpack_from(endian + "IIIII", view, body)
+            else:
+                intid, _drops, ts_high, ts_low, caplen, _wirelen = struct.unpack_from(endian + "HHIIII", view, body)
+            if intid >= len(interfaces):
+                continue
+            linktype, _snaplen, ns_scale, tsresol = interfaces[intid]
+            timestamp = (ts_high << 32) | ts_low
+            if ns_scale is not None:
+                timestamp_ns = timestamp * ns_scale
+            else:
+                timestamp_ns = timestamp * NS_PER_SECOND // tsresol
+            yield view[body + 20:min(body + 20 + caplen, body_end)], timestamp_ns, linktype
+        elif block_type == BLOCK_SPB:
+            if not interfaces or body_end - body < 4:
+                continue
+            linktype, snaplen, _ns_scale, _tsresol = interfaces[0]
+            wirelen = struct.unpack_from(endian + "I", view, body)[0]
+            caplen = min(wirelen, snaplen) if snaplen else wirelen
+            # Simple Packet Blocks carry no timestamp
+            yield view[body + 4:min(body + 4 + caplen, body_end)], 0, linktype
+        elif block_type == BLOCK_IDB:
+            if body_end - body < 8:
+                return
+            interfaces.append(_interface(view, endian, body, body_end))
+        elif block_type == BLOCK_SHB:
+            # A new section starts its own interface table
+            interfaces = []
+
+
+class _MappedCapture:
+    """Common lifetime handling of the mapped readers"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # Views handed out by records() are still alive; the mapping
+            # is released once they are garbage collected.
+            pass
+        self._file.close()
+
+
+class MappedPcap(_MappedCapture):
+    """
+    Read a classic pcap file through mmap.
+
+    records() yields (ts_sec, ts_frac, wirelen, data) where data is a
+    memoryview into the mapping and ts_frac is expressed in units of
+    1 / ts_resolution seconds. A view is only valid while the reader is
+    open; copy it with bytes() to keep it longer.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file, magic, self._map = _open_mapping(file_path, PCAP_MAGIC)
+        endian, self.ts_resolution = PCAP_MAGIC[magic]
+        self._view = memoryview(self._map)
+        if len(self._view) < PCAP_HEADER_SIZE:
+            self.close()
+            raise ValueError("Invalid pcap file (too short)")
+
+        _vermaj, _vermin, _tz, _sig, self.snaplen, self.linktype = struct.unpack_from(
+            endian + "HHIIII", self._view, 4
+        )
+        self._record_header = struct.Struct(endian + "IIII")
+
+    def records(self, start=PCAP_HEADER_SIZE, stop=None, index=None):
+        """
+        Yield (ts_sec, ts_frac, wirelen, data) for every record whose
+        header starts in the byte range [start, stop).
+
+        index, a seek_index.IndexBuilder, is given the offset and time of
+        every record read.
+        """
+        view = self._view
+        size = len(view)
+        stop = size if stop is None else min(stop, size)
+        unpack = self._record_header.unpack_from
+        frac_ns = NS_PER_SECOND // self.ts_resolution
+        offset = start
+        while offset < stop and offset + RECORD_HEADER_SIZE <= size:
+            ts_sec, ts_frac, caplen, wirelen = unpack(view, offset)
+            if index is not None:
+                index.add(offset, ts_sec * NS_PER_SECOND + ts_frac * frac_ns)
+            offset += RECORD_HEADER_SIZE
+            end = offset + caplen
+            # A truncated last record is returned with the bytes that exist
+            yield ts_sec, ts_frac, wirelen, view[offset:min(end, size)]
+            offset = end
+
+    def packets(self, start=PCAP_HEADER_SIZE, stop=None, index=None):
+        """Yield (data, timestamp_ns, linktype) for the records in [start, stop)"""
+        frac_ns = NS_PER_SECOND // self.ts_resolution
+        linktype = self.linktype
+        for ts_sec, ts_frac, _wirelen, data in self.records(start, stop, index):
+            yield data, ts_sec * NS_PER_SECOND + ts_frac * frac_ns, linktype
+
+    def split(self, parts, start=PCAP_HEADER_SIZE, stop=None):
+        """
+        Cut the records in [start, stop) into at most parts byte ranges of
+        similar size that start and end on record boundaries, for parallel
+        parsing. start and stop must be record boundaries.
+        """
+        view = self._view
+        size = len(view) if stop is None else min(stop, len(view))
+        unpack = self._record_header.unpack_from
+        target = max((size - start) // max(parts, 1), 1)
+        ranges = []
+        offset = start
+        while offset + RECORD_HEADER_SIZE <= size:
+            offset += RECORD_HEADER_SIZE + unpack(view, offset)[2]
+            if offset - start >= target and len(ranges) < parts - 1:
+                ranges.append((start, offset))
+                start = offset
+        if start < size:
+            ranges.append((start, size))
+        return ranges
+
+
+class MappedPcapng(_MappedCapture):
+    """
+    Read a pcapng file through mmap, block by block.
+
+    Section Header Blocks set the byte order and start a new set of
+    interfaces; each Interface Description Block contributes its link type
+    and if_tsresol. Enhanced, Simple and (obsolete) Packet Blocks are
+    returned as records, every other block type is skipped. Data views are
+    only valid while the reader is open.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file, _magic, self._map = _open_mapping(file_path, (PCAPNG_MAGIC,))
+        self._view = memoryview(self._map)
+
+    def _blocks(self):
+        view = self._view
+        size = len(view)
+        offset = 0
+        endian = "<"
+        while offset + 12 <= size:
+            block_type = struct.unpack_from(endian + "I", view, offset)[0]
+            if block_type == BLOCK_SHB:
+                endian = PCAPNG_BYTE_ORDER.get(bytes(view[offset + 8:offset + 12]))
+                if endian is None:
+                    return
+            block_len = struct.unpack_from(endian + "I", view, offset + 4)[0]
+            end = offset + block_len
+            if block_len < 12 or end > size:
+                return
+            yield endian, block_type, view, offset + 8, end - 4
+            offset = end + (-block_len % 4)
+
+    def packets(self):
+        """Yield (data, timestamp_ns, linktype) for every packet block"""
+        return _pcapng_packets(self._blocks())
+
+
+class StreamedCapture:
+    """
+    Read a pcap or pcapng capture sequentially from a binary file object,
+    for input that cannot be memory-mapped such as a decompressed stream.
+
+    packets() yields the same (data, timestamp_ns, linktype) records as
+    the mapped readers, with data a bytes-like object per record.
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._magic = fileobj.read(4)
+        if self._magic not in PCAP_MAGIC and self._magic != PCAPNG_MAGIC:
+            raise ValueError(f"Not a supported capture file (bad magic: {self._magic!r})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def packets(self):
+        """Yield (data, timestamp_ns, linktype) for every record"""
+        if self._magic == PCAPNG_MAGIC:
+            return _pcapng_packets(self._pcapng_blocks())
+        return self._pcap_packets()
+
+    def _pcap_packets(self):
+        read = self._file.read
+        endian, ts_resolution = PCAP_MAGIC[self._magic]
+        header = read(PCAP_HEADER_SIZE - 4)
+        if len(header) < PCAP_HEADER_SIZE - 4:
+            return
+        linktype = struct.unpack_from(endian + "I", header, 16)[0]
+        frac_ns = NS_PER_SECOND // ts_resolution
+        unpack = struct.Struct(endian + "IIII").unpack
+        while True:
+            header = read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                return
+            ts_sec, ts_frac, caplen, _wirelen = unpack(header)
+            # A truncated last record is returned with the bytes that exist
+            yield read(caplen), ts_sec * NS_PER_SECOND + ts_frac * frac_ns, linktype
+
+    def _pcapng_blocks(self):
+        read = self._file.read
+        endian = "<"
+        header = self._magic + read(4)
+        while len(header) == 8:
+            if header[:4] == PCAPNG_MAGIC:
+                byte_order = read(4)
+                endian = PCAPNG_BYTE_ORDER.get(byte_order)
+                if endian is None:
+                    return
+                header += byte_order
+            block_type, block_len = struct.unpack_from(endian + "II", header)
+            if block_len < len(header) + 4:
+                return
+            block = header + read(block_len - len(header) + (-block_len % 4))
+            if len(block) < block_len:
+                return
+            yield endian, block_type, memoryview(block), 8, block_len - 4
+            header = read(8)
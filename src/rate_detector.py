@@ -0,0 +1,118 @@
+# rate_detector.py
+"""
+Sliding-window event rates per key, for flood detection.
+
+Each key (a target or source IP) has a ring buffer of per-bucket event
+counts covering the last window seconds, so recording an event costs O(1)
+whatever the length of the capture. While a key's rate over the window
+is at or above the configured rate it is in alert. Alerts are reported
+with their start and end time, so a short burst in a long capture is
+caught, and a steady background rate in a long capture is not flagged.
+"""
+
+from fast_dissector import ns_to_time, NS_PER_SECOND
+
+
+class _Window:
+    __slots__ = ('counts', 'bucket', 'total', 'alert')
+
+    def __init__(self, buckets, bucket):
+        self.counts = [0] * buckets
+        self.bucket = bucket
+        self.total = 0
+        self.alert = None
+
+
+class SlidingRateDetector:
+    """
+    Flag keys whose event rate reaches rate events per second.
+
+    The rate is averaged over the last window seconds, in buckets of
+    resolution seconds (1 for per-second, 60 for per-minute buffers).
+    on_alert(alert) is called when an alert starts; close() ends the
+    open alerts and returns all of them. An alert is a dict with key,
+    start and end (packet times of its first and last event), events
+    (events counted while in alert) and peak_rate.
+    """
+
+    def __init__(self, rate, window=10, resolution=1, on_alert=None):
+        self.rate = rate
+        self.window = window
+        self.resolution_ns = int(resolution * NS_PER_SECOND)
+        self.buckets = max(1, int(round(window / resolution)))
+        self.on_alert = on_alert
+        self.windows = {}
+        self.alerts = []
+        self._last_sweep = None
+
+    def add(self, key, timestamp_ns, count=1):
+        """Record count events for key at timestamp_ns"""
+        bucket = timestamp_ns // self.resolution_ns
+        window = self.windows.get(key)
+        if window is None:
+            if self._last_sweep is None:
+                self._last_sweep = bucket
+            elif bucket - self._last_sweep >= self.buckets:
+                self._sweep(bucket)
+            window = self.windows[key] = _Window(self.buckets, bucket)
+
+        counts = window.counts
+        gap = bucket - window.bucket
+        if gap > 0:
+            if gap >= self.buckets:
+                counts[:] = [0] * self.buckets
+                window.total = 0
+            else:
+                for step in range(1, gap + 1):
+                    index = (window.bucket + step) % self.buckets
+                    window.total -= counts[index]
+                    counts[index] = 0
+            window.bucket = bucket
+        elif gap <= -self.buckets:
+            # Older than the window: out of order by more than window seconds
+            return
+        counts[bucket % self.buckets] += count
+        window.total += count
+
+        rate = window.total / self.window
+        alert = window.alert
+        if rate >= self.rate:
+            if alert is None:
+                alert = window.alert = {
+                    'key': key, 'start_ns': timestamp_ns, 'end_ns': timestamp_ns,
+                    'events': 0, 'peak_rate': rate
+                }
+                if self.on_alert is not None:
+                    self.on_alert(self._finish(dict(alert)))
+            alert['end_ns'] = max(alert['end_ns'], timestamp_ns)
+            alert['events'] += count
+            alert['peak_rate'] = max(alert['peak_rate'], rate)
+        elif alert is not None:
+            self._close(window)
+
+    def _close(self, window):
+        self.alerts.append(self._finish(window.alert))
+        window.alert = None
+
+    @staticmethod
+    def _finish(alert):
+        alert['start'] = ns_to_time(alert['start_ns'])
+        alert['end'] = ns_to_time(alert['end_ns'])
+        return alert
+
+    def _sweep(self, bucket):
+        """Forget keys with no events in the window, ending their alerts"""
+        stale = [key for key, window in self.windows.items()
+                 if bucket - window.bucket >= self.buckets]
+        for key in stale:
+            window = self.windows.pop(key)
+            if window.alert is not None:
+                self._close(window)
+        self._last_sweep = bucket
+
+    def close(self):
+        """End the open alerts; returns all alerts ordered by start time"""
+        for window in self.windows.values():
+            if window.alert is not None:
+                self._close(window)
+        return sorted(self.alerts, key=lambda alert: alert['start_ns'])
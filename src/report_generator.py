@@ -1,20 +1,27 @@
 # report_generator.py
 import os
+from datetime import datetime
+import pandas as pd
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
+from rich.markup import escape
 from tabulate import tabulate
 
+from sketches import traffic_total, talker_note
+
 console = Console()
 
 # --------------------------
 # Terminal Summary Function
 # --------------------------
-def display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips):
+def display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips,
+                    signature_alerts=None):
     """Display a visually stunning terminal summary using Rich."""
     
     total_packets = sum(main_proto_counter.values())
-    total_bytes = sum(ip_traffic_counter.values())
+    total_bytes = traffic_total(ip_traffic_counter)
+    note = talker_note(ip_traffic_counter)
 
     # Header Panel
     console.print(Panel.fit(
@@ -55,10 +62,17 @@ def display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter,
     table3.add_column("IP Address", style="cyan")
     table3.add_column("Bytes Transferred", justify="right", style="yellow")
     table3.add_column("MB", justify="right", style="magenta")
+    if note:
+        table3.add_column("± Bytes", justify="right", style="dim")
     
     for ip, bytes_ in list(ip_traffic_counter.most_common(10)):
-        table3.add_row(ip, f"{bytes_:,}", f"{bytes_/1024/1024:.2f}")
+        row = [ip, f"{bytes_:,}", f"{bytes_/1024/1024:.2f}"]
+        if note:
+            row.append(f"{ip_traffic_counter.error(ip):,}")
+        table3.add_row(*row)
     console.print(table3)
+    if note:
+        console.print(f"[dim]{note}[/dim]")
 
     # Suspicious IPs
     console.print("\n")
@@ -69,20 +83,34 @@ def display_summary(main_proto_counter, full_proto_counter, ip_traffic_counter,
             console.print(f"  [red]⚠️  {ip} - {bytes_transferred:,} bytes ({bytes_transferred/1024/1024:.2f} MB)[/red]")
     else:
         console.print("[bold green]✅ No suspicious IPs detected 🎉[/bold green]")
+
+    # Payload signature matches
+    if signature_alerts:
+        console.print("\n[bold red]🧬 Payload Signature Matches:[/bold red]")
+        for alert in signature_alerts:
+            console.print(f"  [red]⚠️  {escape(signature_line(alert))}[/red]")
     
     console.print("\n")
 
 
+def signature_line(alert):
+    """One-line description of a signature alert"""
+    return (f"[{alert['severity'].upper()}] {alert['signature']}: {alert['src_ip']} → "
+            f"{alert['dst_ip']} ({alert['count']:,} packet{'s' if alert['count'] != 1 else ''})")
+
+
 # --------------------------
 # File Outputs
 # --------------------------
-def save_summary_file(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips, folder="reports"):
+def save_summary_file(main_proto_counter, full_proto_counter, ip_traffic_counter, suspicious_ips, folder="reports",
+                      signature_alerts=None, rollups=None):
     os.makedirs(folder, exist_ok=True)
     filename = os.path.join(folder, "summary_report.txt")
 
     total_packets = sum(main_proto_counter.values())
-    total_bytes = sum(ip_traffic_counter.values())
-    top_talkers = sorted(ip_traffic_counter.items(), key=lambda x: x[1], reverse=True)[:10]
+    total_bytes = traffic_total(ip_traffic_counter)
+    top_talkers = ip_traffic_counter.most_common(10)
+    note = talker_note(ip_traffic_counter)
 
     with open(filename, "w", encoding="utf-8") as f:
         f.write("="*70 + "\n")
@@ -104,6 +132,8 @@ def save_summary_file(main_proto_counter, full_proto_counter, ip_traffic_counter
         f.write("Top Talkers (by Bytes):\n")
         f.write(tabulate([[ip, f"{b:,}", f"{b/1024/1024:.2f}"] for ip, b in top_talkers],
                          headers=["IP Address", "Bytes Transferred", "MB"], tablefmt="grid"))
+        if note:
+            f.write(f"\n{note}")
         f.write("\n\n")
         
         f.write("Suspicious IPs Detected:\n")
@@ -113,6 +143,31 @@ def save_summary_file(main_proto_counter, full_proto_counter, ip_traffic_counter
                 f.write(f"⚠️  {ip} - {bytes_transferred:,} bytes ({bytes_transferred/1024/1024:.2f} MB)\n")
         else:
             f.write("None\n")
+
+        if signature_alerts is not None:
+            f.write("\nPayload Signature Matches:\n")
+            for alert in signature_alerts:
+                f.write(f"⚠️  {signature_line(alert)}\n")
+            if not signature_alerts:
+                f.write("None\n")
+
+        if rollups is not None:
+            f.write("\nBusiest Minutes:\n")
+            busiest = rollups.query(resolution=60).busiest(10)
+            f.write(tabulate([[format_time(start), f"{packets:,}", f"{bytes_:,}"]
+                              for start, packets, bytes_ in busiest],
+                             headers=["Minute", "Packets", "Bytes"], tablefmt="grid"))
+            f.write("\n\nDetector Hits:\n")
+            events = rollups.events()
+            if events:
+                f.write(tabulate([[event['kind'], event['key'], event['severity'] or "", f"{event['count']:,}",
+                                   format_time(event['first_ns']), format_time(event['last_ns'])]
+                                  for event in events],
+                                 headers=["Detector", "Key", "Severity", "Count", "First", "Last"],
+                                 tablefmt="grid"))
+                f.write("\n")
+            else:
+                f.write("None\n")
         
         f.write("\n" + "="*70 + "\n")
         f.write("Report generated by Network Traffic Analyzer (Python)\n")
@@ -121,23 +176,82 @@ def save_summary_file(main_proto_counter, full_proto_counter, ip_traffic_counter
     print(f"✓ Summary report saved to {filename}")
 
 
-def save_packet_reports(df, folder="reports"):
-    os.makedirs(folder, exist_ok=True)
-    csv_filename = os.path.join(folder, "report.csv")
-    txt_filename = os.path.join(folder, "file_formatted.txt")
+def format_time(timestamp_ns):
+    """Local date and time of a nanosecond timestamp, empty for None"""
+    if timestamp_ns is None:
+        return ""
+    return datetime.fromtimestamp(timestamp_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
 
-    df.fillna("", inplace=True)
 
-    # Save CSV
-    df.to_csv(csv_filename, index=False)
-    print(f"✓ CSV data saved to {csv_filename}")
+def format_timestamps(timestamp_ns):
+    """Exact decimal seconds, with microsecond precision when that is enough"""
+    seconds, fraction = timestamp_ns // 1_000_000_000, timestamp_ns % 1_000_000_000
+    if (fraction % 1000 == 0).all():
+        fraction, digits = fraction // 1000, 6
+    else:
+        digits = 9
+    return seconds.astype(str) + "." + fraction.astype(str).str.zfill(digits)
 
-    # Save formatted TXT
-    with open(txt_filename, "w", encoding="utf-8") as f:
-        f.write("="*70 + "\n")
-        f.write("                NETWORK TRAFFIC DETAILED REPORT              \n")
-        f.write("="*70 + "\n\n")
-        f.write(tabulate(df.head(50), headers="keys", tablefmt="grid"))
-        f.write(f"\n\n(Showing first 50 packets out of {len(df)} total)\n")
-        f.write("="*70 + "\n")
-    print(f"✓ Formatted packet report saved to {txt_filename}")
\ No newline at end of file
+
+def export_frame(df):
+    """Flat copy of the packet table for CSV/text export (seconds, strings)"""
+    export = df.drop(columns=['timestamp_ns'])
+    export.insert(0, 'timestamp', format_timestamps(df['timestamp_ns']))
+    export = export.astype(object)
+    return export.where(export.notna(), "")
+
+
+class PacketReportWriter:
+    """
+    save_packet_reports for a packet table fed batch by batch: rows are
+    appended to report.csv as they come and the first 50 are kept for
+    file_formatted.txt, which close() writes. Timestamp precision is
+    chosen per batch (see format_timestamps); rows counts the rows so far.
+    """
+
+    def __init__(self, folder="reports"):
+        os.makedirs(folder, exist_ok=True)
+        self.csv_filename = os.path.join(folder, "report.csv")
+        self.txt_filename = os.path.join(folder, "file_formatted.txt")
+        self.rows = 0
+        self._head = []
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, df):
+        df = export_frame(df)
+        if self._file is None:
+            self._file = open(self.csv_filename, "w", newline="", encoding="utf-8")
+            df.to_csv(self._file, index=False)
+        else:
+            df.to_csv(self._file, index=False, header=False)
+        if self.rows < 50:
+            self._head.append(df.head(50 - self.rows))
+        self.rows += len(df)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        print(f"✓ CSV data saved to {self.csv_filename}")
+
+        # Save formatted TXT
+        with open(self.txt_filename, "w", encoding="utf-8") as f:
+            f.write("="*70 + "\n")
+            f.write("                NETWORK TRAFFIC DETAILED REPORT              \n")
+            f.write("="*70 + "\n\n")
+            f.write(tabulate(pd.concat(self._head, ignore_index=True), headers="keys", tablefmt="grid"))
+            f.write(f"\n\n(Showing first 50 packets out of {self.rows} total)\n")
+            f.write("="*70 + "\n")
+        print(f"✓ Formatted packet report saved to {self.txt_filename}")
+
+
+def save_packet_reports(df, folder="reports"):
+    with PacketReportWriter(folder) as writer:
+        writer.add(df)
\ No newline at end of file
@@ -0,0 +1,527 @@
+# rollup_store.py
+"""
+Persistent time-series rollups of an analysed capture.
+
+The packet table is aggregated once into per-bucket rows at each timeline
+resolution (1s/10s/1m/1h) and written as one Parquet file per resolution,
+sorted by bucket start, next to the other outputs. Rows carry packets,
+bytes, sum of squared lengths and min/max length per bucket and key, for
+these dimensions:
+
+    protocol     main protocol
+    chain        full protocol chain (protocol column: its main protocol)
+    source       source IP, the max_talkers busiest per bucket
+    destination  destination IP, the max_talkers busiest per bucket
+    size         packet length bin of SIZE_BIN bytes
+
+so protocol statistics, top talkers, the size histogram and the timeline
+of any time range can be answered without the packets. Detector hits are
+stored alongside as events. A range query reads only the row groups of
+the coarsest resolution whose buckets line up with the range.
+
+Talker totals are exact unless a bucket had more than max_talkers
+addresses; the metadata records where that happened. The exact number of
+distinct sources and destinations of the whole capture is kept in the
+metadata, since it cannot be summed from per-bucket rows.
+"""
+
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fast_dissector import NS_PER_SECOND, time_to_ns
+from timeline import RESOLUTIONS, Timeline
+
+ROLLUP_VERSION = 1
+METADATA_FILE = "rollups.json"
+EVENTS_FILE = "events.parquet"
+SIZE_BIN = 32
+DIMENSIONS = ('protocol', 'chain', 'source', 'destination', 'size')
+
+_ROW_GROUP_SIZE = 65536
+_ROW_KEYS = ['dimension', 'start_ns', 'protocol', 'key']
+_EVENT_COLUMNS = ['kind', 'key', 'severity', 'first_ns', 'last_ns', 'count']
+
+
+def _rollup_file(resolution):
+    return f"rollup_{resolution:g}s.parquet"
+
+
+def _steps(resolutions):
+    steps = {int(round(resolution * NS_PER_SECOND)): resolution for resolution in resolutions}
+    ordered = sorted(steps)
+    if any(step % ordered[0] for step in ordered):
+        raise ValueError("Rollup resolutions must be multiples of the finest resolution")
+    return steps, ordered
+
+
+def _aggregate(frame, keys):
+    """Sum, sum of squares and min/max of length per keys"""
+    return frame.groupby(keys, observed=True, sort=False).agg(
+        packets=('length', 'count'),
+        bytes=('length', 'sum'),
+        bytes_sq=('length_sq', 'sum'),
+        min_length=('length', 'min'),
+        max_length=('length', 'max')
+    ).reset_index()
+
+
+def _combine(frame, keys):
+    """Merge rows of equal keys, e.g. after coarsening start_ns"""
+    return frame.groupby(keys, observed=True, sort=False).agg(
+        packets=('packets', 'sum'),
+        bytes=('bytes', 'sum'),
+        bytes_sq=('bytes_sq', 'sum'),
+        min_length=('min_length', 'min'),
+        max_length=('max_length', 'max')
+    ).reset_index()
+
+
+def _fine_rows(df, finest):
+    """Rollup rows of a packet table at the finest resolution"""
+    length = df['length'].to_numpy().astype(np.int64)
+    packets = pd.DataFrame({
+        'start_ns': df['timestamp_ns'].to_numpy() // finest * finest,
+        'length': length,
+        'length_sq': length.astype(np.float64) ** 2,
+    })
+
+    keys = {
+        'protocol': (df['main_protocol'].astype(str), None),
+        'chain': (df['full_protocol'].astype(str), df['main_protocol'].astype(str)),
+        'source': (df['src_ip'].astype(str), None),
+        'destination': (df['dst_ip'].astype(str), None),
+        'size': ((length // SIZE_BIN * SIZE_BIN).astype(str), None),
+    }
+    parts = []
+    for dimension, (key, protocol) in keys.items():
+        frame = packets.assign(key=np.asarray(key),
+                               protocol='' if protocol is None else np.asarray(protocol))
+        if dimension in ('source', 'destination'):
+            # Same addresses as ip_traffic: packets without one are left out
+            frame = frame[frame['key'] != '']
+        part = _aggregate(frame, ['start_ns', 'protocol', 'key'])
+        part.insert(0, 'dimension', dimension)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def _resolution_frames(fine, steps, ordered, max_talkers):
+    finest = ordered[0]
+    frames = {}
+    truncated = {}
+    for step in ordered:
+        if step == finest:
+            frame = fine
+        else:
+            frame = _combine(fine.assign(start_ns=fine['start_ns'] // step * step),
+                             _ROW_KEYS)
+        frame, truncated[steps[step]] = _limit_talkers(frame, max_talkers)
+        frame = frame.sort_values(['start_ns', 'dimension', 'packets'], ascending=[True, True, False],
+                                  kind='stable', ignore_index=True)
+        frame['dimension'] = frame['dimension'].astype('category')
+        frames[steps[step]] = frame
+    return frames, truncated
+
+
+def rollup_frames(df, resolutions=RESOLUTIONS, max_talkers=1000):
+    """
+    Rollup rows of the packet table at each resolution, as
+    ({resolution: DataFrame}, {resolution: talkers truncated}).
+    """
+    steps, ordered = _steps(resolutions)
+    return _resolution_frames(_fine_rows(df, ordered[0]), steps, ordered, max_talkers)
+
+
+def _limit_talkers(frame, max_talkers):
+    """Keep the max_talkers busiest sources and destinations of each bucket"""
+    talkers = frame['dimension'].isin(('source', 'destination'))
+    rank = (frame[talkers].sort_values('bytes', ascending=False, kind='stable')
+            .groupby(['dimension', 'start_ns'], observed=True).cumcount())
+    dropped = rank.index[rank.to_numpy() >= max_talkers]
+    if not len(dropped):
+        return frame, False
+    return frame.drop(index=dropped), True
+
+
+def detector_events(suspicious_ips=(), ip_traffic_counter=None, scan=None, signature_alerts=None):
+    """
+    Detector hits as rollup events: {kind, key, severity, first_ns,
+    last_ns, count}. Hits without a time (suspicious IPs, port scanners,
+    flood totals) have first_ns and last_ns None.
+    """
+    scan = scan or {}
+    ip_traffic_counter = ip_traffic_counter or {}
+    events = []
+
+    def add(kind, key, count, first_ns=None, last_ns=None, severity=None):
+        events.append({'kind': kind, 'key': str(key), 'severity': severity,
+                       'first_ns': first_ns, 'last_ns': last_ns, 'count': int(count)})
+
+    for ip in suspicious_ips:
+        add('suspicious_ip', ip, ip_traffic_counter.get(ip, 0))
+    for ip, info in scan.get('port_scanners', {}).items():
+        add('port_scan', ip, info['port_count'])
+    for ip, count in scan.get('syn_flood_targets', {}).items():
+        add('syn_flood_target', ip, count)
+    for ip, count in scan.get('icmp_flooders', {}).items():
+        add('icmp_flooder', ip, count)
+    rate_alerts = [('syn_flood', scan.get('syn_flood_alerts', [])),
+                   ('icmp_flood', scan.get('icmp_flood_alerts', [])),
+                   ('dns_burst', scan.get('dns_summary', {}).get('rate_alerts', []))]
+    for kind, alerts in rate_alerts:
+        for alert in alerts:
+            add(kind, alert['key'], alert['events'], alert['start_ns'], alert['end_ns'])
+    for candidate in scan.get('dns_summary', {}).get('tunneling_candidates', []):
+        add('dns_tunneling', candidate['src_ip'], candidate['suspicious_queries'])
+    for alert in signature_alerts or []:
+        add('signature', f"{alert['signature']} {alert['src_ip']} -> {alert['dst_ip']}", alert['count'],
+            time_to_ns(alert['first_seen']), time_to_ns(alert['last_seen']), alert['severity'])
+    return events
+
+
+def _addresses(column):
+    """Distinct non-empty addresses of a packet table column"""
+    values = column.astype(str)
+    return set(values[values != ''].unique())
+
+
+def _events_frame(events):
+    frame = pd.DataFrame(list(events), columns=_EVENT_COLUMNS)
+    for column in ('first_ns', 'last_ns', 'count'):
+        frame[column] = frame[column].astype('Int64')
+    return frame
+
+
+class RollupBuilder:
+    """
+    Rollups of a packet table fed batch by batch in capture order, e.g.
+    the DataFrames of parse_packet_batches.
+
+    Finest-resolution rows of the batches are merged as they pile up, so
+    memory follows the rollup rows and the distinct addresses rather than
+    the packets. build() gives the same store as from_frame() on the
+    concatenated batches.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS, max_talkers=1000):
+        self.steps, self.ordered = _steps(resolutions)
+        self.max_talkers = max_talkers
+        self.packets = 0
+        self.bytes = 0
+        self.first_ns = None
+        self.last_ns = None
+        self._addresses = {'source': set(), 'destination': set()}
+        self._merged = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, df):
+        rows = _fine_rows(df, self.ordered[0])
+        self._pending.append(rows)
+        self._pending_rows += len(rows)
+        # Merging once the new rows outnumber the merged ones keeps it amortized linear
+        if self._pending_rows > max(_ROW_GROUP_SIZE, 0 if self._merged is None else len(self._merged)):
+            self._merge()
+
+        self.packets += len(df)
+        self.bytes += int(df['length'].sum())
+        if not df.empty:
+            timestamps = df['timestamp_ns']
+            first, last = int(timestamps.min()), int(timestamps.max())
+            self.first_ns = first if self.first_ns is None else min(self.first_ns, first)
+            self.last_ns = last if self.last_ns is None else max(self.last_ns, last)
+        self._addresses['source'].update(_addresses(df['src_ip']))
+        self._addresses['destination'].update(_addresses(df['dst_ip']))
+
+    def _merge(self):
+        parts = ([] if self._merged is None else [self._merged]) + self._pending
+        if len(parts) > 1:
+            self._merged = _combine(pd.concat(parts, ignore_index=True), _ROW_KEYS)
+        elif parts:
+            self._merged = parts[0]
+        self._pending = []
+        self._pending_rows = 0
+
+    def build(self, events=(), source=None):
+        """The rollups of every batch added, held in memory"""
+        self._merge()
+        fine = self._merged
+        if fine is None:
+            fine = pd.DataFrame(columns=_ROW_KEYS + ['packets', 'bytes', 'bytes_sq', 'min_length', 'max_length'])
+        frames, truncated = _resolution_frames(fine, self.steps, self.ordered, self.max_talkers)
+        metadata = {
+            "version": ROLLUP_VERSION,
+            "source": source,
+            "resolutions": sorted(frames),
+            "max_talkers": self.max_talkers,
+            "talkers_truncated": {f"{resolution:g}": flag for resolution, flag in truncated.items()},
+            "first_ns": self.first_ns,
+            "last_ns": self.last_ns,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "unique_addresses": {dimension: len(addresses) for dimension, addresses in self._addresses.items()},
+        }
+        return RollupStore(None, metadata, frames, _events_frame(events))
+
+    def write(self, directory, events=(), source=None):
+        """Build the rollups and save them in directory"""
+        return self.build(events, source)._save(directory)
+
+
+class RollupStore:
+    """
+    Rollups of one capture, in directory or (directory None) in memory.
+
+    Open a written store with RollupStore(directory); write one with
+    RollupStore.write() or build one in memory with from_frame(); a
+    RollupBuilder does either from a table fed batch by batch.
+    """
+
+    def __init__(self, directory, metadata=None, frames=None, events=None):
+        self.directory = directory
+        if metadata is None:
+            with open(os.path.join(directory, METADATA_FILE), "r") as f:
+                metadata = json.load(f)
+            if metadata.get("version") != ROLLUP_VERSION:
+                raise ValueError(f"{directory}: unsupported rollup version {metadata.get('version')}")
+        self.metadata = metadata
+        self.resolutions = tuple(metadata["resolutions"])
+        self._frames = frames
+        self._events = events
+
+    @classmethod
+    def from_frame(cls, df, events=(), source=None, resolutions=RESOLUTIONS, max_talkers=1000):
+        """Rollups of a packet table, held in memory"""
+        builder = RollupBuilder(resolutions, max_talkers)
+        builder.add(df)
+        return builder.build(events, source)
+
+    @classmethod
+    def write(cls, directory, df, events=(), source=None, resolutions=RESOLUTIONS, max_talkers=1000):
+        """Build the rollups of a packet table and save them in directory"""
+        return cls.from_frame(df, events, source, resolutions, max_talkers)._save(directory)
+
+    def _save(self, directory):
+        """Write an in-memory store to directory and switch it to the files"""
+        store = self
+        os.makedirs(directory, exist_ok=True)
+        for resolution, frame in store._frames.items():
+            path = os.path.join(directory, _rollup_file(resolution))
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path + ".tmp",
+                           row_group_size=_ROW_GROUP_SIZE)
+            os.replace(path + ".tmp", path)
+        path = os.path.join(directory, EVENTS_FILE)
+        pq.write_table(pa.Table.from_pandas(store._events, preserve_index=False), path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+        # Metadata last: a store is only opened once it is complete
+        path = os.path.join(directory, METADATA_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(store.metadata, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+        store.directory = directory
+        store._frames = None
+        store._events = None
+        return store
+
+    def resolution_for(self, start_ns=None, end_ns=None):
+        """Coarsest resolution whose buckets line up with both ends of the range"""
+        for resolution in sorted(self.resolutions, reverse=True):
+            step = int(round(resolution * NS_PER_SECOND))
+            if all(bound is None or bound % step == 0 for bound in (start_ns, end_ns)):
+                return resolution
+        return min(self.resolutions)
+
+    def rows(self, resolution, start_ns=None, end_ns=None, dimension=None):
+        """Rollup rows of buckets starting in [start_ns, end_ns)"""
+        filters = []
+        if start_ns is not None:
+            filters.append(('start_ns', '>=', start_ns))
+        if end_ns is not None:
+            filters.append(('start_ns', '<', end_ns))
+        if dimension is not None:
+            filters.append(('dimension', '=', dimension))
+
+        if self._frames is not None:
+            frame = self._frames[resolution]
+            mask = np.ones(len(frame), dtype=bool)
+            for column, op, value in filters:
+                values = frame[column].to_numpy()
+                mask &= values >= value if op == '>=' else values < value if op == '<' else values == value
+            return frame[mask]
+        return pq.read_table(os.path.join(self.directory, _rollup_file(resolution)),
+                             filters=filters or None).to_pandas()
+
+    def events(self, start_ns=None, end_ns=None):
+        """Detector events overlapping [start_ns, end_ns), plus the untimed ones"""
+        if self._events is not None:
+            events = self._events
+        else:
+            events = pq.read_table(os.path.join(self.directory, EVENTS_FILE)).to_pandas()
+            for column in ('first_ns', 'last_ns', 'count'):
+                events[column] = events[column].astype('Int64')
+        keep = pd.Series(True, index=events.index)
+        if start_ns is not None:
+            keep &= events['last_ns'].isna() | (events['last_ns'] >= start_ns)
+        if end_ns is not None:
+            keep &= events['first_ns'].isna() | (events['first_ns'] < end_ns)
+        events = events[keep.to_numpy(dtype=bool)].astype(object)
+        return events.where(events.notna(), None).to_dict('records')
+
+    def query(self, start_ns=None, end_ns=None, resolution=None):
+        """RollupView of [start_ns, end_ns), at resolution_for() unless given"""
+        if resolution is None:
+            resolution = self.resolution_for(start_ns, end_ns)
+        return RollupView(self, resolution, start_ns, end_ns)
+
+    def timeline(self, start_ns=None, end_ns=None, max_points=2000):
+        """Filled Timeline of the range at the finest resolution with at most max_points buckets"""
+        first, last = self.metadata["first_ns"], self.metadata["last_ns"]
+        if first is None:
+            return None
+        first = first if start_ns is None else max(first, start_ns)
+        last = last if end_ns is None else min(last, end_ns - 1)
+        resolutions = sorted(self.resolutions)
+        for resolution in resolutions:
+            step = int(round(resolution * NS_PER_SECOND))
+            if last // step - first // step < max_points:
+                break
+        rows = self.rows(resolution, start_ns, end_ns, 'protocol')
+        if rows.empty:
+            return None
+        packets = rows.pivot_table(index='start_ns', columns='key', values='packets',
+                                   aggfunc='sum', fill_value=0, observed=True)
+        bytes_ = rows.groupby('start_ns')['bytes'].sum()
+        timeline = Timeline(
+            int(round(resolution * NS_PER_SECOND)),
+            packets.index.to_numpy(dtype=np.int64),
+            packets.sum(axis=1).to_numpy(dtype=np.int64),
+            bytes_.reindex(packets.index).to_numpy(dtype=np.int64),
+            packets.to_numpy(dtype=np.int64),
+            [str(name) for name in packets.columns]
+        )
+        return timeline.filled(max_points)
+
+
+class RollupView:
+    """Aggregates of a time range, from one resolution of a RollupStore"""
+
+    def __init__(self, store, resolution, start_ns=None, end_ns=None):
+        self.store = store
+        self.resolution = resolution
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.rows = store.rows(resolution, start_ns, end_ns)
+        self.truncated = store.metadata["talkers_truncated"].get(f"{resolution:g}", False)
+
+    def _dimension(self, dimension):
+        return self.rows[self.rows['dimension'] == dimension]
+
+    @property
+    def first_ns(self):
+        """Time of the first packet, or the start of the range"""
+        first = self.store.metadata["first_ns"]
+        return first if self.start_ns is None or first is None else max(first, self.start_ns)
+
+    @property
+    def last_ns(self):
+        """Time of the last packet, or the end of the range"""
+        last = self.store.metadata["last_ns"]
+        return last if self.end_ns is None or last is None else min(last, self.end_ns)
+
+    @property
+    def total_packets(self):
+        return int(self._dimension('protocol')['packets'].sum())
+
+    @property
+    def total_bytes(self):
+        return int(self._dimension('protocol')['bytes'].sum())
+
+    def _counter(self, dimension, column='packets'):
+        totals = self._dimension(dimension).groupby('key')[column].sum()
+        return Counter({key: int(value) for key, value in totals.items()})
+
+    def protocol_counter(self):
+        return self._counter('protocol')
+
+    def chain_counter(self):
+        return self._counter('chain')
+
+    def talker_counter(self):
+        """Bytes sent plus received per IP, like parse_packets' ip_traffic_counter"""
+        return self._counter('source', 'bytes') + self._counter('destination', 'bytes')
+
+    @property
+    def whole_capture(self):
+        """True when the range holds every packet of the capture"""
+        first, last = self.store.metadata["first_ns"], self.store.metadata["last_ns"]
+        return ((self.start_ns is None or first is None or self.start_ns <= first)
+                and (self.end_ns is None or last is None or self.end_ns > last))
+
+    def unique_addresses(self, dimension):
+        """
+        Distinct 'source' or 'destination' addresses: exact for the whole
+        capture or untruncated rollups, else a lower bound (see
+        unique_addresses_exact)
+        """
+        stored = self.store.metadata.get("unique_addresses")
+        if stored is not None and self.whole_capture:
+            return stored[dimension]
+        return int(self._dimension(dimension)['key'].nunique())
+
+    def unique_addresses_exact(self, dimension):
+        """False when unique_addresses(dimension) is only a lower bound"""
+        return (not self.truncated
+                or (self.whole_capture and "unique_addresses" in self.store.metadata))
+
+    def size_histogram(self):
+        """{bin start: packets} for SIZE_BIN-byte length bins"""
+        totals = self._dimension('size').groupby('key')['packets'].sum()
+        return {int(key): int(value) for key, value in sorted(totals.items(), key=lambda item: int(item[0]))}
+
+    def protocol_statistics(self):
+        """Per-protocol statistics in the format of get_protocol_statistics(df)"""
+        stats = _combine(self._dimension('protocol'), ['key'])
+        if stats.empty:
+            return {}
+        stats = stats.sort_values('packets', ascending=False, kind='stable')
+        count = stats['packets'].to_numpy(dtype=np.float64)
+        total = stats['bytes'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (stats['bytes_sq'].to_numpy() - total * total / count) / (count - 1)
+        std = np.where(count > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+
+        protocol_stats = {}
+        for i, protocol in enumerate(stats['key']):
+            protocol_stats[protocol] = {
+                'count': int(count[i]),
+                'total_bytes': int(total[i]),
+                'avg_packet_size': total[i] / count[i],
+                'min_packet_size': int(stats['min_length'].iloc[i]),
+                'max_packet_size': int(stats['max_length'].iloc[i]),
+                'std_packet_size': float(std[i]),
+            }
+        chains = self._dimension('chain').groupby(['protocol', 'key'])['packets'].sum()
+        for (protocol, chain), _count in chains.sort_values(ascending=False, kind='stable').items():
+            if protocol in protocol_stats:
+                protocol_stats[protocol].setdefault('chain', chain)
+        return protocol_stats
+
+    def busiest(self, n=10):
+        """The n buckets with the most packets, as (start_ns, packets, bytes)"""
+        totals = self._dimension('protocol').groupby('start_ns')[['packets', 'bytes']].sum()
+        top = totals.sort_values('packets', ascending=False, kind='stable').head(n)
+        return [(int(start), int(row['packets']), int(row['bytes'])) for start, row in top.iterrows()]
+
+    def events(self):
+        return self.store.events(self.start_ns, self.end_ns)
+
+    def timeline(self, max_points=2000):
+        return self.store.timeline(self.start_ns, self.end_ns, max_points)
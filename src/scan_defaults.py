@@ -0,0 +1,27 @@
+# scan_defaults.py
+"""
+Default detector thresholds of the security scan.
+
+The detector signatures, comprehensive_security_scan and scan_table fall
+back to these, and get_default_config ships them as the "thresholds"
+settings, so a missing key behaves exactly like the shipped value.
+"""
+
+PORT_SCAN_THRESHOLD = 10
+SYN_FLOOD_THRESHOLD = 50
+ICMP_FLOOD_THRESHOLD = 100
+SYN_FLOOD_RATE = 100
+ICMP_FLOOD_RATE = 50
+DNS_QUERY_RATE = 20
+FLOOD_WINDOW = 10
+
+# The same defaults keyed by their name in the "thresholds" settings
+SCAN_THRESHOLDS = {
+    "port_scan_threshold": PORT_SCAN_THRESHOLD,
+    "syn_flood_threshold": SYN_FLOOD_THRESHOLD,
+    "icmp_flood_threshold": ICMP_FLOOD_THRESHOLD,
+    "syn_flood_rate": SYN_FLOOD_RATE,
+    "icmp_flood_rate": ICMP_FLOOD_RATE,
+    "dns_query_rate": DNS_QUERY_RATE,
+    "flood_window_seconds": FLOOD_WINDOW,
+}
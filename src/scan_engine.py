@@ -0,0 +1,154 @@
+# scan_engine.py
+"""
+Single-pass detector engine.
+
+Every detector is a visitor with a visit(view) and a result() method.
+run_visitors() dissects each packet once into a PacketView and hands it to
+all visitors, so a security scan costs one pass over the capture (and, for
+streams, one read of the file) instead of one pass per detector.
+
+Streamed records are decoded from the raw bytes by the fast dissector;
+records it cannot decode, and plain scapy packet lists, are viewed through
+their scapy layers. Either way a view carries exactly the values the
+original per-detector haslayer() lookups produced.
+"""
+
+from scapy.all import TCP, UDP, ICMP, IP, IPv6
+
+from fast_dissector import (
+    decode_headers, to_scapy, ns_to_time, time_to_ns,
+    TCP_BOUND_PORTS, UDP_BOUND_PORTS, DNS_TCP_PORTS, DNS_UDP_PORTS,
+    IPPROTO_TCP, IPPROTO_UDP
+)
+
+# Application layers other than DNS may carry further IP, TCP, UDP or ICMP
+# layers (VXLAN, GRE, L2TP, ...); records on those ports go through scapy.
+_TCP_NESTING_PORTS = TCP_BOUND_PORTS - DNS_TCP_PORTS
+_UDP_NESTING_PORTS = UDP_BOUND_PORTS - DNS_UDP_PORTS
+
+
+class PacketView:
+    """
+    The fields the detectors look at, decoded once per packet.
+
+    ip is the (src, dst) pair of the IPv4 layer and addresses that of the
+    IPv4 or IPv6 layer; tcp is (sport, dport, flags) and udp (sport, dport)
+    of the first such layer, or None, and seq the sequence number of that
+    TCP layer. For views decoded from raw bytes (decoded is True) payload
+    is a zero-copy view of the transport payload.
+    scapy() dissects the packet on demand, at most once.
+    """
+
+    __slots__ = ('decoded', 'ip', 'addresses', 'tcp', 'seq', 'udp', 'icmp', 'length',
+                 'payload', '_time', '_timestamp_ns', '_pkt', '_record')
+
+    def __init__(self):
+        self.decoded = False
+        self.ip = None
+        self.addresses = None
+        self.tcp = None
+        self.seq = None
+        self.udp = None
+        self.icmp = False
+        self.length = 0
+        self.payload = None
+        self._time = None
+        self._timestamp_ns = None
+        self._pkt = None
+        self._record = None
+
+    @property
+    def time(self):
+        """Packet time as scapy reports it"""
+        if self._time is None:
+            self._time = ns_to_time(self._timestamp_ns)
+        return self._time
+
+    @property
+    def timestamp_ns(self):
+        if self._timestamp_ns is None:
+            self._timestamp_ns = time_to_ns(self._time)
+        return self._timestamp_ns
+
+    def scapy(self):
+        """The scapy packet, dissected from the record on first use"""
+        if self._pkt is None:
+            data, linktype = self._record
+            self._pkt = to_scapy(data, linktype, timestamp_ns=self._timestamp_ns)
+        return self._pkt
+
+
+def view_scapy(pkt):
+    """Build the view of a scapy packet"""
+    view = PacketView()
+    view._pkt = pkt
+    view._time = pkt.time
+    view.length = len(pkt)
+    if pkt.haslayer(IP):
+        view.ip = view.addresses = (pkt[IP].src, pkt[IP].dst)
+    elif pkt.haslayer(IPv6):
+        view.addresses = (pkt[IPv6].src, pkt[IPv6].dst)
+    if pkt.haslayer(TCP):
+        tcp = pkt[TCP]
+        view.tcp = (tcp.sport, tcp.dport, tcp.flags)
+        view.seq = tcp.seq
+    if pkt.haslayer(UDP):
+        udp = pkt[UDP]
+        view.udp = (udp.sport, udp.dport)
+    view.icmp = pkt.haslayer(ICMP)
+    return view
+
+
+def view_record(data, timestamp_ns, linktype):
+    """Build the view of a raw capture record"""
+    headers = decode_headers(data, linktype)
+    if headers is not None:
+        network, src_ip, dst_ip, proto, sport, dport, flags, start, end, seq = headers
+        if proto == IPPROTO_TCP:
+            nested = sport in _TCP_NESTING_PORTS or dport in _TCP_NESTING_PORTS
+        elif proto == IPPROTO_UDP:
+            nested = sport in _UDP_NESTING_PORTS or dport in _UDP_NESTING_PORTS
+        else:
+            nested = False
+        if not nested:
+            view = PacketView()
+            view.decoded = True
+            view._record = (data, linktype)
+            view._timestamp_ns = timestamp_ns
+            view.length = len(data)
+            if network != "ARP":
+                view.addresses = (src_ip, dst_ip)
+                if network == "IP":
+                    view.ip = view.addresses
+            if proto == IPPROTO_TCP:
+                view.tcp = (sport, dport, flags)
+                view.seq = seq
+            elif proto == IPPROTO_UDP:
+                view.udp = (sport, dport)
+            elif proto is not None:
+                view.icmp = True
+            view.payload = data[start:end]
+            return view
+
+    view = view_scapy(to_scapy(data, linktype, timestamp_ns=timestamp_ns))
+    view._timestamp_ns = timestamp_ns
+    return view
+
+
+def iter_views(packets):
+    """Yield one PacketView per packet of a list or stream"""
+    if hasattr(packets, 'records'):
+        for data, timestamp_ns, linktype in packets.records():
+            yield view_record(data, timestamp_ns, linktype)
+    else:
+        for pkt in packets:
+            yield view_scapy(pkt)
+
+
+def run_visitors(packets, visitors):
+    """Feed every packet to every visitor in one pass, returns their results"""
+    visits = [visitor.visit for visitor in visitors]
+    for view in iter_views(packets):
+        for visit in visits:
+            visit(view)
+    return [visitor.result() for visitor in visitors]
@@ -0,0 +1,151 @@
+# seek_index.py
+"""
+Sparse time index of classic pcap files, kept in a sidecar file.
+
+Every INTERVAL records the index stores the byte offset of the record and
+the earliest and latest timestamp of the records from there up to the
+next mark. A time range is turned into a byte range with two binary
+searches: the first block whose running maximum reaches the start, and
+the first block after which no record is earlier than the end. Captures
+with slightly out-of-order timestamps are still read completely; records
+in the byte range are filtered by their exact timestamp.
+
+The index is saved next to the capture as <capture>.nsidx and rebuilt
+when the capture's size or mtime changes. It is built on the side while
+a capture is read in full, or by a header-only pass the first time a
+range is requested.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+INDEX_SUFFIX = ".nsidx"
+INDEX_MAGIC = b"NSIDX\x00\x00\x01"
+INTERVAL = 4096
+
+_HEADER = struct.Struct("<8sQqQQ")
+
+
+def index_path(capture_path):
+    return capture_path + INDEX_SUFFIX
+
+
+class IndexBuilder:
+    """Collect the marks of a SeekIndex while the records are read in order"""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.count = 0
+        self.offsets = []
+        self.first_ns = []
+        self.last_ns = []
+
+    def add(self, offset, timestamp_ns):
+        if self.count % self.interval == 0:
+            self.offsets.append(offset)
+            self.first_ns.append(timestamp_ns)
+            self.last_ns.append(timestamp_ns)
+        elif timestamp_ns < self.first_ns[-1]:
+            self.first_ns[-1] = timestamp_ns
+        elif timestamp_ns > self.last_ns[-1]:
+            self.last_ns[-1] = timestamp_ns
+        self.count += 1
+
+    def finish(self, size, mtime_ns):
+        return SeekIndex(size, mtime_ns, self.interval,
+                         np.array(self.offsets, dtype=np.int64),
+                         np.array(self.first_ns, dtype=np.int64),
+                         np.array(self.last_ns, dtype=np.int64))
+
+
+class SeekIndex:
+    """
+    Block offsets and timestamp bounds of one capture.
+
+    size and mtime_ns identify the capture version the index describes.
+    """
+
+    def __init__(self, size, mtime_ns, interval, offsets, first_ns, last_ns):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.interval = interval
+        self.offsets = offsets
+        self.first_ns = first_ns
+        self.last_ns = last_ns
+        # Both are sorted whatever the order of the timestamps
+        self._latest_so_far = np.maximum.accumulate(last_ns) if len(last_ns) else last_ns
+        self._earliest_after = np.minimum.accumulate(first_ns[::-1])[::-1] if len(first_ns) else first_ns
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, capture, interval=INTERVAL):
+        """Index a MappedPcap with one pass over the record headers"""
+        builder = IndexBuilder(interval)
+        for _data in capture.packets(index=builder):
+            pass
+        stat = os.stat(capture.file_path)
+        return builder.finish(stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, capture_path):
+        """The sidecar index of capture_path, or None if missing, stale or unreadable"""
+        try:
+            stat = os.stat(capture_path)
+            with open(index_path(capture_path), "rb") as f:
+                magic, size, mtime_ns, interval, blocks = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                    return None
+                arrays = np.fromfile(f, dtype="<i8", count=3 * blocks)
+        except (OSError, struct.error):
+            return None
+        if len(arrays) != 3 * blocks:
+            return None
+        offsets, first_ns, last_ns = arrays.reshape(3, blocks)
+        return cls(size, mtime_ns, interval, offsets, first_ns, last_ns)
+
+    def save(self, capture_path):
+        """Write the sidecar; returns False when its directory is not writable"""
+        path = index_path(capture_path)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(_HEADER.pack(INDEX_MAGIC, self.size, self.mtime_ns, self.interval, len(self)))
+                np.concatenate([self.offsets, self.first_ns, self.last_ns]).astype("<i8").tofile(f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            return False
+        return True
+
+    def byte_range(self, start_ns=None, end_ns=None):
+        """
+        (start, stop) byte offsets holding every record with start_ns <=
+        timestamp < end_ns; stop is None for the end of the file.
+        """
+        blocks = len(self)
+        first = 0
+        if start_ns is not None:
+            first = int(np.searchsorted(self._latest_so_far, start_ns, side="left"))
+        last = blocks
+        if end_ns is not None:
+            last = int(np.searchsorted(self._earliest_after, end_ns, side="left"))
+        start = int(self.offsets[first]) if first < blocks else self.size
+        stop = int(self.offsets[last]) if last < blocks else None
+        if stop is not None and stop < start:
+            stop = start
+        return start, stop
+
+
+def capture_index(capture):
+    """
+    SeekIndex of a MappedPcap: the saved sidecar if it is current, else a
+    new one, built with a header pass and saved.
+    """
+    index = SeekIndex.load(capture.file_path)
+    if index is None:
+        print(f"🧭 Indexing {capture.file_path} for time-range reads...")
+        index = SeekIndex.build(capture)
+        index.save(capture.file_path)
+    return index
@@ -0,0 +1,250 @@
+# signature_engine.py
+"""
+Multi-pattern payload signatures.
+
+The rules file is compiled once into an Aho-Corasick automaton, so every
+payload is scanned in a single pass whatever the number of signatures.
+Rules are lines of
+
+    <name> <severity> "<content>" [nocase]
+
+where severity is low, medium, high or critical and content is matched
+as bytes, with Snort-style |hex| runs for binary data, e.g.
+
+    meterpreter-stage  high  "|6d 65 74 65 72|preter"
+
+Blank lines and lines starting with # are ignored. Matches are
+aggregated per signature, source and destination, so the alerts stay
+bounded on long captures.
+"""
+
+import re
+from collections import deque
+
+from scapy.all import TCP, UDP, Raw
+
+from scan_engine import run_visitors
+
+SEVERITIES = ('low', 'medium', 'high', 'critical')
+
+_RULE = re.compile(r'^(\S+)\s+(\w+)\s+"((?:[^"\\]|\\.)*)"(?:\s+(nocase))?\s*$')
+_HEX_RUN = re.compile(r'\|([0-9A-Fa-f\s]*)\|')
+
+
+class Signature:
+    __slots__ = ('name', 'severity', 'content', 'nocase')
+
+    def __init__(self, name, severity, content, nocase=False):
+        self.name = name
+        self.severity = severity
+        self.content = content
+        self.nocase = nocase
+
+
+def parse_content(text):
+    """Content bytes of a rule: text with |hex| runs and \\" or \\\\ escapes"""
+    content = bytearray()
+    position = 0
+    for run in _HEX_RUN.finditer(text):
+        content += re.sub(r'\\(.)', r'\1', text[position:run.start()]).encode('utf-8')
+        content += bytes.fromhex(run.group(1))
+        position = run.end()
+    content += re.sub(r'\\(.)', r'\1', text[position:]).encode('utf-8')
+    return bytes(content)
+
+
+def load_signatures(path):
+    """Read a rules file; raises ValueError naming the first bad line"""
+    signatures = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            rule = _RULE.match(line)
+            if rule is None:
+                raise ValueError(f"{path}:{number}: expected <name> <severity> \"<content>\" [nocase]")
+            name, severity, text, nocase = rule.groups()
+            if severity.lower() not in SEVERITIES:
+                raise ValueError(f"{path}:{number}: unknown severity {severity!r}")
+            try:
+                content = parse_content(text)
+            except ValueError:
+                raise ValueError(f"{path}:{number}: bad hex run in content") from None
+            if not content:
+                raise ValueError(f"{path}:{number}: empty content")
+            signatures.append(Signature(name, severity.lower(), content, nocase is not None))
+    return signatures
+
+
+class AhoCorasick:
+    """
+    Automaton matching a list of byte patterns in one pass.
+
+    search() yields (pattern index, end offset) for every occurrence.
+    While no pattern is partially matched, the scan jumps straight to the
+    next byte that can start a pattern.
+    """
+
+    def __init__(self, patterns):
+        goto = [{}]
+        fail = [0]
+        outputs = [()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern:
+                following = goto[state].get(byte)
+                if following is None:
+                    following = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    outputs.append(())
+                    goto[state][byte] = following
+                state = following
+            outputs[state] += (index,)
+
+        # Failure links, breadth first: the longest proper suffix that is
+        # also a pattern prefix
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, following in goto[state].items():
+                queue.append(following)
+                suffix = fail[state]
+                while suffix and byte not in goto[suffix]:
+                    suffix = fail[suffix]
+                target = goto[suffix].get(byte, 0)
+                fail[following] = target if target != following else 0
+                outputs[following] += outputs[fail[following]]
+
+        self.goto = goto
+        self.fail = fail
+        self.outputs = outputs
+        self._first = re.compile(b'[' + b''.join(re.escape(bytes([byte])) for byte in goto[0]) + b']')
+
+    def __len__(self):
+        return len(self.goto)
+
+    def search(self, data):
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        first = self._first
+        state = 0
+        position = 0
+        size = len(data)
+        while position < size:
+            if not state:
+                found = first.search(data, position)
+                if found is None:
+                    return
+                position = found.start()
+            byte = data[position]
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            position += 1
+            if outputs[state]:
+                for index in outputs[state]:
+                    yield index, position
+
+
+class SignatureSet:
+    """
+    Compiled signatures: one automaton for exact rules and one, over
+    lowercased bytes, for nocase rules.
+    """
+
+    def __init__(self, signatures):
+        self.signatures = list(signatures)
+        exact = [i for i, signature in enumerate(self.signatures) if not signature.nocase]
+        nocase = [i for i, signature in enumerate(self.signatures) if signature.nocase]
+        self._automata = []
+        if exact:
+            self._automata.append((False, exact, AhoCorasick(
+                [self.signatures[i].content for i in exact])))
+        if nocase:
+            self._automata.append((True, nocase, AhoCorasick(
+                [self.signatures[i].content.lower() for i in nocase])))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_signatures(path))
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def match(self, payload):
+        """Indices of the signatures found in payload, each once"""
+        found = set()
+        for lower, indices, automaton in self._automata:
+            data = bytes(payload).lower() if lower else payload
+            for index, _end in automaton.search(data):
+                found.add(indices[index])
+        return found
+
+
+class SignatureScanner:
+    """
+    Per-packet visitor matching transport payloads against a SignatureSet.
+
+    Matches are aggregated per (signature, source, destination); at most
+    max_alerts such groups are kept, further new groups are only counted
+    in dropped.
+    """
+
+    def __init__(self, signatures, max_alerts=10000):
+        self.signatures = signatures
+        self.max_alerts = max_alerts
+        self.alerts = {}
+        self.dropped = 0
+
+    def visit(self, view):
+        if view.decoded:
+            payload = view.payload
+        else:
+            pkt = view.scapy()
+            if pkt.haslayer(TCP) or pkt.haslayer(UDP):
+                layer = (pkt[TCP] if pkt.haslayer(TCP) else pkt[UDP]).payload
+                payload = layer.load if isinstance(layer, Raw) else bytes(layer)
+            elif pkt.haslayer(Raw):
+                payload = pkt[Raw].load
+            else:
+                return
+        if not payload:
+            return
+        found = self.signatures.match(payload)
+        if not found:
+            return
+
+        src_ip, dst_ip = view.addresses or ('', '')
+        ports = view.tcp or view.udp
+        for index in found:
+            key = (index, src_ip, dst_ip)
+            alert = self.alerts.get(key)
+            if alert is None:
+                if len(self.alerts) >= self.max_alerts:
+                    self.dropped += 1
+                    continue
+                signature = self.signatures.signatures[index]
+                alert = self.alerts[key] = {
+                    'signature': signature.name,
+                    'severity': signature.severity,
+                    'src_ip': src_ip,
+                    'dst_ip': dst_ip,
+                    'src_port': ports[0] if ports else None,
+                    'dst_port': ports[1] if ports else None,
+                    'count': 0,
+                    'first_seen': view.time,
+                    'last_seen': view.time
+                }
+            alert['count'] += 1
+            alert['last_seen'] = view.time
+
+    def result(self):
+        """Alerts, most severe first, then by match count"""
+        return sorted(self.alerts.values(),
+                      key=lambda alert: (-SEVERITIES.index(alert['severity']), -alert['count']))
+
+
+def scan_signatures(packets, signatures, max_alerts=10000):
+    """Match every packet payload against a SignatureSet in one pass"""
+    return run_visitors(packets, [SignatureScanner(signatures, max_alerts)])[0]
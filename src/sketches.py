@@ -0,0 +1,329 @@
+# sketches.py
+"""
+Bounded-memory sketches for per-IP statistics.
+
+HyperLogLog estimates how many distinct keys were seen. TalkerSketch
+replaces the per-IP byte Counter on captures with too many addresses to
+count exactly: a Space-Saving summary keeps the heaviest IPs with an
+error bound for each, and a Count-Min table estimates the bytes of any
+other IP. All sketches hash keys with BLAKE2b rather than hash(), so
+sketches built in different worker processes can be merged. PortSketch
+counts the distinct ports a source has contacted, exactly while there
+are few and with a small HyperLogLog beyond that.
+"""
+
+import heapq
+import math
+from array import array
+from hashlib import blake2b
+
+import numpy as np
+
+
+def hash64(key):
+    """Stable 64-bit hash of a key (same value in every process)"""
+    data = key.encode() if isinstance(key, str) else repr(key).encode()
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Distinct-count estimate in 2**precision one-byte registers.
+
+    The standard error is about 1.04 / sqrt(2**precision), e.g. 0.8% at
+    the default precision of 14 (16 KiB).
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._rank_bits = 64 - precision
+        self._rank_mask = (1 << self._rank_bits) - 1
+
+    def add(self, key):
+        self.add_hash(hash64(key))
+
+    def add_hash(self, hashed):
+        index = hashed >> self._rank_bits
+        rank = self._rank_bits - (hashed & self._rank_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precision")
+        self.registers = bytearray(np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers, dtype=np.uint8)
+        ).tobytes())
+
+    def count(self):
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int32)))
+        zeros = m - np.count_nonzero(registers)
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TalkerSketch:
+    """
+    Approximate per-IP byte counts in fixed memory.
+
+    Behaves like the per-IP Counter for the reports: most_common(),
+    get(), items() and len(). Space-Saving keeps the capacity heaviest
+    IPs. Their counts are never too low and overstate the truth by at
+    most error(ip), which is itself at most total() / capacity. Any IP
+    that carried more than total() / capacity bytes is guaranteed to be
+    kept. Other IPs are estimated by a Count-Min table of depth x width
+    counters, whose overestimate is below e / width * total() with
+    probability 1 - exp(-depth). len() is a HyperLogLog estimate of the
+    number of distinct IPs.
+    """
+
+    def __init__(self, capacity=1000, width=2048, depth=4, precision=14):
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.counts = {}
+        self.errors = {}
+        # Upper bound on the bytes of any IP not in counts
+        self.floor = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.distinct = HyperLogLog(precision)
+        self._total = 0
+
+    def _columns(self, hashes):
+        """Count-Min column of each hash in every row (double hashing)"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((low + rows * high) % np.uint64(self.width)).astype(np.intp)
+
+    def update(self, ip_bytes):
+        """Add a mapping of IP -> bytes, e.g. the per-IP Counter of one batch"""
+        if not ip_bytes:
+            return
+        hashes = [hash64(ip) for ip in ip_bytes]
+        weights = np.fromiter(ip_bytes.values(), dtype=np.int64, count=len(ip_bytes))
+        np.add.at(self.table, (np.arange(self.depth)[:, None], self._columns(hashes)), weights)
+        for hashed in hashes:
+            self.distinct.add_hash(hashed)
+        self._total += int(weights.sum())
+        # A batch is an exact summary: no error and nothing left out
+        self._combine(ip_bytes, {}, 0)
+
+    def merge(self, other):
+        """Add another sketch with the same dimensions, e.g. a worker's"""
+        if (other.capacity, other.width, other.depth) != (self.capacity, self.width, self.depth):
+            raise ValueError("Cannot merge talker sketches with different dimensions")
+        self.table += other.table
+        self.distinct.merge(other.distinct)
+        self._total += other._total
+        self._combine(other.counts, other.errors, other.floor)
+
+    def _combine(self, counts, errors, floor):
+        """
+        Merge a Space-Saving summary into this one, then keep the capacity
+        heaviest IPs. An IP missing from one side may have up to that
+        side's floor bytes there, which is added to its count and error.
+        """
+        merged_counts = {}
+        merged_errors = {}
+        for ip, count in self.counts.items():
+            merged_counts[ip] = count + counts.get(ip, floor)
+            merged_errors[ip] = self.errors[ip] + errors.get(ip, floor if ip not in counts else 0)
+        for ip, count in counts.items():
+            if ip not in merged_counts:
+                merged_counts[ip] = count + self.floor
+                merged_errors[ip] = errors.get(ip, 0) + self.floor
+
+        new_floor = self.floor + floor
+        if len(merged_counts) > self.capacity:
+            kept = heapq.nlargest(self.capacity + 1, merged_counts.items(), key=lambda item: item[1])
+            new_floor = max(new_floor, kept.pop()[1])
+            merged_counts = dict(kept)
+            merged_errors = {ip: merged_errors[ip] for ip in merged_counts}
+        self.counts = merged_counts
+        self.errors = merged_errors
+        self.floor = new_floor
+
+    def total(self):
+        """Exact total of all bytes added"""
+        return self._total
+
+    def estimate(self, ip):
+        """Estimated bytes of ip; never below the true value"""
+        count = self.counts.get(ip)
+        if count is not None:
+            return count
+        if not self.floor:
+            # Nothing was ever evicted, so an unkept IP was never seen
+            return 0
+        columns = self._columns([hash64(ip)])[:, 0]
+        return min(self.floor, int(self.table[np.arange(self.depth), columns].min()))
+
+    def error(self, ip):
+        """Upper bound on how far estimate(ip) overstates the true bytes"""
+        if ip in self.counts:
+            return self.errors[ip]
+        return self.estimate(ip)
+
+    def count_min_error(self):
+        """Count-Min overestimate bound and the probability it holds"""
+        return math.e / self.width * self._total, 1 - math.exp(-self.depth)
+
+    def describe(self):
+        """One-line statement of the sketch's accuracy, for reports"""
+        bound, confidence = self.count_min_error()
+        return (f"Estimated with a {self.capacity:,}-entry Space-Saving sketch: top talker byte "
+                f"counts are overstated by at most {self.floor:,} bytes; other IPs within "
+                f"{bound:,.0f} bytes at {confidence:.1%} confidence")
+
+    def most_common(self, n=None):
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def get(self, ip, default=0):
+        estimate = self.estimate(ip)
+        return estimate if estimate else default
+
+    def __getitem__(self, ip):
+        return self.estimate(ip)
+
+    def __contains__(self, ip):
+        return ip in self.counts
+
+    def items(self):
+        """The kept IPs and their estimates"""
+        return self.counts.items()
+
+    def keys(self):
+        return self.counts.keys()
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return self.distinct.count()
+
+    def __bool__(self):
+        return bool(self.counts)
+
+
+def _splitmix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+# HyperLogLog register index and rank of every (protocol, port) code,
+# per precision: a port update is then two table lookups
+_PORT_TABLES = {}
+
+
+def _port_tables(precision):
+    tables = _PORT_TABLES.get(precision)
+    if tables is None:
+        rank_bits = 64 - precision
+        rank_mask = (1 << rank_bits) - 1
+        index = array('H')
+        rank = bytearray()
+        for code in range(2 << 16):
+            hashed = _splitmix64(code)
+            index.append(hashed >> rank_bits)
+            rank.append(rank_bits - (hashed & rank_mask).bit_length() + 1)
+        tables = _PORT_TABLES[precision] = (index, bytes(rank))
+    return tables
+
+
+class PortSketch:
+    """
+    Distinct (protocol, port) pairs contacted by one source.
+
+    Up to cutoff pairs are kept in an exact set. Past that they are
+    counted by a HyperLogLog of 2**precision registers (1 KiB and about
+    3% error at the default precision of 10), and only the
+    sample_size lowest ports are remembered. Memory per source is
+    therefore bounded whatever the scan rate.
+    """
+
+    __slots__ = ('cutoff', 'precision', 'sample_size', 'ports', 'hll',
+                 '_index', '_rank', '_sample_max')
+
+    def __init__(self, cutoff=64, precision=10, sample_size=20):
+        self.cutoff = cutoff
+        self.precision = precision
+        self.sample_size = sample_size
+        self.ports = set()
+        self.hll = None
+        self._index, self._rank = _port_tables(precision)
+        self._sample_max = None
+
+    @property
+    def estimated(self):
+        """True once the count comes from the HyperLogLog"""
+        return self.hll is not None
+
+    def add(self, key):
+        """Record a ('TCP' or 'UDP', port) pair"""
+        if self.hll is None:
+            self.ports.add(key)
+            if len(self.ports) > self.cutoff:
+                self._promote()
+            return
+        code = key[1] | 0x10000 if key[0] == 'UDP' else key[1]
+        index = self._index[code]
+        rank = self._rank[code]
+        registers = self.hll.registers
+        if rank > registers[index]:
+            registers[index] = rank
+        if key[1] < self._sample_max and key not in self.ports:
+            self.ports.add(key)
+            self._trim_sample()
+
+    def _promote(self):
+        """Move the exact set into a HyperLogLog, keeping the lowest ports"""
+        self.hll = HyperLogLog(self.precision)
+        registers = self.hll.registers
+        for protocol, port in self.ports:
+            code = port | 0x10000 if protocol == 'UDP' else port
+            index = self._index[code]
+            registers[index] = max(registers[index], self._rank[code])
+        self._trim_sample()
+
+    def _trim_sample(self):
+        if len(self.ports) > self.sample_size:
+            self.ports = set(self.sample())
+        if len(self.ports) < self.sample_size:
+            self._sample_max = 1 << 16
+        else:
+            self._sample_max = max(port for _protocol, port in self.ports)
+
+    def sample(self):
+        """The lowest ports seen, at most sample_size of them"""
+        return sorted(self.ports, key=lambda key: key[1])[:self.sample_size]
+
+    def __len__(self):
+        if self.hll is None:
+            return len(self.ports)
+        return max(self.hll.count(), self.cutoff + 1)
+
+
+def traffic_total(ip_traffic_counter):
+    """Total bytes of a per-IP Counter or TalkerSketch"""
+    if isinstance(ip_traffic_counter, TalkerSketch):
+        return ip_traffic_counter.total()
+    return sum(ip_traffic_counter.values())
+
+
+def talker_note(ip_traffic_counter):
+    """Accuracy note for reports when per-IP bytes are estimated, else None"""
+    if isinstance(ip_traffic_counter, TalkerSketch):
+        return ip_traffic_counter.describe()
+    return None
@@ -0,0 +1,160 @@
+# table_detectors.py
+"""
+Vectorized detectors over the parsed packet table.
+
+These compute the port scan and ICMP flood results of advanced_analyzer
+from the DataFrame that parse_packets builds (or the parse cache
+returns), using NumPy grouping instead of a pass over the packets. Layer
+tests such as haslayer(TCP) become lookups on the protocol-chain
+categories, so a capture that was parsed once can be scanned again
+without reading it. Detectors that need TCP flags or payloads (SYN
+floods, DNS, HTTP) still run on the packets.
+"""
+
+import numpy as np
+
+from fast_dissector import ns_to_time, NS_PER_SECOND
+from packet_table import CHAIN_SEPARATOR
+from scan_defaults import PORT_SCAN_THRESHOLD, ICMP_FLOOD_THRESHOLD, ICMP_FLOOD_RATE, FLOOD_WINDOW
+
+
+def _chain_masks(df, names):
+    """Per row, whether its protocol chain contains each layer name"""
+    chains = df['full_protocol']
+    layer_sets = [set(chain.split(CHAIN_SEPARATOR)) for chain in chains.cat.categories]
+    codes = chains.cat.codes.to_numpy()
+    return {
+        name: np.array([name in layers for layers in layer_sets], dtype=bool)[codes]
+        for name in names
+    }
+
+
+def _ports(column):
+    return column.to_numpy(dtype=np.int64, na_value=0)
+
+
+def detect_port_scanning_table(df, threshold=PORT_SCAN_THRESHOLD):
+    """
+    detect_port_scanning on the packet table: IPv4 sources that sent
+    TCP or UDP packets to at least threshold distinct ports.
+    """
+    if df.empty:
+        return {}
+    masks = _chain_masks(df, ('IP', 'TCP', 'UDP'))
+    selected = masks['IP'] & (masks['TCP'] | masks['UDP'])
+    src = df['src_ip'].cat.codes.to_numpy().astype(np.int64)[selected]
+    udp = (~masks['TCP'][selected]).astype(np.int64)
+    port = _ports(df['dst_port'])[selected]
+
+    # One entry per distinct (source, port, protocol), sorted in that order
+    pairs = np.unique((src << 17) | (port << 1) | udp)
+    pair_src = pairs >> 17
+    port_counts = np.bincount(pair_src, minlength=len(df['src_ip'].cat.categories))
+    starts = np.searchsorted(pair_src, np.arange(len(port_counts)))
+
+    addresses = df['src_ip'].cat.categories
+    scanners = {}
+    for code in np.flatnonzero(port_counts >= threshold):
+        first = pairs[starts[code]:starts[code] + min(20, port_counts[code])]
+        scanners[addresses[code]] = {
+            'port_count': int(port_counts[code]),
+            'ports': [('UDP' if key & 1 else 'TCP', int((key >> 1) & 0xFFFF)) for key in first]
+        }
+    return scanners
+
+
+def _icmp_rows(df):
+    masks = _chain_masks(df, ('IP', 'ICMP'))
+    return masks['IP'] & masks['ICMP']
+
+
+def detect_icmp_flood_table(df, threshold=ICMP_FLOOD_THRESHOLD):
+    """detect_icmp_flood on the packet table: ICMP packets per IPv4 source"""
+    if df.empty:
+        return {}
+    src = df['src_ip'].cat.codes.to_numpy()[_icmp_rows(df)]
+    counts = np.bincount(src, minlength=len(df['src_ip'].cat.categories))
+    addresses = df['src_ip'].cat.categories
+    return {addresses[code]: int(counts[code]) for code in np.flatnonzero(counts >= threshold)}
+
+
+def rate_alerts(codes, timestamps_ns, labels, rate, window=FLOOD_WINDOW, resolution=1):
+    """
+    The alerts SlidingRateDetector raises for events (codes[i] at
+    timestamps_ns[i], in capture order), computed for all keys at once.
+
+    For each event the number of events of its key in the window up to
+    and including it is found with one searchsorted; runs of events at
+    or above the rate form the alerts. labels maps codes to keys.
+    """
+    if not len(codes):
+        return []
+    buckets = max(1, int(round(window / resolution)))
+    order = np.lexsort((np.arange(len(codes)), codes))
+    codes = codes[order].astype(np.int64)
+    timestamps_ns = timestamps_ns[order]
+    bucket = timestamps_ns // int(resolution * NS_PER_SECOND)
+
+    # Offset buckets so a window never reaches into the previous key
+    bucket = bucket - bucket.min() + buckets
+    span = int(bucket.max()) + 1
+    combined = codes * span + bucket
+    first_in_window = np.searchsorted(combined, combined - (buckets - 1), side='left')
+    in_window = np.arange(len(codes)) - first_in_window + 1
+    rates = in_window / window
+    alerting = rates >= rate
+    if not alerting.any():
+        return []
+
+    new_key = np.empty(len(codes), dtype=bool)
+    new_key[0] = True
+    new_key[1:] = codes[1:] != codes[:-1]
+    previous = np.concatenate(([False], alerting[:-1]))
+    starts = np.flatnonzero(alerting & (new_key | ~previous))
+    ends = np.flatnonzero(alerting & np.concatenate((new_key[1:] | ~alerting[1:], [True])))
+
+    alerts = []
+    for start, end in zip(starts, ends):
+        start_ns = int(timestamps_ns[start])
+        end_ns = int(timestamps_ns[start:end + 1].max())
+        alerts.append({
+            'key': labels[codes[start]],
+            'start_ns': start_ns,
+            'end_ns': end_ns,
+            'events': int(end - start + 1),
+            'peak_rate': float(rates[start:end + 1].max()),
+            'start': ns_to_time(start_ns),
+            'end': ns_to_time(end_ns),
+        })
+    alerts.sort(key=lambda alert: alert['start_ns'])
+    return alerts
+
+
+def detect_icmp_flood_rate_table(df, rate=ICMP_FLOOD_RATE, window=FLOOD_WINDOW, resolution=1):
+    """detect_icmp_flood_rate on the packet table"""
+    if df.empty:
+        return []
+    rows = _icmp_rows(df)
+    return rate_alerts(df['src_ip'].cat.codes.to_numpy()[rows],
+                       df['timestamp_ns'].to_numpy()[rows],
+                       df['src_ip'].cat.categories, rate, window, resolution)
+
+
+def scan_table(df, thresholds=None):
+    """
+    The table-computable part of comprehensive_security_scan, with the
+    same result keys and the same "thresholds" settings.
+    """
+    thresholds = thresholds or {}
+    return {
+        'port_scanners': detect_port_scanning_table(
+            df, thresholds.get('port_scan_threshold', PORT_SCAN_THRESHOLD)
+        ),
+        'icmp_flooders': detect_icmp_flood_table(
+            df, thresholds.get('icmp_flood_threshold', ICMP_FLOOD_THRESHOLD)
+        ),
+        'icmp_flood_alerts': detect_icmp_flood_rate_table(
+            df, thresholds.get('icmp_flood_rate', ICMP_FLOOD_RATE),
+            thresholds.get('flood_window_seconds', FLOOD_WINDOW)
+        ),
+    }
@@ -0,0 +1,249 @@
+# timeline.py
+"""
+Multi-resolution traffic timelines from the packet table.
+
+Timestamps stay int64 nanoseconds throughout: each packet's bucket at the
+finest resolution is one integer division, packets, bytes and per-protocol
+packets per bucket are np.bincount sums, and every coarser resolution is
+rolled up from those buckets rather than from the packets again. Buckets
+are aligned to the epoch, so 1-minute buckets start on the minute. The
+input DataFrame is never modified.
+
+Spikes are buckets whose packet count is far above the median in units of
+the median absolute deviation, so a few huge bursts cannot hide each
+other the way they inflate a mean and standard deviation.
+"""
+
+import numpy as np
+import pandas as pd
+
+from fast_dissector import NS_PER_SECOND
+from volume_stats import MAD_SCALE
+
+# 1 second, 10 seconds, 1 minute and 1 hour
+RESOLUTIONS = (1, 10, 60, 3600)
+
+# Makes the mean absolute deviation comparable to a standard deviation
+_MEAN_AD_SCALE = 1.2533
+
+# Finest buckets TimelineBuilder collects before merging them
+_MERGE_BUCKETS = 65536
+
+
+def spike_mask(values, factor=3.5):
+    """
+    Values more than factor robust standard deviations above the median.
+
+    The scale is the MAD, or the mean absolute deviation when more than
+    half of the values are equal (MAD 0); constant series have no spikes.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 3:
+        return np.zeros(len(values), dtype=bool)
+    median = np.median(values)
+    deviations = np.abs(values - median)
+    scale = MAD_SCALE * np.median(deviations)
+    if scale == 0:
+        scale = _MEAN_AD_SCALE * deviations.mean()
+    if scale == 0:
+        return np.zeros(len(values), dtype=bool)
+    return values > median + factor * scale
+
+
+class Timeline:
+    """
+    Packets, bytes and per-protocol packets per bucket of one resolution.
+
+    starts_ns holds the bucket start times. Only buckets with traffic are
+    stored; filled() adds the empty ones. protocol_packets has one column
+    per name in protocols.
+    """
+
+    def __init__(self, step_ns, starts_ns, packets, bytes_, protocol_packets, protocols):
+        self.step_ns = step_ns
+        self.starts_ns = starts_ns
+        self.packets = packets
+        self.bytes = bytes_
+        self.protocol_packets = protocol_packets
+        self.protocols = protocols
+
+    @property
+    def resolution(self):
+        """Bucket size in seconds"""
+        return self.step_ns / NS_PER_SECOND
+
+    def __len__(self):
+        return len(self.starts_ns)
+
+    def span(self):
+        """Number of buckets from the first to the last one with traffic"""
+        if not len(self.starts_ns):
+            return 0
+        return int((self.starts_ns[-1] - self.starts_ns[0]) // self.step_ns) + 1
+
+    def filled(self, max_buckets=1000000):
+        """Copy with the empty buckets included, unless there would be more than max_buckets"""
+        span = self.span()
+        if span == len(self.starts_ns) or span > max_buckets:
+            return self
+        index = (self.starts_ns - self.starts_ns[0]) // self.step_ns
+        packets = np.zeros(span, dtype=self.packets.dtype)
+        packets[index] = self.packets
+        bytes_ = np.zeros(span, dtype=self.bytes.dtype)
+        bytes_[index] = self.bytes
+        protocol_packets = np.zeros((span, len(self.protocols)), dtype=self.protocol_packets.dtype)
+        protocol_packets[index] = self.protocol_packets
+        starts_ns = self.starts_ns[0] + np.arange(span, dtype=np.int64) * self.step_ns
+        return Timeline(self.step_ns, starts_ns, packets, bytes_, protocol_packets, self.protocols)
+
+    def times(self):
+        """Bucket start times as a DatetimeIndex"""
+        return pd.to_datetime(self.starts_ns, unit='ns')
+
+    def protocol_series(self, protocol):
+        return self.protocol_packets[:, self.protocols.index(protocol)]
+
+    def spikes(self, factor=3.5):
+        """Boolean mask of the buckets whose packet count is a spike"""
+        return spike_mask(self.packets, factor)
+
+    def to_records(self, factor=3.5):
+        """[{time, packets, bytes, is_spike}] per bucket"""
+        spikes = self.spikes(factor)
+        return [
+            {'time': time, 'packets': int(packets), 'bytes': int(bytes_), 'is_spike': bool(spike)}
+            for time, packets, bytes_, spike in zip(self.times(), self.packets, self.bytes, spikes)
+        ]
+
+
+def _steps(resolutions):
+    steps = {int(round(resolution * NS_PER_SECOND)): resolution for resolution in resolutions}
+    ordered = sorted(steps)
+    if any(step % ordered[0] for step in ordered):
+        raise ValueError("Timeline resolutions must be multiples of the finest resolution")
+    return steps, ordered
+
+
+class TimelineBuilder:
+    """
+    Timelines of a packet table fed batch by batch in capture order, e.g.
+    the DataFrames of parse_packet_batches.
+
+    Each batch is reduced to its occupied finest buckets, and those are
+    merged as they pile up, so memory follows the active buckets rather
+    than the packets. timelines() gives the same result as
+    build_timelines() on the concatenated batches.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.steps, self.ordered = _steps(resolutions)
+        self.first_ns = None
+        self.names = []
+        self._name_columns = {}
+        self._merged = None
+        self._pending = []
+        self._pending_buckets = 0
+
+    def add(self, df):
+        if df.empty:
+            return
+        finest = self.ordered[0]
+        timestamps = df['timestamp_ns'].to_numpy()
+        first = int(timestamps.min())
+        self.first_ns = first if self.first_ns is None else min(self.first_ns, first)
+        buckets, inverse = np.unique(timestamps // finest, return_inverse=True)
+
+        protocols = df['main_protocol'].astype('category')
+        codes = protocols.cat.codes.to_numpy().astype(np.int64)
+        names = list(protocols.cat.categories)
+        count = len(buckets)
+        packets = np.bincount(inverse, minlength=count)
+        bytes_ = np.bincount(inverse, weights=df['length'].to_numpy(), minlength=count).astype(np.int64)
+        protocol_packets = np.bincount(inverse * len(names) + codes,
+                                       minlength=count * len(names)).reshape(count, len(names))
+        present = protocol_packets.sum(axis=0) > 0
+        columns = [self._name_column(name) for name, kept in zip(names, present) if kept]
+        self._pending.append((buckets, packets, bytes_, protocol_packets[:, present], columns))
+        self._pending_buckets += count
+        # Merging once the new buckets outnumber the merged ones keeps it amortized linear
+        if self._pending_buckets > max(_MERGE_BUCKETS, 0 if self._merged is None else len(self._merged[0])):
+            self._merge()
+
+    def _name_column(self, name):
+        column = self._name_columns.get(name)
+        if column is None:
+            column = self._name_columns[name] = len(self.names)
+            self.names.append(name)
+        return column
+
+    def _merge(self):
+        parts = ([] if self._merged is None else [self._merged + (list(range(self._merged[3].shape[1])),)])
+        parts += self._pending
+        self._pending = []
+        self._pending_buckets = 0
+        if not parts:
+            return
+        buckets = np.concatenate([part[0] for part in parts])
+        protocol_packets = np.zeros((len(buckets), len(self.names)), dtype=np.int64)
+        row = 0
+        for part in parts:
+            protocol_packets[row:row + len(part[0]), part[4]] = part[3]
+            row += len(part[0])
+        order = np.argsort(buckets, kind='stable')
+        buckets = buckets[order]
+        runs = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        self._merged = (
+            buckets[runs],
+            np.add.reduceat(np.concatenate([part[1] for part in parts])[order], runs),
+            np.add.reduceat(np.concatenate([part[2] for part in parts])[order], runs),
+            np.add.reduceat(protocol_packets[order], runs, axis=0),
+        )
+
+    def timelines(self):
+        """{resolution: Timeline} of every batch added"""
+        self._merge()
+        if self._merged is None:
+            return {}
+        ordered = self.ordered
+        finest = ordered[0]
+        buckets, packets, bytes_, protocol_packets = self._merged
+        origin = self.first_ns // ordered[-1] * ordered[-1]
+        # origin is a multiple of finest, so this is (timestamp - origin) // finest
+        occupied = buckets - origin // finest
+
+        timelines = {}
+        for step in ordered:
+            # Buckets are sorted, so each coarser bucket is a run of finer ones
+            parents = occupied // (step // finest)
+            runs = np.flatnonzero(np.concatenate(([True], parents[1:] != parents[:-1])))
+            timelines[self.steps[step]] = Timeline(
+                step,
+                origin + parents[runs] * step,
+                np.add.reduceat(packets, runs),
+                np.add.reduceat(bytes_, runs),
+                np.add.reduceat(protocol_packets, runs, axis=0),
+                list(self.names)
+            )
+        return timelines
+
+
+def build_timelines(df, resolutions=RESOLUTIONS):
+    """
+    Timelines of the packet table at each resolution (seconds), as
+    {resolution: Timeline}. Every resolution must be a multiple of the
+    finest one.
+    """
+    builder = TimelineBuilder(resolutions)
+    builder.add(df)
+    return builder.timelines()
+
+
+def chart_timeline(timelines, max_points=2000):
+    """The finest timeline that fits in max_points buckets, filled, for charts"""
+    for resolution in sorted(timelines):
+        timeline = timelines[resolution]
+        if timeline.span() <= max_points:
+            return timeline.filled()
+    if not timelines:
+        return None
+    return timelines[max(timelines)].filled(max_points)
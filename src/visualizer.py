@@ -7,6 +7,10 @@ import plotly.express as px
 import networkx as nx
 import os
 from collections import Counter
+import pandas as pd
+
+from sketches import TalkerSketch
+from timeline import build_timelines, chart_timeline
 
 def create_protocol_pie_chart(protocol_counter, output_dir="reports/visualizations"):
     """Create a pie chart showing protocol distribution"""
@@ -90,7 +94,8 @@ def create_top_talkers_chart(ip_traffic_counter, top_n=15, output_dir="reports/v
     
     fig.update_layout(
         title={
-            'text': f'👥 Top {top_n} Talkers by Traffic Volume',
+            'text': f'👥 Top {top_n} Talkers by Traffic Volume'
+                    + (' (estimated)' if isinstance(ip_traffic_counter, TalkerSketch) else ''),
             'x': 0.5,
             'xanchor': 'center',
             'font': {'size': 20, 'color': '#2c3e50'}
@@ -119,17 +124,32 @@ def create_top_talkers_chart(ip_traffic_counter, top_n=15, output_dir="reports/v
         print(f"⚠ Could not save PNG: {e}")
 
 
-def create_packet_size_distribution(df, output_dir="reports/visualizations"):
-    """Create histogram of packet sizes"""
+def packet_size_counts(df):
+    """{packet length: packets} of a packet table, the input of create_packet_size_distribution"""
+    counts = df['length'].value_counts(sort=False)
+    return {int(length): int(count) for length, count in counts.items()}
+
+
+def ip_pair_counts(df):
+    """{(src_ip, dst_ip): packets} of a packet table, the input of create_traffic_heatmap"""
+    df_filtered = df[(df['src_ip'] != '') & (df['dst_ip'] != '')]
+    counts = df_filtered.groupby(['src_ip', 'dst_ip'], observed=True, sort=False).size()
+    return {(str(src), str(dst)): int(count) for (src, dst), count in counts.items()}
+
+
+def create_packet_size_distribution(size_counts, output_dir="reports/visualizations"):
+    """Create histogram of packet sizes from {packet length: packets}"""
     os.makedirs(output_dir, exist_ok=True)
     
-    if df.empty or 'length' not in df.columns:
+    if not size_counts:
         print("⚠ No packet size data to visualize")
         return
     
     fig = go.Figure(data=[
         go.Histogram(
-            x=df['length'],
+            x=list(size_counts),
+            y=list(size_counts.values()),
+            histfunc='sum',
             nbinsx=50,
             marker=dict(
                 color='#3498db',
@@ -232,23 +252,17 @@ def create_protocol_comparison(main_proto_counter, full_proto_counter, output_di
     print(f"✓ Protocol comparison chart saved to {output_file}")
 
 
-def create_traffic_heatmap(df, output_dir="reports/visualizations"):
-    """Create heatmap showing traffic between source and destination IPs"""
+def create_traffic_heatmap(pair_counts, output_dir="reports/visualizations"):
+    """Create heatmap showing traffic between source and destination IPs, from ip_pair_counts()"""
     os.makedirs(output_dir, exist_ok=True)
     
-    if df.empty or 'src_ip' not in df.columns or 'dst_ip' not in df.columns:
-        print("⚠ No IP data to create heatmap")
-        return
-    
-    # Filter out empty IPs
-    df_filtered = df[(df['src_ip'] != '') & (df['dst_ip'] != '')]
-    
-    if df_filtered.empty:
+    if not pair_counts:
         print("⚠ No valid IP pairs for heatmap")
         return
     
     # Create pivot table
-    traffic_matrix = df_filtered.groupby(['src_ip', 'dst_ip']).size().reset_index(name='count')
+    traffic_matrix = pd.DataFrame([(src, dst, count) for (src, dst), count in pair_counts.items()],
+                                  columns=['src_ip', 'dst_ip', 'count'])
     
     # Get top IPs
     top_src = traffic_matrix.groupby('src_ip')['count'].sum().nlargest(10).index.tolist()
@@ -294,18 +308,93 @@ def create_traffic_heatmap(df, output_dir="reports/visualizations"):
     print(f"✓ Traffic heatmap saved to {output_file}")
 
 
+def create_traffic_timeline(timelines, top_protocols=8, output_dir="reports/visualizations"):
+    """Create packets and bytes over time from timeline rollups, stacked by protocol"""
+    os.makedirs(output_dir, exist_ok=True)
+    
+    timeline = chart_timeline(timelines)
+    if timeline is None or not len(timeline):
+        print("⚠ No timing data to create timeline")
+        return
+    
+    times = timeline.times()
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.08,
+        subplot_titles=('Packets by Protocol', 'Bytes')
+    )
+    
+    # Stack the largest protocols, the rest as one band
+    order = timeline.protocol_packets.sum(axis=0).argsort()[::-1]
+    for column in order[:top_protocols]:
+        fig.add_trace(go.Scatter(
+            x=times, y=timeline.protocol_packets[:, column],
+            name=timeline.protocols[column],
+            mode='lines', stackgroup='packets',
+            hovertemplate='%{x}<br>Packets: %{y}<extra></extra>'
+        ), row=1, col=1)
+    if len(order) > top_protocols:
+        fig.add_trace(go.Scatter(
+            x=times, y=timeline.protocol_packets[:, order[top_protocols:]].sum(axis=1),
+            name='Other',
+            mode='lines', stackgroup='packets',
+            hovertemplate='%{x}<br>Packets: %{y}<extra></extra>'
+        ), row=1, col=1)
+    
+    spikes = timeline.spikes()
+    if spikes.any():
+        fig.add_trace(go.Scatter(
+            x=times[spikes], y=timeline.packets[spikes],
+            name='Spike', mode='markers',
+            marker=dict(color='#e74c3c', size=10, symbol='diamond'),
+            hovertemplate='%{x}<br>Spike: %{y} packets<extra></extra>'
+        ), row=1, col=1)
+    
+    fig.add_trace(go.Scatter(
+        x=times, y=timeline.bytes,
+        name='Bytes', mode='lines',
+        line=dict(color='#2c3e50'),
+        hovertemplate='%{x}<br>Bytes: %{y:,}<extra></extra>'
+    ), row=2, col=1)
+    
+    fig.update_layout(
+        title={
+            'text': f'⏱️ Traffic Timeline ({timeline.resolution:g}s buckets)',
+            'x': 0.5,
+            'xanchor': 'center',
+            'font': {'size': 20, 'color': '#2c3e50'}
+        },
+        height=700,
+        paper_bgcolor='#f8f9fa'
+    )
+    
+    # Save
+    output_file = os.path.join(output_dir, "traffic_timeline.html")
+    fig.write_html(output_file)
+    print(f"✓ Traffic timeline saved to {output_file}")
+
+
 def generate_all_visualizations(df, main_proto_counter, full_proto_counter, 
-                               ip_traffic_counter, output_dir="reports/visualizations"):
-    """Generate all visualizations at once"""
+                               ip_traffic_counter, output_dir="reports/visualizations",
+                               timelines=None, size_counts=None, pair_counts=None):
+    """
+    Generate all visualizations at once. The timelines, packet sizes and
+    IP pairs are taken from df when not given, so df may be None when
+    all three are (see batch_reports.py).
+    """
     print("\n" + "="*70)
     print("🎨 GENERATING VISUALIZATIONS")
     print("="*70)
     
     create_protocol_pie_chart(main_proto_counter, output_dir)
     create_top_talkers_chart(ip_traffic_counter, top_n=15, output_dir=output_dir)
-    create_packet_size_distribution(df, output_dir)
+    create_packet_size_distribution(packet_size_counts(df) if size_counts is None else size_counts,
+                                    output_dir)
     create_protocol_comparison(main_proto_counter, full_proto_counter, output_dir)
-    create_traffic_heatmap(df, output_dir)
+    create_traffic_heatmap(ip_pair_counts(df) if pair_counts is None else pair_counts, output_dir)
+    create_traffic_timeline(build_timelines(df) if timelines is None else timelines,
+                            output_dir=output_dir)
     
     print("="*70)
     print(f"✅ All visualizations saved to '{output_dir}/' directory")
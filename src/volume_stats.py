@@ -0,0 +1,206 @@
+# volume_stats.py
+"""
+Fixed-memory statistics over per-IP traffic volume.
+
+VolumeSketch is a relative-error quantile sketch (logarithmic buckets, as
+in DDSketch) combined with exact running moments. Its size depends on the
+value range and the accuracy, never on the number of hosts, and two
+sketches merge by adding their buckets.
+
+SuspiciousTrafficMonitor flags IPs during ingestion, as soon as their
+volume crosses the adaptive threshold. It keeps the running per-IP totals
+in a TalkerSketch, so its memory is bounded too.
+"""
+
+import math
+
+from sketches import TalkerSketch
+
+THRESHOLD_METHODS = ("static", "mean", "percentile", "mad")
+
+# Makes the median absolute deviation comparable to a standard deviation
+MAD_SCALE = 1.4826
+
+
+class VolumeSketch:
+    """
+    Quantiles, mean and variance of a multiset of non-negative volumes.
+
+    Quantiles are within relative_accuracy of the true value; count,
+    mean and variance are exact.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+
+    @classmethod
+    def from_values(cls, values, relative_accuracy=0.01):
+        sketch = cls(relative_accuracy)
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _bucket_value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _adjust(self, value, count):
+        if value <= 0:
+            self.zero_count += count
+            return
+        key = self._key(value)
+        remaining = self.buckets.get(key, 0) + count
+        if remaining:
+            self.buckets[key] = remaining
+        else:
+            del self.buckets[key]
+
+    def add(self, value, count=1):
+        self._adjust(value, count)
+        self.count += count
+        self.total += value * count
+        self.total_squares += value * value * count
+
+    def remove(self, value, count=1):
+        self.add(value, -count)
+
+    def merge(self, other):
+        """Add the contents of another sketch with the same accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return (self.total_squares - self.total * self.total / self.count) / (self.count - 1)
+
+    def _sorted_values(self):
+        """(value, count) pairs in ascending order"""
+        values = [(0.0, self.zero_count)] if self.zero_count else []
+        values.extend((self._bucket_value(key), self.buckets[key]) for key in sorted(self.buckets))
+        return values
+
+    @staticmethod
+    def _weighted_quantile(values, q):
+        rank = q * (sum(count for _value, count in values) - 1)
+        seen = 0
+        for value, count in values:
+            seen += count
+            if seen > rank:
+                return value
+        return values[-1][0] if values else 0.0
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1) of the volumes"""
+        return self._weighted_quantile(self._sorted_values(), q)
+
+    def mad(self):
+        """Approximate median absolute deviation from the median"""
+        values = self._sorted_values()
+        median = self._weighted_quantile(values, 0.5)
+        deviations = sorted((abs(value - median), count) for value, count in values)
+        return self._weighted_quantile(deviations, 0.5)
+
+    def threshold(self, method, threshold=1048576, factor=2, percentile=99.0):
+        """
+        Volume above which an IP is suspicious:
+
+        - static: threshold bytes
+        - mean: factor times the mean volume
+        - percentile: the given percentile of the volumes
+        - mad: factor scaled MADs above the median
+        """
+        if method == "static":
+            return threshold
+        if method == "mean":
+            return self.mean * factor
+        if method == "percentile":
+            return self.quantile(percentile / 100)
+        if method == "mad":
+            return self.quantile(0.5) + factor * MAD_SCALE * self.mad()
+        raise ValueError(f"Unknown threshold method: {method}")
+
+
+class SuspiciousTrafficMonitor:
+    """
+    Flag IPs during ingestion whose volume crosses the adaptive threshold.
+
+    observe() is called once per batch with the bytes each IP sent or
+    received in the batch. The threshold is recomputed after every batch;
+    adaptive methods wait until min_hosts IPs have been seen. Each IP is
+    reported once, through on_alert(ip, total_bytes, threshold) if given.
+
+    Running totals are kept in a TalkerSketch of capacity IPs. Up to
+    capacity hosts, totals and thresholds are exact. Beyond that only the
+    IPs the sketch keeps are candidates (every IP above total / capacity
+    bytes among them), and one is flagged only once its guaranteed bytes
+    (estimate minus error) cross the threshold. The mean threshold stays
+    exact up to the HyperLogLog host count, while the percentile and MAD
+    thresholds count every dropped IP at the sketch's floor, an upper
+    bound on its volume.
+    """
+
+    def __init__(self, method="static", threshold=1048576, factor=2, percentile=99.0,
+                 min_hosts=10, capacity=1000, on_alert=None):
+        if method not in THRESHOLD_METHODS:
+            raise ValueError(f"Unknown threshold method: {method}")
+        self.method = method
+        self.settings = {"threshold": threshold, "factor": factor, "percentile": percentile}
+        self.min_hosts = min_hosts
+        self.on_alert = on_alert
+        self.totals = TalkerSketch(capacity=capacity)
+        self.flagged = {}
+
+    def host_count(self):
+        """Number of IPs seen so far (estimated once the sketch is full)"""
+        if not self.totals.floor:
+            return len(self.totals.counts)
+        return max(len(self.totals), len(self.totals.counts))
+
+    def threshold(self):
+        """Current volume above which an IP is flagged"""
+        if self.method == "static":
+            return self.settings["threshold"]
+        hosts = self.host_count()
+        if self.method == "mean":
+            return self.totals.total() / hosts * self.settings["factor"] if hosts else 0.0
+        sketch = VolumeSketch.from_values(self.totals.counts.values())
+        dropped = hosts - len(self.totals.counts)
+        if dropped > 0:
+            sketch.add(self.totals.floor, dropped)
+        return sketch.threshold(self.method, **self.settings)
+
+    def observe(self, batch_bytes):
+        """Account for one batch of per-IP bytes"""
+        self.totals.update(batch_bytes)
+        if self.method != "static" and self.host_count() < self.min_hosts:
+            return
+        current = self.threshold()
+        for ip in batch_bytes:
+            if ip in self.flagged or ip not in self.totals:
+                continue
+            total = self.totals[ip]
+            if total - self.totals.errors[ip] > current:
+                self.flagged[ip] = (total, current)
+                if self.on_alert is not None:
+                    self.on_alert(ip, total, current)